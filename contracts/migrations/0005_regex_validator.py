@@ -0,0 +1,35 @@
+# Generated by Django 5.2.10 on 2026-10-18 23:43
+
+import utils.bsparsers.pg_regex
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contracts", "0004_alter_contracts_regex"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cfitemauto",
+            name="regex",
+            field=models.CharField(
+                blank=True,
+                max_length=500,
+                null=True,
+                validators=[utils.bsparsers.pg_regex.validate_rule_regex],
+                verbose_name="RegEx",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="contracts",
+            name="regex",
+            field=models.TextField(
+                blank=True,
+                null=True,
+                validators=[utils.bsparsers.pg_regex.validate_rule_regex],
+                verbose_name="RegEx",
+            ),
+        ),
+    ]
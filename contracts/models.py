@@ -7,6 +7,8 @@ from django.conf import settings
 import os
 from django.utils.text import slugify
 
+from utils.bsparsers.pg_regex import validate_rule_regex
+
 
 
 # Модели договоров.
@@ -50,7 +52,7 @@ class Contracts(models.Model):
         # limit_choices_to={'groups__name': 'Подразделение'}
     )
     is_signed = models.BooleanField(verbose_name='Подписан',null=True,blank=True)
-    regex =  models.TextField(verbose_name='RegEx',null=True,blank=True)
+    regex =  models.TextField(verbose_name='RegEx',null=True,blank=True,validators=[validate_rule_regex])
     
     class Meta:
         verbose_name = "Договор"
@@ -113,7 +115,7 @@ class ContractFiles(models.Model):
 
 class CfItemAuto(models.Model):
     contract = models.ForeignKey(Contracts,on_delete=models.CASCADE,verbose_name='Договор')
-    regex =  models.CharField(max_length=500,verbose_name='RegEx',null=True,blank=True)
+    regex =  models.CharField(max_length=500,verbose_name='RegEx',null=True,blank=True,validators=[validate_rule_regex])
     defaultcfdt = models.ForeignKey(CfItems,on_delete=models.CASCADE, verbose_name='Статья CF по дефолту для Дт',null=True,blank=True,related_name="contracts_default_dt", )
     defaultcfcr = models.ForeignKey(CfItems,on_delete=models.CASCADE, verbose_name='Статья CF по дефолту для Кт',null=True,blank=True,related_name="contracts_default_cr", )
     
@@ -4,9 +4,9 @@ from django.http import JsonResponse
 from django.urls import path
 from django.db.models import F, Value, DecimalField, ExpressionWrapper
 import csv
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.contrib import admin, messages
-from django.db.models import Sum, Count
+from django.db.models import Sum
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.html import format_html
@@ -14,12 +14,23 @@ from django.utils.safestring import mark_safe
 from django.db.models.functions import Coalesce
 
 from datetime import datetime
+import time
 from django.db.models import Q
 from django.contrib.admin import SimpleListFilter
 from django import forms
 from contracts.models import Contracts
-from .models import BankStatements, CfData, CfSplits,ContractsRexex
-from utils.bsparsers.bsupdater import update_cf_data
+from corporate.models import BankAccount, Owners
+from django.db.models import OuterRef, Subquery
+from django.template.response import TemplateResponse
+from .models import BankStatements, CfData, CfSplits,ContractsRexex, StatementJob, IntercompanyRule, ImportRun, IntercompanyMatch
+from treasury.services.statement_jobs import enqueue_statements, run_statement
+from treasury.services.import_runs import import_trends
+from treasury.services.eod import eod_balances
+from treasury.services.consolidation import consolidate_balances
+from treasury.services.statement_quality import refresh_statement_quality
+from treasury.services.data_version import bump_data_version
+from treasury.services.cf_pivot import MEASURES, get_pivot
+from treasury.services.cfitem_tree import cfitem_paths
 from decimal import Decimal
 
 
@@ -56,6 +67,17 @@ def badge(text, tone="slate"):
     
 
 
+class EchoBuffer:
+    """Псевдо-файл для csv.writer: writerow() возвращает готовую строку (для StreamingHttpResponse)."""
+
+    def write(self, value):
+        return value
+
+
+# Строк CfData за один fetch при потоковой выгрузке CSV
+CSV_CHUNK_SIZE = 2_000
+
+
 RU_MONTHS_SHORT = {
     1: "янв",  2: "фев",  3: "мар",  4: "апр",
     5: "май",  6: "июн",  7: "июл",  8: "авг",
@@ -107,6 +129,32 @@ class CfDataInline(admin.TabularInline):
 
 
 
+class ImportRunInline(admin.TabularInline):
+    """История загрузок выписки: время, строки, SQL, память."""
+    model = ImportRun
+    extra = 0
+    can_delete = False
+    fields = ("started_at", "format", "status", "seconds", "docs", "skipped", "inserted", "updated",
+              "cache_hits", "stage_times", "queries", "query_seconds", "peak_memory_mb", "error_short")
+    readonly_fields = fields
+    verbose_name_plural = "История загрузок"
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Этапы, с")
+    def stage_times(self, obj):
+        order = [stage for stage, _ in StatementJob.STAGES]
+        stages = sorted(obj.stages.items(), key=lambda item: order.index(item[0]) if item[0] in order else len(order))
+        return " · ".join(f"{stage} {data['seconds']:.2f}" for stage, data in stages) or "—"
+
+    @admin.display(description="Ошибка")
+    def error_short(self, obj):
+        if not obj.error:
+            return "—"
+        return obj.error.strip().splitlines()[-1][:200]
+
+
 class CfSplitsInline(admin.TabularInline):
     model = CfSplits
     extra = 0
@@ -171,6 +219,31 @@ class InPeriodDateFilter(SimpleListFilter):
         except ValueError:
             return queryset
         return queryset.filter(start__lte=d, finish__gte=d)
+
+
+class SelectRelatedFilter(admin.RelatedFieldListFilter):
+    """
+    Фильтр по FK, у которого str() объекта лезет в связанные модели:
+    подтягиваем их сразу (select_related), а не запросом на каждый вариант.
+    """
+    select_related = ()
+
+    def field_choices(self, field, request, model_admin):
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        objs = field.related_model.objects.select_related(*self.select_related).order_by(*ordering)
+        return [(obj.pk, str(obj)) for obj in objs]
+
+
+class BankAccountFilter(SelectRelatedFilter):
+    select_related = ("bank",)
+
+
+class ContractFilter(SelectRelatedFilter):
+    select_related = ("cp", "title")
+
+
+class StatementFilter(SelectRelatedFilter):
+    select_related = ("owner", "ba", "ba__bank")
     
 
 
@@ -179,6 +252,7 @@ class BankStatementsAdmin(admin.ModelAdmin):
     change_form_template = "admin/services/migrations/change_form.html"
     change_list_template = "admin/treasury/bankstatements/change_list.html"
     # inlines = [CfDataInline]
+    inlines = [ImportRunInline]
 
 
     list_display = (
@@ -190,14 +264,15 @@ class BankStatementsAdmin(admin.ModelAdmin):
         "eb_pretty",
         "uploaded_at_short",
         "quality_badge",
+        "job_badge",
     )
     list_display_links = ("period",)
     search_fields = ("owner__name", "ba__account", "ba__bank__name")
-    list_filter = ("owner", "ba", "uploaded_at", InPeriodDateFilter)
+    list_filter = ("owner", ("ba", BankAccountFilter), "uploaded_at", InPeriodDateFilter)
     # date_hierarchy = "uploaded_at"
   
     ordering = ("-uploaded_at",)
-    list_select_related = ("owner", "ba")
+    list_select_related = ("owner", "ba", "ba__bank")
 
     fieldsets = (
         ("📄 Файл выписки", {"fields": ("file",)}),
@@ -238,11 +313,21 @@ class BankStatementsAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.process_selected_view),
                 name="treasury_bankstatements_process_selected",
             ),
+            path(
+                "jobs-status/",
+                self.admin_site.admin_view(self.jobs_status_view),
+                name="treasury_bankstatements_jobs_status",
+            ),
             path(
                 "export-eod-xlsx/",
                 self.admin_site.admin_view(export_eod_xlsx),
                 name="treasury_bankstatements_export_eod_xlsx",
             ),
+            path(
+                "import-runs/",
+                self.admin_site.admin_view(self.import_runs_view),
+                name="treasury_bankstatements_import_runs",
+            ),
 
         ]
         return custom_urls + urls
@@ -275,39 +360,74 @@ class BankStatementsAdmin(admin.ModelAdmin):
             messages.warning(request, "Не удалось прочитать выбранные id.")
             return redirect(request.META.get("HTTP_REFERER", ".."))
 
-        qs = BankStatements.objects.filter(pk__in=ids).select_related("ba", "owner")
+        # обработку делает воркер (manage.py process_statements), здесь только ставим в очередь
+        queued, skipped = enqueue_statements(ids)
 
-        ok = 0
-        bad = 0
-        for obj in qs:
-            try:
-                if not obj.file:
-                    bad += 1
-                    continue
-                result = update_cf_data(obj.file.path, obj.pk)
-                # можно либо копить результаты, либо показывать кратко
-                ok += 1
-            except Exception as e:
-                bad += 1
-
-        if ok:
-            messages.success(request, f"Обработано выписок: {ok}")
-        if bad:
-            messages.error(request, f"Ошибок/пропусков: {bad} (нет файла или ошибка обработки).")
+        if queued:
+            messages.success(request, f"Поставлено в очередь выписок: {queued}")
+        if skipped:
+            messages.warning(request, f"Пропущено: {skipped} (нет файла или уже в очереди).")
 
         # вернуть обратно на changelist с теми же фильтрами
         return redirect(request.META.get("HTTP_REFERER", ".."))
 
 
 
+    def jobs_status_view(self, request):
+        """
+        Состояние последних задач по выпискам: ?ids=1,2,3
+        Changelist опрашивает, пока есть активные задачи.
+        """
+        ids = [int(x) for x in (request.GET.get("ids") or "").split(",") if x.strip().isdigit()]
+
+        jobs = {}
+        for job in StatementJob.objects.filter(bs_id__in=ids).order_by("bs_id", "-id").distinct("bs_id"):
+            jobs[job.bs_id] = {
+                "status": job.status,
+                "stage": job.stage,
+                "active": job.is_active,
+                "html": self._job_badge_html(job.status, job.stage, job.error),
+            }
+
+        return JsonResponse({"jobs": jobs})
+
+    def import_runs_view(self, request):
+        """Скорость загрузки выписок по форматам и размерам: ?days=90"""
+        days = request.GET.get("days", "")
+        days = int(days) if days.isdigit() else 90
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Скорость загрузки выписок",
+            "days": days,
+            "trends": import_trends(days),
+            "failed": (
+                ImportRun.objects.filter(status=ImportRun.FAILED)
+                .select_related("bs", "bs__ba")[:20]
+            ),
+        }
+        return TemplateResponse(request, "admin/treasury/bankstatements/import_runs.html", context)
+
     def get_queryset(self, request):
         qs = super().get_queryset(request)
+
+        last_job = StatementJob.objects.filter(bs_id=OuterRef("pk")).order_by("-id")
+
+        # строки и обороты — из сводки StatementQuality (LEFT JOIN), без прохода по CfData
         return (
-            qs.select_related("owner", "ba")
+            qs.select_related("owner", "ba", "ba__bank")
               .annotate(
-                  dt_sum=Sum("cfdata__dt"),
-                  cr_sum=Sum("cfdata__cr"),
-                  rows=Count("cfdata", distinct=True),
+                  dt_sum=F("quality__dt"),
+                  cr_sum=F("quality__cr"),
+                  rows=Coalesce(F("quality__rows"), 0),
+                  missing_contract=F("quality__missing_contract"),
+                  missing_cfitem=F("quality__missing_cfitem"),
+                  missing_cp_final=F("quality__missing_cp_final"),
+                  missing_cnt=F("quality__missing_any"),
+                  job_status=Subquery(last_job.values("status")[:1]),
+                  job_stage=Subquery(last_job.values("stage")[:1]),
+                  job_error=Subquery(last_job.values("error")[:1]),
               )
         )
     
@@ -503,40 +623,21 @@ class BankStatementsAdmin(admin.ModelAdmin):
         # ✅ ТВОЯ ТЕКУЩАЯ ЛОГИКА EOD (только если выбрана дата)
         # =========================================================
         if selected_date:
-            bss = (
-                BankStatements.objects
-                .filter(start__lte=selected_date, finish__gte=selected_date)
-                .select_related("owner", "ba", "ba__bank")
-            )
-
-            # ✅ используем уже прочитанные owner_id / ba_id (не читаем повторно)
-            if owner_id:
-                bss = bss.filter(owner_id=owner_id)
-            if ba_id:
-                bss = bss.filter(ba_id=ba_id)
+            # остатки по дням (DailyBalance): по одной строке на счёт, опорная выписка — в bs
+            balances = eod_balances(selected_date, owner_id=owner_id, ba_id=ba_id)
 
             blocks = []
 
             # --- итоги по валютам ---
             totals_by_ccy = {}  # code -> {"dt": Decimal, "cr": Decimal, "eod": Decimal, "cnt": int}
 
-            for bs in bss:
-                agg = (
-                    CfData.objects
-                    .filter(bs=bs, date__lte=selected_date)
-                    .aggregate(
-                        dt=Coalesce(Sum("dt"), Decimal("0.00")),
-                        cr=Coalesce(Sum("cr"), Decimal("0.00")),
-                    )
-                )
-
-                dt_sum = agg["dt"] or Decimal("0.00")
-                cr_sum = agg["cr"] or Decimal("0.00")
-
-                bb = bs.bb if bs.bb is not None else Decimal("0.00")
-                eod = bb + dt_sum - cr_sum
+            for balance in balances:
+                bs = balance.bs
+                dt_sum = balance.period_dt
+                cr_sum = balance.period_cr
+                eod = balance.closing
 
-                ba = bs.ba
+                ba = balance.ba
                 bank = getattr(ba, "bank", None) if ba else None
 
                 bank_name = (getattr(bank, "name", None) or "").strip()
@@ -544,7 +645,7 @@ class BankStatementsAdmin(admin.ModelAdmin):
                 owner_name = str(bs.owner) if bs.owner else ""
 
                 # валюта счета
-                code = (getattr(ba, "currency", None) or "").upper() if ba else ""
+                code = (balance.currency or "").upper()
                 sym = CURRENCY_SYMBOLS.get(code, "") if code else ""
                 flag = CURRENCY_FLAGS.get(code, "") if code else ""
 
@@ -595,6 +696,10 @@ class BankStatementsAdmin(admin.ModelAdmin):
             totals_list.sort(key=lambda x: (x["currency_code"] == "—", x["currency_code"]))
             extra_context["totals_by_ccy"] = totals_list
 
+            # несколько валют — общий итог в рублях по курсам ЦБ (macro.CurrencyRate)
+            if len(totals_list) > 1:
+                extra_context["consolidated"] = consolidate_balances(balances, selected_date)
+
             # для обратной совместимости: если валюта одна — оставим total_* как раньше
             if len(totals_list) == 1:
                 only = totals_list[0]
@@ -650,21 +755,16 @@ class BankStatementsAdmin(admin.ModelAdmin):
 
         # Если выписка ещё не обработана (нет строк)
         rows = getattr(obj, "rows", None)
-        if rows is not None and rows == 0:
+        if not rows:
             return badge("⏳ не обработано", "amber")
 
-        # Считаем «плохие» строки (хотя бы одно из полей пустое)
-        base = CfData.objects.filter(bs_id=obj.pk)
-
-        missing_contract = base.filter(contract__isnull=True).count()
-        missing_cfitem = base.filter(cfitem__isnull=True).count()
-        missing_cp_final = base.filter(cp_final__isnull=True).count()
-
-        missing_any = base.filter(
-            Q(contract__isnull=True) | Q(cfitem__isnull=True) | Q(cp_final__isnull=True)
-        ).count()
+        # счётчики — из сводки StatementQuality (аннотации get_queryset)
+        missing_contract = obj.missing_contract or 0
+        missing_cfitem = obj.missing_cfitem or 0
+        missing_cp_final = obj.missing_cp_final or 0
+        missing_any = obj.missing_cnt or 0
 
-        if missing_any == 0 and base.exists():
+        if missing_any == 0:
             return format_html(
                 '<div style="display:inline-flex;align-items:center;gap:8px;">'
                 '{}'
@@ -672,10 +772,6 @@ class BankStatementsAdmin(admin.ModelAdmin):
                 badge("✅ OK", "green"),
             )
 
-        # если вообще нет строк (на всякий)
-        if not base.exists():
-            return badge("— нет строк", "amber")
-
         # расшифровка чего не хватает
         parts = []
         if missing_cp_final:
@@ -698,6 +794,39 @@ class BankStatementsAdmin(admin.ModelAdmin):
         )
 
 
+    def _job_badge_html(self, status, stage, error=None):
+        if not status:
+            return "—"
+
+        stages = dict(StatementJob.STAGES)
+
+        if status == StatementJob.QUEUED:
+            inner = badge("⏳ в очереди", "slate")
+        elif status == StatementJob.RUNNING:
+            inner = badge(f"⚙️ {stages.get(stage, 'старт')}", "blue")
+        elif status == StatementJob.DONE:
+            inner = badge("✅ обработано", "green")
+        else:
+            first_line = (error or "").strip().splitlines()[:1]
+            return format_html(
+                '<span class="bs-job-inner" title="{}">{}</span>',
+                first_line[0] if first_line else "",
+                badge("❌ ошибка", "red"),
+            )
+
+        return format_html('<span class="bs-job-inner">{}</span>', inner)
+
+    @admin.display(description="Обработка")
+    def job_badge(self, obj):
+        status = getattr(obj, "job_status", None)
+        active = status in (StatementJob.QUEUED, StatementJob.RUNNING)
+        return format_html(
+            '<span class="bs-job" data-bs="{}" data-active="{}">{}</span>',
+            obj.pk,
+            "1" if active else "0",
+            self._job_badge_html(status, getattr(obj, "job_stage", None), getattr(obj, "job_error", None)),
+        )
+
     @admin.display(description="Счет")
     def ba_pretty(self, obj):
         if not obj.ba_id:
@@ -818,8 +947,11 @@ class BankStatementsAdmin(admin.ModelAdmin):
             obj = self.get_object(request, object_id)
 
             if obj and obj.file:
-                result = update_cf_data(obj.file.path, obj.pk)
-                messages.success(request, mark_safe(result))
+                result = run_statement(obj)
+                if isinstance(result, Exception):
+                    messages.error(request, f"Ошибка обработки выписки: {result}")
+                else:
+                    messages.success(request, mark_safe(result))
             else:
                 messages.error(request, "Файл не найден")
 
@@ -891,7 +1023,10 @@ class CfDataAdmin(admin.ModelAdmin):
         "cp_final__name",
         "contract__number",
     )
-    list_filter = ( ByInnBadgeFilter, 'cp', "intercompany", "owner", "ba", "cfitem", "contract", "bs")
+    list_filter = (
+        ByInnBadgeFilter, 'cp', "intercompany", "ic_status", "owner",
+        ("ba", BankAccountFilter), "cfitem", ("contract", ContractFilter), ("bs", StatementFilter),
+    )
     date_hierarchy = "date"
     ordering = ("-date", "-id")
 
@@ -904,6 +1039,24 @@ class CfDataAdmin(admin.ModelAdmin):
         ("🏦 Детали", {"fields": ("owner", "ba", "tax_id", "payer_account", "reciver_account", "vat_rate", "intercompany")}),
     )
 
+    # -------------------- Сводка качества выписок --------------------
+    def save_model(self, request, obj, form, change):
+        old_bs_id = form.initial.get("bs") if change else None
+        super().save_model(request, obj, form, change)
+        refresh_statement_quality({obj.bs_id, old_bs_id})
+        bump_data_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_statement_quality([obj.bs_id])
+        bump_data_version()
+
+    def delete_queryset(self, request, queryset):
+        bs_ids = set(queryset.values_list("bs_id", flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_statement_quality(bs_ids)
+        bump_data_version()
+
     # -------------------- Колонки списка --------------------
     def _currency_code(self, obj) -> str:
         ba = getattr(obj, "ba", None) or getattr(getattr(obj, "bs", None), "ba", None)
@@ -918,7 +1071,12 @@ class CfDataAdmin(admin.ModelAdmin):
                     "export-csv/",
                     self.admin_site.admin_view(self.export_csv_view),
                     name="treasury_cfdata_export_csv",
-                )
+                ),
+                path(
+                    "cash-flow/",
+                    self.admin_site.admin_view(self.cash_flow_view),
+                    name="treasury_cfdata_cash_flow",
+                ),
             ]
             return custom + urls
         
@@ -930,6 +1088,7 @@ class CfDataAdmin(admin.ModelAdmin):
             "cp",            # <-- добавили
             "cp_final",
             "contract",
+            "contract__title",
             "cfitem",
             "owner",
             "ba",
@@ -937,18 +1096,18 @@ class CfDataAdmin(admin.ModelAdmin):
             "bs",
         )
 
-        response = HttpResponse(content_type="text/csv; charset=utf-8")
-        response["Content-Disposition"] = 'attachment; filename="cf_data.csv"'
-        response.write("\ufeff")  # UTF-8 BOM для Excel
-
+        # writer пишет в "буфер", который просто возвращает строку, — её и отдаём потоком
         writer = csv.writer(
-            response,
+            EchoBuffer(),
             delimiter="|",
             quoting=csv.QUOTE_MINIMAL,
         )
 
         LEVELS = 4
 
+        # пути статей CF — один запрос на выгрузку
+        paths = cfitem_paths()
+
         header = [
             "date", "dt", "cr", "amount",
             "cp_inn_name",        # <-- НОВОЕ (перед финальным)
@@ -969,106 +1128,166 @@ class CfDataAdmin(admin.ModelAdmin):
             "bs_start", "bs_finish",
         ]
 
-        writer.writerow(header)
-
-        for obj in qs:
-            # --- даты операции (YYYY-MM-DD) ---
-            op_date_txt = obj.date.isoformat() if obj.date else ""
-            bs_start = obj.bs.start.isoformat() if obj.bs and obj.bs.start else ""
-            bs_finish = obj.bs.finish.isoformat() if obj.bs and obj.bs.finish else ""
+        def rows():
+            yield "\ufeff"  # UTF-8 BOM для Excel
+            yield writer.writerow(header)
+            for obj in qs.iterator(chunk_size=CSV_CHUNK_SIZE):
+                yield writer.writerow(self._csv_row(obj, paths, LEVELS))
 
-            # --- dt/cr -> amount (+/-) ---
-            dt_val = obj.dt or Decimal("0")
-            cr_val = obj.cr or Decimal("0")
+        response = StreamingHttpResponse(rows(), content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = 'attachment; filename="cf_data.csv"'
+        return response
 
-            if dt_val > 0:
-                amount = dt_val
-            elif cr_val > 0:
-                amount = -cr_val
-            else:
-                amount = Decimal("0")
+    def cash_flow_view(self, request):
+        """
+        Свод CF: статьи (с подстатьями) × месяцы.
+        ?owner=&ba= (можно несколько), ?start=&end= (ГГГГ-ММ), ?measure=net|dt|cr, ?depth=
+        """
+        def month(value):
+            try:
+                return datetime.strptime(value, "%Y-%m").date()
+            except (TypeError, ValueError):
+                return None
+
+        owner_ids = [v for v in request.GET.getlist("owner") if v.isdigit()]
+        ba_ids = [v for v in request.GET.getlist("ba") if v.isdigit()]
+        start, end = month(request.GET.get("start")), month(request.GET.get("end"))
+        measure = request.GET.get("measure")
+        measure = measure if measure in MEASURES else "net"
+        depth = request.GET.get("depth", "")
+        depth = int(depth) if depth.isdigit() else None
+
+        started = time.perf_counter()
+        pivot = get_pivot()
+        loaded = time.perf_counter()
+        data = pivot.slice(owner_ids, ba_ids, start, end, measure, depth)
+        sliced = time.perf_counter()
+
+        for row in data["rows"]:
+            row["cells"] = [money(v) for v in row["values"]]
+            row["total"] = money(row["total"])
+            row["indent"] = row["level"] * 18
+
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Свод CF",
+            "months": data["months"],
+            "rows": data["rows"],
+            "total_cells": [money(v) for v in data["total_values"]],
+            "total": money(data["total"]),
+            "owners": Owners.objects.filter(pk__in=pivot.owner_ids.tolist()).order_by("name"),
+            "accounts": BankAccount.objects.filter(pk__in=pivot.ba_ids.tolist()).select_related("bank"),
+            "owner_ids": owner_ids,
+            "ba_ids": ba_ids,
+            "start": start.strftime("%Y-%m") if start else "",
+            "end": end.strftime("%Y-%m") if end else "",
+            "measure": measure,
+            "measures": MEASURES,
+            "depth": "" if depth is None else depth,
+            "version": pivot.version,
+            "load_ms": round((loaded - started) * 1000, 1),
+            "slice_ms": round((sliced - loaded) * 1000, 1),
+        }
+        return TemplateResponse(request, "admin/treasury/cfdata/cash_flow.html", context)
+
+    def _csv_row(self, obj, paths, levels):
+        """Строка CSV по операции; paths — cfitem_paths()."""
+        # --- даты операции (YYYY-MM-DD) ---
+        op_date_txt = obj.date.isoformat() if obj.date else ""
+        bs_start = obj.bs.start.isoformat() if obj.bs and obj.bs.start else ""
+        bs_finish = obj.bs.finish.isoformat() if obj.bs and obj.bs.finish else ""
+
+        # --- dt/cr -> amount (+/-) ---
+        dt_val = obj.dt or Decimal("0")
+        cr_val = obj.cr or Decimal("0")
+
+        if dt_val > 0:
+            amount = dt_val
+        elif cr_val > 0:
+            amount = -cr_val
+        else:
+            amount = Decimal("0")
 
-            # --- договор: дата договора в формате DD.MM.YYYY ---
-            contract_txt = ""
-            if obj.contract:
-                title = getattr(getattr(obj.contract, "title", None), "title", "") or ""
-                num = (obj.contract.number or "").strip() or "б/н"
+        # --- договор: дата договора в формате DD.MM.YYYY ---
+        contract_txt = ""
+        if obj.contract:
+            title = getattr(getattr(obj.contract, "title", None), "title", "") or ""
+            num = (obj.contract.number or "").strip() or "б/н"
 
-                contract_date_part = ""
-                if obj.contract.date:
-                    contract_date_txt = obj.contract.date.strftime("%d.%m.%Y")
-                    contract_date_part = f" от {contract_date_txt}"
+            contract_date_part = ""
+            if obj.contract.date:
+                contract_date_txt = obj.contract.date.strftime("%d.%m.%Y")
+                contract_date_part = f" от {contract_date_txt}"
 
-                if title:
-                    contract_txt = f"{title} № {num}{contract_date_part}"
-                else:
-                    contract_txt = f"{num}{contract_date_part}"
-
-            # --- CF item и иерархия ---
-            it = obj.cfitem
-            if it:
-                ancestors = list(it.get_ancestors(include_self=True))  # [root, ..., self]
-                path_names = " / ".join(a.name for a in ancestors)
-                it_name = it.name
-            else:
-                ancestors = []
-                path_names = ""
-                it_name = ""
-
-            # --- банк / счет / валюта ---
-            ba_account = obj.ba.account if obj.ba else ""
-            ba_bank_name = obj.ba.bank.name if (obj.ba and obj.ba.bank) else ""
-            ba_currency = obj.ba.currency if obj.ba else ""
-            ba_bank_account = f"{ba_bank_name} | {ba_account}".strip(" |")
-
-            # --- контрагент по ИНН (из выписки) / финальный / матч ---
-            cp_inn_name = obj.cp.name if getattr(obj, "cp", None) else ""
-            cp_final_name = obj.cp_final.name if getattr(obj, "cp_final", None) else ""
-
-            if obj.cp_final_id and obj.cp_id:
-                cp_final_match = "MATCH" if obj.cp_final_id == obj.cp_id else "MISMATCH"
-            elif obj.cp_final_id and not obj.cp_id:
-                cp_final_match = "NO_INN_CP"
-            elif obj.cp_id and not obj.cp_final_id:
-                cp_final_match = "NO_FINAL"
+            if title:
+                contract_txt = f"{title} № {num}{contract_date_part}"
             else:
-                cp_final_match = "EMPTY"
+                contract_txt = f"{num}{contract_date_part}"
+
+        # --- CF item и иерархия ---
+        it = obj.cfitem
+        if it:
+            ancestors = paths.get(it.pk, [it.name])  # [root, ..., self]
+            path_names = " / ".join(ancestors)
+            it_name = it.name
+        else:
+            ancestors = []
+            path_names = ""
+            it_name = ""
+
+        # --- банк / счет / валюта ---
+        ba_account = obj.ba.account if obj.ba else ""
+        ba_bank_name = obj.ba.bank.name if (obj.ba and obj.ba.bank) else ""
+        ba_currency = obj.ba.currency if obj.ba else ""
+        ba_bank_account = f"{ba_bank_name} | {ba_account}".strip(" |")
+
+        # --- контрагент по ИНН (из выписки) / финальный / матч ---
+        cp_inn_name = obj.cp.name if getattr(obj, "cp", None) else ""
+        cp_final_name = obj.cp_final.name if getattr(obj, "cp_final", None) else ""
+
+        if obj.cp_final_id and obj.cp_id:
+            cp_final_match = "MATCH" if obj.cp_final_id == obj.cp_id else "MISMATCH"
+        elif obj.cp_final_id and not obj.cp_id:
+            cp_final_match = "NO_INN_CP"
+        elif obj.cp_id and not obj.cp_final_id:
+            cp_final_match = "NO_FINAL"
+        else:
+            cp_final_match = "EMPTY"
 
-            row = [
-                op_date_txt,  # <-- дата операции ISO
-                (str(dt_val) if dt_val else ""),
-                (str(cr_val) if cr_val else ""),
-                str(amount),
+        row = [
+            op_date_txt,  # <-- дата операции ISO
+            (str(dt_val) if dt_val else ""),
+            (str(cr_val) if cr_val else ""),
+            str(amount),
 
-                cp_inn_name,       # <-- НОВОЕ
-                cp_final_name,     # <-- финальный
-                cp_final_match,    # <-- НОВОЕ (рулевая)
+            cp_inn_name,       # <-- НОВОЕ
+            cp_final_name,     # <-- финальный
+            cp_final_match,    # <-- НОВОЕ (рулевая)
 
-                contract_txt,
-                it_name,
-                path_names,
-            ]
+            contract_txt,
+            it_name,
+            path_names,
+        ]
 
-            # lvl1..lvlN: root -> ...
-            for idx in range(LEVELS):
-                if idx < len(ancestors):
-                    row += [ancestors[idx].name]
-                else:
-                    row += [""]
-
-            row += [
-                (obj.temp or "").replace("\n", " ").strip(),
-                obj.tax_id or "",
-                (obj.owner.name if obj.owner else ""),
-                ba_currency,
-                ba_bank_account,
-                bs_start,
-                bs_finish,
-            ]
+        # lvl1..lvlN: root -> ...
+        for idx in range(levels):
+            if idx < len(ancestors):
+                row += [ancestors[idx]]
+            else:
+                row += [""]
+
+        row += [
+            (obj.temp or "").replace("\n", " ").strip(),
+            obj.tax_id or "",
+            (obj.owner.name if obj.owner else ""),
+            ba_currency,
+            ba_bank_account,
+            bs_start,
+            bs_finish,
+        ]
 
-            writer.writerow(row)
-
-        return response
+        return row
 
 
     
@@ -1384,3 +1603,29 @@ class ContractsRexexAdmin(admin.ModelAdmin):
         return (s[:80] + "…") if len(s) > 80 else (s or "—")
 
   
+
+
+# ---------- ВНУТРИГРУППОВЫЕ ----------
+
+@admin.register(IntercompanyRule)
+class IntercompanyRuleAdmin(admin.ModelAdmin):
+    list_display = ("date", "intercompany", "fragment", "comment")
+    list_filter = ("intercompany",)
+    search_fields = ("fragment", "comment")
+    date_hierarchy = "date"
+    list_per_page = 50
+
+
+@admin.register(IntercompanyMatch)
+class IntercompanyMatchAdmin(admin.ModelAdmin):
+    """Пары находит сверка (services/intercompany_match.py), здесь — только просмотр и удаление."""
+
+    list_display = ("out_date", "in_date", "out_ba", "in_ba", "amount", "currency", "out_leg", "in_leg")
+    list_filter = (("out_ba", BankAccountFilter), ("in_ba", BankAccountFilter), "currency")
+    list_select_related = ("out_ba", "out_ba__bank", "in_ba", "in_ba__bank", "out_leg", "in_leg")
+    date_hierarchy = "out_date"
+    readonly_fields = ("out_leg", "in_leg", "amount", "currency", "out_ba", "in_ba", "out_date", "in_date", "created_at")
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
@@ -5,3 +5,7 @@ class TreasuryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "treasury"
     verbose_name = "Казначейство"
+
+    def ready(self):
+        # Журнал изменений правил разноски (RuleChange)
+        from . import signals  # noqa: F401
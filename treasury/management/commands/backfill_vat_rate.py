@@ -0,0 +1,64 @@
+# treasury/management/commands/backfill_vat_rate.py
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+import pandas as pd
+
+from treasury.models import CfData
+from utils.bsparsers.bsupdater import vat_rates
+
+
+class Command(BaseCommand):
+    help = (
+        "Проставить ставку НДС (vat_rate) в уже загруженных CfData по назначению платежа. "
+        "Идёт порциями по id, каждая порция — отдельная транзакция."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk",
+            type=int,
+            default=5000,
+            help="Строк за порцию (по умолчанию 5000).",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Пересчитать и строки, где ставка уже есть.",
+        )
+
+    def handle(self, *args, **options):
+        qs = CfData.objects.filter(temp__isnull=False)
+        if not options["all"]:
+            qs = qs.filter(vat_rate__isnull=True)
+
+        q = """
+            UPDATE treasury_cfdata d
+            SET vat_rate = v.vat_rate
+            FROM unnest(%(ids)s::bigint[], %(rates)s::numeric[]) AS v(id, vat_rate)
+            WHERE d.id = v.id
+              AND d.vat_rate IS DISTINCT FROM v.vat_rate
+        """
+
+        last_id, seen, updated = 0, 0, 0
+        while True:
+            rows = list(
+                qs.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "temp")[: options["chunk"]]
+            )
+            if not rows:
+                break
+
+            ids, temps = zip(*rows)
+            rates = vat_rates(pd.Series(temps))
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(q, {"ids": list(ids), "rates": list(rates)})
+                updated += cursor.rowcount
+
+            last_id = ids[-1]
+            seen += len(rows)
+            self.stdout.write(f"Обработано {seen}, обновлено {updated}")
+
+        self.stdout.write(self.style.SUCCESS(f"Готово: обновлено {updated} строк из {seen}"))
@@ -0,0 +1,153 @@
+# treasury/management/commands/bench_contract_matching.py
+# Сравнение подбора договоров: прежний SQL (строки × шаблоны) и Classifier с предфильтром ContractMatcher
+
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from contracts.models import Contracts, ContractsTitle
+from corporate.models import Owners
+from counterparties.models import Counterparty
+from treasury.models import BankStatements, CfData
+from utils.bsparsers.classifier import Classifier
+
+# Прежний find_contracts: каждый шаблон на каждой строке выписки
+LEGACY_SQL = """
+UPDATE treasury_cfdata
+SET contract_id = NULL
+WHERE bs_id = %(bs_id)s;
+
+WITH contract_patterns AS (
+    SELECT id AS contract_id, regex AS pattern
+    FROM contracts_contracts
+    WHERE regex IS NOT NULL AND regex <> ''
+),
+matched AS (
+    SELECT DISTINCT ON (d.id)
+        d.id AS cf_id,
+        cp.contract_id
+    FROM treasury_cfdata d
+    JOIN contract_patterns cp
+      ON d.temp IS NOT NULL
+     AND d.temp ~* cp.pattern
+    WHERE d.bs_id = %(bs_id)s
+    ORDER BY d.id, length(cp.pattern) DESC, cp.contract_id ASC
+)
+UPDATE treasury_cfdata d
+SET contract_id = m.contract_id
+FROM matched m
+WHERE d.id = m.cf_id
+  AND d.bs_id = %(bs_id)s;
+"""
+
+NAMES = ["Ромашка", "Вектор", "Сфера", "Альфа", "Гранит", "Меридиан", "Север", "Каскад"]
+SUBJECTS = ["аренда", "услуги связи", "поставка товара", "охрана", "уборка", "консультационные услуги"]
+
+
+def synthetic_patterns(n, rnd):
+    """Шаблоны в духе справочника: номер договора, дата, название контрагента."""
+    patterns = []
+    for i in range(n):
+        number = f"{i + 1}/{rnd.randint(18, 25)}-{rnd.choice('АБВГДКМП')}{rnd.choice('АБВГДКМП')}"
+        date = f"{rnd.randint(1, 28):02d}\\.{rnd.randint(1, 12):02d}\\.20{rnd.randint(18, 25)}"
+        kind = i % 10
+        if kind < 5:
+            rx = f"дог\\w*\\.?\\s*(№\\s*)?{number}"
+        elif kind < 8:
+            rx = f"{number}\\s+от\\s+{date}"
+        elif kind < 9:
+            rx = f"ООО\\s+\"{rnd.choice(NAMES)}-{i}\"\\s+(по\\s+)?(дог|сч)"
+        else:
+            # без обязательного текста — такие проверяются на всех строках
+            rx = f"\\d{{{5 + i % 4}}}\\s*[А-Я]{{2}}\\s*{i % 10}"
+        patterns.append((number, rx))
+    return patterns
+
+
+def synthetic_rows(n, patterns, rnd):
+    rows = []
+    for i in range(n):
+        subject = rnd.choice(SUBJECTS)
+        if rnd.random() < 0.6:
+            number, _ = rnd.choice(patterns)
+            temp = f"Оплата по договору № {number} от {rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.2024 за {subject}"
+        else:
+            temp = f"Оплата по счету {rnd.randint(1, 99999)} за {subject}, в т.ч. НДС 20%"
+        rows.append(temp)
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк подбора договоров по RegEx на синтетических данных (всё откатывается)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10_000, help="Строк выписки")
+        parser.add_argument("--patterns", type=int, default=2_000, help="Договоров с RegEx")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options["seed"])
+        patterns = synthetic_patterns(options["patterns"], rnd)
+        texts = synthetic_rows(options["rows"], patterns, rnd)
+
+        with transaction.atomic():
+            owner = Owners.objects.create(name="bench-owner", inn="bench-owner")
+            cp = Counterparty.objects.create(tax_id="bench-cp", name="bench-cp")
+            title, _ = ContractsTitle.objects.get_or_create(title="bench")
+
+            Contracts.objects.bulk_create(
+                Contracts(title=title, owner=owner, cp=cp, number=number, regex=rx)
+                for number, rx in patterns
+            )
+            bs = BankStatements.objects.create(owner=owner)
+            CfData.objects.bulk_create(
+                CfData(bs=bs, doc_numner=str(i), temp=temp, dt=0, cr=0, intercompany=False)
+                for i, temp in enumerate(texts)
+            )
+
+            _, legacy_time = self.timed(lambda: self.run_legacy(bs.pk))
+            legacy = self.assignments(bs.pk)
+            engine, engine_time = self.timed(lambda: self.run_engine(bs.pk))
+            engine_count = sum(v is not None for v in engine.values())
+
+            matcher = Classifier.load().matcher
+            cf_ids, _ = matcher.candidate_pairs(
+                CfData.objects.filter(bs=bs).values_list("id", "temp")
+            )
+
+            transaction.set_rollback(True)
+
+        full = len(texts) * len(patterns)
+        checked = len(cf_ids) + len(texts) * len(matcher.unfiltered)
+
+        self.stdout.write(f"Строк: {len(texts)}, шаблонов: {len(patterns)} (без предфильтра: {len(matcher.unfiltered)})")
+        self.stdout.write(f"Проверок RegEx: SQL {full:,}, предфильтр {checked:,} ({checked / full:.2%})")
+        self.stdout.write(f"SQL:        {legacy_time:8.3f} с, договоров найдено {sum(v is not None for v in legacy.values())}")
+        self.stdout.write(f"Предфильтр: {engine_time:8.3f} с, договоров найдено {engine_count}")
+        if legacy_time and engine_time:
+            self.stdout.write(f"Ускорение: x{legacy_time / engine_time:.1f}")
+
+        if legacy == engine:
+            self.stdout.write(self.style.SUCCESS("Результаты совпадают"))
+        else:
+            diff = sum(legacy[k] != engine.get(k) for k in legacy)
+            self.stdout.write(self.style.ERROR(f"Расхождения: {diff} строк"))
+
+    def timed(self, fn):
+        started = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - started
+
+    def run_legacy(self, bs_id):
+        with connection.cursor() as cursor:
+            cursor.execute(LEGACY_SQL, {"bs_id": bs_id})
+
+    def run_engine(self, bs_id):
+        classifier = Classifier.load()
+        rows = CfData.objects.filter(bs_id=bs_id).values_list("id", "temp")
+        return {cf_id: classifier.match_contract(temp) for cf_id, temp in rows}
+
+    def assignments(self, bs_id):
+        return dict(CfData.objects.filter(bs_id=bs_id).values_list("id", "contract_id"))
@@ -0,0 +1,243 @@
+# treasury/management/commands/bench_ingest.py
+# Бенчмарк загрузки выписок по этапам на синтетических файлах (всё откатывается).
+# Результат — JSON: сохраняем на каждой версии и сравниваем через --compare.
+
+import json
+import platform
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from contracts.models import Contracts, ContractsTitle
+from corporate.models import BankAccount, Owners
+from counterparties.models import Counterparty
+from treasury.models import BankStatements, CfData
+from utils.bsparsers.bsparser import bs_decode, bs_to_dict, normalize_statement
+from utils.bsparsers.bsupdater import find_vat_rate, write_statement
+from utils.bsparsers.classifier import Classifier
+from utils.bsparsers.synthetic import WRITERS, counterparties, write_statement as write_file
+from utils.bsparsers.xls_parser import adjust_df, read_xls
+
+BENCH_ACCOUNT = "40702810999999999999"
+BENCH_INN = "bench-owner"
+
+# Этапы, из которых складывается загрузка. decode / read — диагностика:
+# они уже входят в tokenize / parse; vat и classifier_load — в prepare и classify.
+INGEST_STAGES = ("tokenize", "normalize", "parse", "prepare", "classify", "upsert")
+
+
+class StageTimer:
+    """
+    Совместим с progress(stage) из bsupdater: каждый вызов закрывает
+    предыдущий этап и открывает новый.
+    """
+
+    def __init__(self, suffix=""):
+        self.stages = defaultdict(float)
+        self.suffix = suffix
+        self._name = None
+        self._started = None
+
+    def __call__(self, name):
+        self.stop()
+        self._name = name + self.suffix
+        self._started = time.perf_counter()
+
+    def stop(self):
+        if self._name is not None:
+            self.stages[self._name] += time.perf_counter() - self._started
+            self._name = None
+
+
+class QueryCounter:
+    """connection.execute_wrapper: число и время SQL-запросов (COPY сюда не попадает)."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+def timed(stages, name, fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    stages[name] = time.perf_counter() - started
+    return result
+
+
+def git_commit():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк загрузки выписки по этапам: разбор, НДС, разноска, запись в treasury_cfdata. "
+        "Пример: python manage.py bench_ingest --docs 1000 100000 --format txt xlsx --output bench.json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs", type=int, nargs="+", default=[1_000, 10_000], help="Документов в выписке")
+        parser.add_argument("--format", nargs="+", choices=sorted(WRITERS), default=["txt"], dest="formats")
+        parser.add_argument("--counterparties", type=int, default=300)
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--dir", default=None, help="Каталог для файлов (по умолчанию временный)")
+        parser.add_argument("--output", default=None, help="Куда записать результаты JSON")
+        parser.add_argument("--compare", default=None, help="JSON прошлого прогона для сравнения")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = Path(options["dir"] or tmp)
+            workdir.mkdir(parents=True, exist_ok=True)
+
+            runs = []
+            for fmt in options["formats"]:
+                for docs in options["docs"]:
+                    run = self.bench(workdir, fmt, docs, options)
+                    runs.append(run)
+                    self.report(run)
+
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW server_version")
+            pg_version = cursor.fetchone()[0]
+
+        result = {
+            "commit": git_commit(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "postgres": pg_version,
+            "runs": runs,
+        }
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+            self.stdout.write(self.style.SUCCESS(f"Результаты: {options['output']}"))
+
+        if options["compare"]:
+            self.compare(json.loads(Path(options["compare"]).read_text(encoding="utf-8")), result)
+
+    # --- прогон ---
+
+    def bench(self, workdir, fmt, docs, options):
+        path = str(workdir / f"statement_{docs}.{fmt}")
+        stages = {}
+
+        timed(
+            stages, "generate", write_file, path, docs, fmt,
+            account=BENCH_ACCOUNT, cps=options["counterparties"], seed=options["seed"],
+        )
+
+        # разбор — чистые функции, без БД
+        if fmt == "txt":
+            timed(stages, "decode", lambda: sum(1 for _ in bs_decode(path)))
+            init_df, account, start, end, bb, eb = timed(stages, "tokenize", bs_to_dict, path)
+            df = timed(stages, "normalize", normalize_statement, init_df, account)
+            parsed = df, account, start, end, bb, eb
+        else:
+            timed(stages, "read", read_xls, path)
+            parsed = timed(stages, "parse", adjust_df, path)
+        timed(stages, "vat", find_vat_rate, parsed[0])
+
+        queries = QueryCounter()
+        with transaction.atomic(), connection.execute_wrapper(queries):
+            ba = self.fixtures(options)
+            timed(stages, "classifier_load", Classifier.load)
+
+            bs = BankStatements.objects.create(owner_id=ba.corporate_id, ba=ba)
+
+            # первая загрузка: кэш разноски пуст, все строки новые
+            timer = StageTimer()
+            write_statement(parsed, path, bs.pk, progress=timer)
+            timer.stop()
+
+            # повторная загрузка той же выписки: кэш тёплый, строки обновляются
+            rerun = StageTimer("_again")
+            write_statement(parsed, path, bs.pk, progress=rerun)
+            rerun.stop()
+
+            rows = CfData.objects.filter(bs=bs).count()
+            transaction.set_rollback(True)
+
+        stages.update(timer.stages)
+        stages.update(rerun.stages)
+        ingest = sum(stages.get(k, 0) for k in INGEST_STAGES)
+
+        return {
+            "format": fmt,
+            "docs": docs,
+            "rows": rows,
+            "stages": {k: round(v, 4) for k, v in stages.items()},
+            "ingest_seconds": round(ingest, 4),
+            "docs_per_second": round(docs / ingest) if ingest else None,
+            "queries": queries.count,
+            "query_seconds": round(queries.seconds, 4),
+        }
+
+    def fixtures(self, options):
+        """Собственник, счёт, контрагенты и договоры синтетического справочника."""
+        owner, _ = Owners.objects.get_or_create(inn=BENCH_INN, defaults={"name": BENCH_INN})
+        ba, _ = BankAccount.objects.get_or_create(account=BENCH_ACCOUNT, defaults={"corporate": owner})
+
+        cps = counterparties(options["counterparties"], options["seed"])
+        Counterparty.objects.bulk_create(
+            [Counterparty(tax_id=cp.inn, name=cp.name) for cp in cps], ignore_conflicts=True
+        )
+        cp_ids = dict(Counterparty.objects.filter(tax_id__in=[cp.inn for cp in cps]).values_list("tax_id", "id"))
+
+        title, _ = ContractsTitle.objects.get_or_create(title="bench")
+        Contracts.objects.bulk_create(
+            Contracts(title=title, owner=owner, cp_id=cp_ids[cp.inn], number=number, date=signed,
+                      regex=f"№\\s*{number}\\s+от\\s+{signed:%d\\.%m\\.%Y}")
+            for cp in cps
+            for number, signed, _ in cp.contracts
+        )
+        return ba
+
+    # --- вывод ---
+
+    def report(self, run):
+        self.stdout.write(
+            f"{run['format']} × {run['docs']:,}: {run['ingest_seconds']:.2f} с "
+            f"({run['docs_per_second'] or 0:,} док/с), SQL-запросов {run['queries']}"
+        )
+        for name, seconds in run["stages"].items():
+            self.stdout.write(f"  {name:<20} {seconds:9.3f} с")
+
+    def compare(self, before, after):
+        old = {(r["format"], r["docs"]): r for r in before.get("runs", [])}
+        self.stdout.write(f"Сравнение с {before.get('commit') or '?'} от {before.get('created_at')}:")
+
+        for run in after["runs"]:
+            prev = old.get((run["format"], run["docs"]))
+            if prev is None:
+                continue
+            self.stdout.write(f"{run['format']} × {run['docs']:,}")
+            for name, seconds in run["stages"].items():
+                was = prev["stages"].get(name)
+                if not was:
+                    continue
+                change = (seconds - was) / was
+                line = f"  {name:<20} {was:9.3f} -> {seconds:9.3f} с ({change:+.0%})"
+                if change > 0.2:
+                    line = self.style.ERROR(line)
+                self.stdout.write(line)
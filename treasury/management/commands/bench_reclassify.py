@@ -0,0 +1,125 @@
+# treasury/management/commands/bench_reclassify.py
+# Поиск строк, задетых изменениями правил: WHERE ... OR ... одним проходом
+# и поиски по каждому условию (UNION ALL), без триграммного индекса cfdata_temp_trgm и с ним.
+# Данные синтетические, всё откатывается (в т.ч. индекс).
+
+import datetime as dt
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from contracts.models import Contracts, ContractsTitle
+from corporate.models import Owners
+from counterparties.models import Counterparty
+from treasury.models import BankStatements, CfData, RuleChange
+from treasury.services.reclassify import lookup_affected_rows, reclassify_rows, scan_affected_rows
+from treasury.services.trgm_index import INDEX_NAME, has_trgm_index, trgm_available
+from utils.bsparsers.synthetic import counterparties, documents
+
+BENCH_INN = "bench-owner"
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк поиска строк CfData, задетых изменениями правил разноски (всё откатывается). "
+        "Пример: python manage.py bench_reclassify --rows 200000 --changes 10 100 all"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000, help="Строк в treasury_cfdata")
+        parser.add_argument("--counterparties", type=int, default=300)
+        parser.add_argument(
+            "--changes", nargs="+", default=["10", "100", "all"],
+            help="Сколько договоров поменяли RegEx; all — все (полная переразноска)",
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument(
+            "--index", nargs="+", choices=["without", "with"], default=None,
+            help=f"Замеры без индекса {INDEX_NAME} и/или с ним (по умолчанию оба, если есть pg_trgm)",
+        )
+
+    def handle(self, *args, **options):
+        modes = options["index"] or (["without", "with"] if trgm_available() else ["without"])
+        if "with" in modes and not trgm_available():
+            raise CommandError("На сервере нет расширения pg_trgm — замер с индексом невозможен")
+
+        with transaction.atomic():
+            contracts = self.fixtures(options)
+            self.stdout.write(f"Строк: {options['rows']:,}, договоров с RegEx: {len(contracts)}")
+
+            for mode in modes:
+                self.set_index(mode)
+                self.stdout.write(self.style.NOTICE(f"Индекс {INDEX_NAME}: {'есть' if has_trgm_index() else 'нет'}"))
+
+                for size in options["changes"]:
+                    picked = contracts if size == "all" else contracts[:int(size)]
+                    # договоры "добавили": старого шаблона нет, новый — RegEx договора
+                    changes = RuleChange.objects.bulk_create(
+                        RuleChange(rule=RuleChange.CONTRACT, rule_id=c.pk, old_regex=None, new_regex=c.regex)
+                        for c in picked
+                    )
+
+                    (scan_ids, scan_counts), scan = self.timed(scan_affected_rows, changes)
+                    (lookup_ids, lookup_counts), lookup = self.timed(lookup_affected_rows, changes)
+                    _, classify = self.timed(reclassify_rows, lookup_ids)
+
+                    line = (
+                        f"{len(changes):>5} изменений: OR-проход {scan:8.3f} с, поиски {lookup:8.3f} с"
+                        f" (x{scan / lookup if lookup else 0:.1f}), строк {len(lookup_ids):,},"
+                        f" переразноска {classify:.3f} с"
+                    )
+                    if scan_ids != lookup_ids or scan_counts != lookup_counts:
+                        line = self.style.ERROR(line + " — РАСХОЖДЕНИЕ")
+                    self.stdout.write(line)
+
+            transaction.set_rollback(True)
+
+    def set_index(self, mode):
+        """Индекс ставим или снимаем внутри транзакции замера — откатится вместе с данными."""
+        with connection.cursor() as cursor:
+            if mode == "with":
+                # отложенные проверки FK от вставок не дают строить индекс в той же транзакции
+                cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                started = time.perf_counter()
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON treasury_cfdata USING gin (temp gin_trgm_ops)")
+                cursor.execute("SELECT pg_size_pretty(pg_relation_size(%s))", [INDEX_NAME])
+                self.stdout.write(f"Индекс построен за {time.perf_counter() - started:.1f} с, размер {cursor.fetchone()[0]}")
+            else:
+                cursor.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+            cursor.execute("ANALYZE treasury_cfdata")
+
+    def fixtures(self, options):
+        """Выписка из синтетических документов и договоры с RegEx по номеру и дате."""
+        owner, _ = Owners.objects.get_or_create(inn=BENCH_INN, defaults={"name": BENCH_INN})
+        cps = counterparties(options["counterparties"], options["seed"])
+        Counterparty.objects.bulk_create(
+            [Counterparty(tax_id=cp.inn, name=cp.name) for cp in cps], ignore_conflicts=True
+        )
+        cp_ids = dict(Counterparty.objects.filter(tax_id__in=[cp.inn for cp in cps]).values_list("tax_id", "id"))
+
+        title, _ = ContractsTitle.objects.get_or_create(title="bench")
+        contracts = Contracts.objects.bulk_create(
+            Contracts(title=title, owner=owner, cp_id=cp_ids[cp.inn], number=number, date=signed,
+                      regex=f"№\\s*{number}\\s+от\\s+{signed:%d\\.%m\\.%Y}")
+            for cp in cps
+            for number, signed, _ in cp.contracts
+        )
+
+        bs = BankStatements.objects.create(owner=owner)
+        CfData.objects.bulk_create(
+            (
+                CfData(bs=bs, owner=owner, doc_numner=str(doc.number), date=doc.date, temp=doc.temp,
+                       dt=0 if doc.outgoing else doc.amount, cr=doc.amount if doc.outgoing else 0,
+                       intercompany=False, cp_id=cp_ids.get(doc.cp.inn))
+                for doc in documents(options["rows"], cps, dt.date(2024, 1, 1), options["seed"])
+            ),
+            batch_size=5_000,
+        )
+        return contracts
+
+    def timed(self, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - started
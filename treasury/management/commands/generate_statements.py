@@ -0,0 +1,36 @@
+# treasury/management/commands/generate_statements.py
+# Синтетические выписки (1С txt / xlsx) для бенчмарков и ручных проверок загрузки
+
+import os
+
+from django.core.management.base import BaseCommand
+
+from utils.bsparsers.synthetic import OWN_ACCOUNT, WRITERS, write_statement
+
+
+class Command(BaseCommand):
+    help = (
+        "Пишет синтетические выписки заданного размера. "
+        "Пример: python manage.py generate_statements --docs 1000 100000 --format txt xlsx --out /tmp/bench"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs", type=int, nargs="+", default=[1_000], help="Документов в выписке (можно несколько)")
+        parser.add_argument("--format", nargs="+", choices=sorted(WRITERS), default=["txt"], dest="formats")
+        parser.add_argument("--out", default=".", help="Каталог для файлов")
+        parser.add_argument("--account", default=OWN_ACCOUNT, help="Расчётный счёт выписки")
+        parser.add_argument("--counterparties", type=int, default=300, help="Размер справочника контрагентов")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        os.makedirs(options["out"], exist_ok=True)
+
+        for fmt in options["formats"]:
+            for docs in options["docs"]:
+                path = os.path.join(options["out"], f"statement_{docs}.{fmt}")
+                write_statement(
+                    path, docs, fmt,
+                    account=options["account"], cps=options["counterparties"], seed=options["seed"],
+                )
+                size = os.path.getsize(path) / 1024 / 1024
+                self.stdout.write(f"{path}: {docs:,} документов, {size:.1f} МБ")
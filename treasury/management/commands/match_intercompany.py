@@ -0,0 +1,31 @@
+# treasury/management/commands/match_intercompany.py
+# Сверка переводов между своими счетами по всей таблице или по выпискам.
+# После загрузки выписки сверка идёт сама (write_statement); команда —
+# для старых данных, смены окна и повторной сверки.
+
+from django.core.management.base import BaseCommand
+
+from treasury.services.intercompany_match import match_all, match_statement
+
+
+class Command(BaseCommand):
+    help = (
+        "Сопоставляет списания и зачисления переводов между своими счетами. "
+        "Пример: python manage.py match_intercompany --window 5 --reset"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bs", type=int, nargs="+", help="id выписок (по умолчанию — вся таблица)")
+        parser.add_argument("--window", type=int, help="дней между списанием и зачислением (по умолчанию из settings)")
+        parser.add_argument("--reset", action="store_true", help="удалить найденные пары и сопоставить заново")
+
+    def handle(self, *args, **options):
+        if options["bs"]:
+            results = [match_statement(bs_id, options["window"]) for bs_id in options["bs"]]
+        else:
+            results = [match_all(options["window"], reset=options["reset"])]
+
+        legs = sum(r["legs"] for r in results)
+        pairs = sum(r["pairs"] for r in results)
+        unmatched = sum(r["unmatched"] for r in results)
+        self.stdout.write(self.style.SUCCESS(f"Половин переводов: {legs:,}, новых пар: {pairs:,}, без пары: {unmatched:,}"))
@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from treasury.services.reclassify import apply_rule_changes
+from treasury.services.statement_jobs import claim_jobs, reclaim_stale_jobs, run_job, run_jobs_batch, worker_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Воркер очереди обработки выписок (StatementJob). "
+        "Пример: python manage.py process_statements --sleep 5. "
+        "С --batch N воркер берет до N выписок сразу и разбирает файлы параллельно. "
+        "Можно запускать несколько воркеров одновременно. "
+        "Пока очередь пуста, воркер применяет изменения правил разноски (RuleChange)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Разобрать текущую очередь и выйти.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=3.0,
+            help="Пауза между опросами пустой очереди, сек (по умолчанию 3).",
+        )
+        parser.add_argument(
+            "--batch",
+            type=int,
+            default=1,
+            help="Сколько задач брать за раз (по умолчанию 1 — без пула процессов).",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Число процессов разбора в пакетном режиме (по умолчанию по числу ядер).",
+        )
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write(self.style.NOTICE(f"Воркер {worker} запущен"))
+
+        # задачи упавших воркеров (в т.ч. прошлого запуска с тем же именем)
+        reclaimed = reclaim_stale_jobs(worker)
+        if reclaimed:
+            self.stdout.write(self.style.WARNING(f"Снято брошенных задач: {reclaimed}"))
+
+        while True:
+            jobs = claim_jobs(worker, limit=max(options["batch"], 1))
+
+            if not jobs:
+                changes, rows = apply_rule_changes()
+                if changes:
+                    self.stdout.write(f"Изменения правил: {changes}, пересчитано строк: {rows}")
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+                continue
+
+            self.stdout.write(f"Выписки {', '.join(str(j.bs_id) for j in jobs)}: обработка")
+
+            if len(jobs) == 1:
+                done = [run_job(jobs[0])]
+            else:
+                done = run_jobs_batch(jobs, workers=options["workers"])
+
+            for job in done:
+                if job.status == job.DONE:
+                    self.stdout.write(self.style.SUCCESS(f"Выписка {job.bs_id}: готово"))
+                else:
+                    self.stdout.write(self.style.ERROR(f"Выписка {job.bs_id}: ошибка — {job.error.strip().splitlines()[-1]}"))
@@ -0,0 +1,21 @@
+# treasury/management/commands/rebuild_daily_balance.py
+# Полный пересчёт остатков по дням (DailyBalance).
+# Нужен после массовых правок CfData/выписок мимо write_statement и сигналов.
+
+from django.core.management.base import BaseCommand
+
+from treasury.services.daily_balance import rebuild_daily_balance
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает таблицу остатков по дням. "
+        "Пример: python manage.py rebuild_daily_balance --ba 3 7"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ba", type=int, nargs="+", help="id счетов (по умолчанию — все)")
+
+    def handle(self, *args, **options):
+        days = rebuild_daily_balance(options["ba"])
+        self.stdout.write(self.style.SUCCESS(f"Остатков записано: {days:,} дней"))
@@ -0,0 +1,30 @@
+# treasury/management/commands/reclassify.py
+from django.core.management.base import BaseCommand
+
+from treasury.services.reclassify import apply_rule_changes, reclassify_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Переразноска CfData после изменения правил (договоры, исключения, статьи CF). "
+        "По умолчанию пересчитывает только строки, задетые новыми записями RuleChange."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Пересчитать все выписки целиком (например, после массовых правок правил).",
+        )
+
+    def handle(self, *args, **options):
+        if options["all"]:
+            total = reclassify_all()
+            self.stdout.write(self.style.SUCCESS(f"Переразнесено строк: {total}"))
+            return
+
+        changes, rows = apply_rule_changes()
+        if not changes:
+            self.stdout.write("Новых изменений правил нет")
+            return
+        self.stdout.write(self.style.SUCCESS(f"Изменений правил: {changes}, пересчитано строк: {rows}"))
@@ -0,0 +1,30 @@
+# treasury/management/commands/trgm_index.py
+# Триграммный индекс cfdata_temp_trgm: поставить после установки pg_trgm на сервер
+# (миграция 0020 его пропускает, если расширения нет) или снять.
+
+from django.core.management.base import BaseCommand, CommandError
+
+from treasury.services.trgm_index import INDEX_NAME, create_trgm_index, drop_trgm_index, has_trgm_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Строит (или снимает) триграммный индекс treasury_cfdata.temp для поиска строк, "
+        "задетых изменениями правил. Пример: python manage.py trgm_index"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--drop", action="store_true", help="Снять индекс.")
+
+    def handle(self, *args, **options):
+        if options["drop"]:
+            drop_trgm_index()
+            self.stdout.write(self.style.SUCCESS(f"Индекс {INDEX_NAME} снят"))
+            return
+
+        if has_trgm_index():
+            self.stdout.write(f"Индекс {INDEX_NAME} уже есть")
+            return
+        if not create_trgm_index():
+            raise CommandError("На сервере нет расширения pg_trgm (пакет postgresql-contrib)")
+        self.stdout.write(self.style.SUCCESS(f"Индекс {INDEX_NAME} построен"))
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0009_contractsrexex"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatementJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "В очереди"),
+                            ("running", "Выполняется"),
+                            ("done", "Готово"),
+                            ("failed", "Ошибка"),
+                        ],
+                        db_index=True,
+                        default="queued",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "stage",
+                    models.CharField(
+                        blank=True,
+                        choices=[
+                            ("parse", "Разбор файла"),
+                            ("upsert", "Загрузка операций"),
+                            ("contracts", "Договоры"),
+                            ("exceptions", "Исключения"),
+                            ("cp_final", "Контрагенты"),
+                            ("cfitem", "Статьи CF"),
+                        ],
+                        max_length=20,
+                        null=True,
+                        verbose_name="Этап",
+                    ),
+                ),
+                (
+                    "result",
+                    models.TextField(blank=True, null=True, verbose_name="Результат"),
+                ),
+                (
+                    "error",
+                    models.TextField(blank=True, null=True, verbose_name="Ошибка"),
+                ),
+                (
+                    "worker",
+                    models.CharField(
+                        blank=True, max_length=255, null=True, verbose_name="Воркер"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Поставлена"),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="Начата"),
+                ),
+                (
+                    "finished_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Завершена"
+                    ),
+                ),
+                (
+                    "bs",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="jobs",
+                        to="treasury.bankstatements",
+                        verbose_name="Выписка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Обработка выписки",
+                "verbose_name_plural": "Обработка выписок",
+                "ordering": ["-id"],
+            },
+        ),
+    ]
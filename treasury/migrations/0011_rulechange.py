@@ -0,0 +1,83 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0010_statementjob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RuleChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "rule",
+                    models.CharField(
+                        choices=[
+                            ("contract", "RegEx договора"),
+                            ("exception", "Исключение по контрагенту"),
+                            ("cfitem", "Статья CF по договору"),
+                        ],
+                        max_length=20,
+                        verbose_name="Правило",
+                    ),
+                ),
+                ("rule_id", models.BigIntegerField(verbose_name="ID правила")),
+                (
+                    "old_regex",
+                    models.TextField(
+                        blank=True, null=True, verbose_name="Старый RegEx"
+                    ),
+                ),
+                (
+                    "new_regex",
+                    models.TextField(blank=True, null=True, verbose_name="Новый RegEx"),
+                ),
+                (
+                    "old_scope",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="Старая область"
+                    ),
+                ),
+                (
+                    "new_scope",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="Новая область"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Изменено"),
+                ),
+                (
+                    "processed_at",
+                    models.DateTimeField(
+                        blank=True, db_index=True, null=True, verbose_name="Пересчитано"
+                    ),
+                ),
+                (
+                    "rows",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Строк пересчитано"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Изменение правила разноски",
+                "verbose_name_plural": "Изменения правил разноски",
+                "ordering": ["id"],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0011_rulechange"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="statementjob",
+            name="stage",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("parse", "Разбор файла"),
+                    ("classify", "Разноска"),
+                    ("upsert", "Загрузка операций"),
+                ],
+                max_length=20,
+                null=True,
+                verbose_name="Этап",
+            ),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contracts", "0004_alter_contracts_regex"),
+        ("corporate", "0009_alter_countries_options_and_more"),
+        ("counterparties", "0001_initial"),
+        ("treasury", "0012_statementjob_classify_stage"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClassificationCache",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "fingerprint",
+                    models.CharField(
+                        max_length=32, unique=True, verbose_name="Отпечаток"
+                    ),
+                ),
+                ("temp", models.TextField(verbose_name="Назначение (пример)")),
+                (
+                    "by_exception",
+                    models.BooleanField(
+                        default=False, verbose_name="Договор по исключению"
+                    ),
+                ),
+                (
+                    "vat_rate",
+                    models.DecimalField(
+                        blank=True,
+                        decimal_places=2,
+                        max_digits=6,
+                        null=True,
+                        verbose_name="НДС",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="Создано"),
+                ),
+                (
+                    "cfitem_cr",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="corporate.cfitems",
+                        verbose_name="Статья CF для Кт",
+                    ),
+                ),
+                (
+                    "cfitem_dt",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="corporate.cfitems",
+                        verbose_name="Статья CF для Дт",
+                    ),
+                ),
+                (
+                    "contract",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="contracts.contracts",
+                        verbose_name="Договор",
+                    ),
+                ),
+                (
+                    "cp",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="counterparties.counterparty",
+                        verbose_name="Контрагент",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Кэш разноски",
+                "verbose_name_plural": "Кэш разноски",
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:42
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0013_classificationcache"),
+    ]
+
+    # До этой версии ставка НДС при загрузке не считалась — в кэше везде NULL
+    operations = [
+        migrations.RunSQL(
+            "DELETE FROM treasury_classificationcache",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
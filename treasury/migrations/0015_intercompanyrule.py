@@ -0,0 +1,50 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0014_reset_classification_cache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IntercompanyRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(db_index=True, verbose_name="Дата платежа")),
+                ("fragment", models.TextField(verbose_name="Фрагмент назначения")),
+                (
+                    "intercompany",
+                    models.BooleanField(
+                        help_text="Включено — считать внутригрупповым, выключено — исключить из внутригрупповых",
+                        verbose_name="Внутригрупповой",
+                    ),
+                ),
+                (
+                    "comment",
+                    models.CharField(
+                        blank=True,
+                        max_length=250,
+                        null=True,
+                        verbose_name="Комментарий",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Правило внутригрупповых",
+                "verbose_name_plural": "Правила внутригрупповых",
+                "ordering": ["-date", "id"],
+            },
+        ),
+    ]
@@ -0,0 +1,130 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:43
+
+from datetime import date
+
+from django.db import migrations
+
+# Правила, которые раньше были зашиты в utils/bsparsers/intercompany_rules.py
+RULES = [
+    (
+        "2024-11-19",
+        'Перевод средств в связи с окончанием договора N Б/Н от 14.11.2024 ООО "Трендсеттер" по вх.д. 850343 от 19.11.2024',
+        False,
+    ),
+    (
+        "2024-10-02",
+        'Перевод средств в связи с окончанием договора N Б/Н от 25.09.2024 ООО "Трендсеттер" по вх.д. 788752 от 02.10.2024',
+        False,
+    ),
+    (
+        "2024-05-13",
+        "Возврат суммы депозита по депозитному договору № БВ-Ю-810/1100-90618308/5-24 от 08.05.24. Без НДС по вх.д. 4507 от 13.05.2024",
+        False,
+    ),
+    (
+        "2024-04-23",
+        "Возврат суммы депозита по депозитному договору № БВ-Ю-810/1100-90618308/4-24 от 19.04.24. Без НДС по вх.д. 25735 от 23.04.2024",
+        False,
+    ),
+    (
+        "2024-03-25",
+        "Возврат суммы депозита по депозитному договору № БВ-Ю-810/1100-90618308/3-24 от 22.03.24. Без НДС по вх.д. 22217 от 25.03.2024",
+        False,
+    ),
+    (
+        "2024-03-18",
+        "Возврат суммы депозита по депозитному договору № БВ-Ю-810/1100-90618308/2-24 от 15.03.24. Без НДС по вх.д. 3169 от 18.03.2024",
+        False,
+    ),
+    (
+        "2024-03-11",
+        "Возврат суммы депозита по депозитному договору № БВ-Ю-810/1100-90618308/1-24 от 07.03.24. Без НДС по вх.д. 7018 от 11.03.2024",
+        False,
+    ),
+    (
+        "2024-01-31",
+        'Перевод средств в связи с окончанием договора N Б/Н от 15.01.2024 ООО "Трендсеттер" по вх.д. 603079 от 31.01.2024',
+        False,
+    ),
+    (
+        "2024-01-10",
+        'Перевод средств в связи с окончанием договора N Б/Н от 29.12.2023 ООО "Трендсеттер" по вх.д. 594376 от 10.01.2024',
+        False,
+    ),
+    (
+        "2024-11-14",
+        'Зачисление на счет договора банковского депозита №Б/Н от 14.11.2024 ООО "Трендсеттер" Без НДС. по вх.д. 842746 от 14.11.2024',
+        False,
+    ),
+    (
+        "2024-09-25",
+        'Зачисление на счет по договору банковского депозита№ Б/Н от 25.09.2024 ООО "Трендсеттер". НДС не облагается по вх.д. 778730 от 25.09.2024',
+        False,
+    ),
+    (
+        "2024-05-08",
+        "Перевод средств на депозитный счет по договору №БВ-Ю-810/1100-90618308/5-24 от 08.05.2024г., НДС не облагается. по вх.д. 45412 от 08.05.2024",
+        False,
+    ),
+    (
+        "2024-04-19",
+        "Перевод средств на депозитный счет по договору №БВ-Ю-810/1100-90618308/4-24 от 19.04.2024г., НДС не облагается. по вх.д. 64739 от 19.04.2024",
+        False,
+    ),
+    (
+        "2024-03-22",
+        "Перевод средств на депозитный счет по договору №БВ-Ю-810/1100-90618308/3-24 от 22.03.2024г., НДС не облагается. по вх.д. 71267 от 22.03.2024",
+        False,
+    ),
+    (
+        "2024-03-15",
+        "Перевод средств на депозитный счет по договору №БВ-Ю-810/1100-90618308/2-24 от 15.03.2024г., НДС не облагается. по вх.д. 86931 от 15.03.2024",
+        False,
+    ),
+    (
+        "2024-03-07",
+        "Перевод средств на депозитный счет по договору №БВ-Ю-810/1100-90618308/1-24 от 07.03.2024г., НДС не облагается. по вх.д. 56739 от 07.03.2024",
+        False,
+    ),
+    (
+        "2024-01-15",
+        'Зачисление на счет по депозитному договору Б/Н от 15.01.2024 ООО "Трендсеттер" Без НДС по вх.д. 597164 от 15.01.2024',
+        False,
+    ),
+    ("2025-07-05", "Alfa Iss по чеку 04.07.25,2E26AM.НДС не обл.", True),
+    (
+        "2025-07-04",
+        '2200+5183 Внес.ср.ООО "ТРЕНДСЕТТЕР" ч-з ТУ 212724(чек 04.07.25 4U88XK) на сч.40702810802430004523 НДС не обл.',
+        True,
+    ),
+    ("2025-07-03", "возврат п/п №247", True),
+]
+
+
+def seed_rules(apps, schema_editor):
+    IntercompanyRule = apps.get_model("treasury", "IntercompanyRule")
+    IntercompanyRule.objects.bulk_create(
+        IntercompanyRule(
+            date=date.fromisoformat(d), fragment=fragment, intercompany=flag
+        )
+        for d, fragment, flag in RULES
+    )
+
+
+def unseed_rules(apps, schema_editor):
+    IntercompanyRule = apps.get_model("treasury", "IntercompanyRule")
+    for d, fragment, flag in RULES:
+        IntercompanyRule.objects.filter(
+            date=date.fromisoformat(d), fragment=fragment, intercompany=flag
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0015_intercompanyrule"),
+    ]
+
+    operations = [
+        migrations.RunPython(seed_rules, unseed_rules),
+    ]
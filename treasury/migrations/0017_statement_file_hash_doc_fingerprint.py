@@ -0,0 +1,45 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contracts", "0004_alter_contracts_regex"),
+        ("corporate", "0009_alter_countries_options_and_more"),
+        ("counterparties", "0001_initial"),
+        ("treasury", "0016_seed_intercompany_rules"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="bankstatements",
+            name="file_hash",
+            field=models.CharField(
+                blank=True,
+                db_index=True,
+                editable=False,
+                max_length=64,
+                null=True,
+                verbose_name="SHA-256 файла",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cfdata",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                max_length=32,
+                null=True,
+                verbose_name="Отпечаток документа",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cfdata",
+            index=models.Index(
+                fields=["ba", "fingerprint"], name="cfdata_ba_fingerprint"
+            ),
+        ),
+    ]
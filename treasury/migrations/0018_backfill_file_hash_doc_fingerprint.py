@@ -0,0 +1,38 @@
+# Generated by Django 5.2.10 on 2026-10-18 22:10
+
+import hashlib
+
+from django.db import migrations
+
+# Та же формула, что в treasury.models.doc_fingerprint
+BACKFILL_FINGERPRINT = """
+    UPDATE treasury_cfdata
+    SET fingerprint = md5(concat_ws('|', ba_id, date, doc_numner, dt, cr))
+    WHERE fingerprint IS NULL
+"""
+
+
+def backfill_file_hash(apps, schema_editor):
+    BankStatements = apps.get_model("treasury", "BankStatements")
+    for bs in BankStatements.objects.filter(file_hash__isnull=True).exclude(file=""):
+        # файлы старых выписок могли не сохраниться — такие пропускаем
+        try:
+            with bs.file.open("rb") as f:
+                digest = hashlib.sha256()
+                for chunk in f.chunks():
+                    digest.update(chunk)
+        except (FileNotFoundError, OSError):
+            continue
+        BankStatements.objects.filter(pk=bs.pk).update(file_hash=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0017_statement_file_hash_doc_fingerprint"),
+    ]
+
+    operations = [
+        migrations.RunSQL(BACKFILL_FINGERPRINT, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunPython(backfill_file_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,150 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0018_backfill_file_hash_doc_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="statementjob",
+            name="stage",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("parse", "Разбор файла"),
+                    ("prepare", "Подготовка операций"),
+                    ("classify", "Разноска"),
+                    ("upsert", "Загрузка операций"),
+                ],
+                max_length=20,
+                null=True,
+                verbose_name="Этап",
+            ),
+        ),
+        migrations.CreateModel(
+            name="ImportRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "format",
+                    models.CharField(
+                        blank=True,
+                        db_index=True,
+                        max_length=50,
+                        null=True,
+                        verbose_name="Формат",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("ok", "Успешно"), ("failed", "Ошибка")],
+                        default="ok",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "started_at",
+                    models.DateTimeField(db_index=True, verbose_name="Начата"),
+                ),
+                ("finished_at", models.DateTimeField(verbose_name="Завершена")),
+                ("seconds", models.FloatField(verbose_name="Время, с")),
+                (
+                    "docs",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Документов в файле"
+                    ),
+                ),
+                (
+                    "skipped",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Пропущено (уже загружены)"
+                    ),
+                ),
+                (
+                    "inserted",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Добавлено строк"
+                    ),
+                ),
+                (
+                    "updated",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Обновлено строк"
+                    ),
+                ),
+                (
+                    "cache_hits",
+                    models.IntegerField(
+                        blank=True, null=True, verbose_name="Из кэша разноски"
+                    ),
+                ),
+                (
+                    "stages",
+                    models.JSONField(blank=True, default=dict, verbose_name="Этапы"),
+                ),
+                (
+                    "queries",
+                    models.IntegerField(default=0, verbose_name="SQL-запросов"),
+                ),
+                (
+                    "query_seconds",
+                    models.FloatField(default=0, verbose_name="Время SQL, с"),
+                ),
+                (
+                    "peak_memory_mb",
+                    models.FloatField(
+                        blank=True, null=True, verbose_name="Пик памяти, МБ"
+                    ),
+                ),
+                (
+                    "result",
+                    models.TextField(blank=True, null=True, verbose_name="Результат"),
+                ),
+                (
+                    "error",
+                    models.TextField(blank=True, null=True, verbose_name="Ошибка"),
+                ),
+                (
+                    "bs",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_runs",
+                        to="treasury.bankstatements",
+                        verbose_name="Выписка",
+                    ),
+                ),
+                (
+                    "job",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="import_runs",
+                        to="treasury.statementjob",
+                        verbose_name="Задача",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Загрузка выписки",
+                "verbose_name_plural": "Загрузки выписок",
+                "ordering": ["-started_at"],
+            },
+        ),
+    ]
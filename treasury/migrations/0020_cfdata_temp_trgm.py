@@ -0,0 +1,49 @@
+# Generated by Django 5.2.10 on 2026-10-18 22:05
+
+import logging
+
+from django.conf import settings
+from django.db import migrations
+
+# Триграммный индекс необязательный: без pg_trgm на сервере (или с
+# TREASURY_TRGM_INDEX = False) миграция ничего не делает, поиск правил
+# идёт без индекса. Поставить позже — manage.py trgm_index.
+# Тот же SQL, что в treasury/services/trgm_index.py
+
+logger = logging.getLogger(__name__)
+
+
+def create_trgm_index(apps, schema_editor):
+    if not getattr(settings, "TREASURY_TRGM_INDEX", True):
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            logger.warning("pg_trgm на сервере нет — индекс cfdata_temp_trgm пропущен")
+            return
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS cfdata_temp_trgm "
+            "ON treasury_cfdata USING gin (temp gin_trgm_ops)"
+        )
+
+
+def drop_trgm_index(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP INDEX CONCURRENTLY IF EXISTS cfdata_temp_trgm")
+
+
+class Migration(migrations.Migration):
+    # индекс строится без блокировки записи в treasury_cfdata
+    atomic = False
+
+    dependencies = [
+        ("contracts", "0004_alter_contracts_regex"),
+        ("corporate", "0009_alter_countries_options_and_more"),
+        ("counterparties", "0001_initial"),
+        ("treasury", "0019_import_run"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trgm_index, drop_trgm_index),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 5.2.10 on 2026-10-18 22:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("corporate", "0009_alter_countries_options_and_more"),
+        ("treasury", "0020_cfdata_temp_trgm"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DailyBalance",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(db_index=True, verbose_name="Дата")),
+                (
+                    "opening",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=16,
+                        verbose_name="Остаток на начало дня",
+                    ),
+                ),
+                (
+                    "dt",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=16, verbose_name="Дт за день"
+                    ),
+                ),
+                (
+                    "cr",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=16, verbose_name="Кт за день"
+                    ),
+                ),
+                (
+                    "closing",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=16,
+                        verbose_name="Остаток на конец дня",
+                    ),
+                ),
+                (
+                    "period_dt",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=16,
+                        verbose_name="Дт с начала выписки",
+                    ),
+                ),
+                (
+                    "period_cr",
+                    models.DecimalField(
+                        decimal_places=2,
+                        max_digits=16,
+                        verbose_name="Кт с начала выписки",
+                    ),
+                ),
+                ("currency", models.CharField(max_length=3, verbose_name="Валюта")),
+                (
+                    "ba",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_balances",
+                        to="corporate.bankaccount",
+                        verbose_name="Расчетный счет",
+                    ),
+                ),
+                (
+                    "bs",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_balances",
+                        to="treasury.bankstatements",
+                        verbose_name="Опорная выписка",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Остаток на день",
+                "verbose_name_plural": "Остатки по дням",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ba", "date"), name="uniq_daily_balance_ba_date"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.10 on 2026-10-18 22:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Сводка по уже загруженным выпискам — тот же запрос, что services/statement_quality.py
+BACKFILL_QUALITY = """
+    INSERT INTO treasury_statementquality (
+        bs_id, rows, dt, cr,
+        missing_contract, missing_cfitem, missing_cp_final, missing_any, updated_at
+    )
+    SELECT
+        bs.id,
+        COUNT(d.id),
+        COALESCE(SUM(d.dt), 0),
+        COALESCE(SUM(d.cr), 0),
+        COUNT(d.id) FILTER (WHERE d.contract_id IS NULL),
+        COUNT(d.id) FILTER (WHERE d.cfitem_id IS NULL),
+        COUNT(d.id) FILTER (WHERE d.cp_final_id IS NULL),
+        COUNT(d.id) FILTER (
+            WHERE d.contract_id IS NULL OR d.cfitem_id IS NULL OR d.cp_final_id IS NULL
+        ),
+        now()
+    FROM treasury_bankstatements bs
+    LEFT JOIN treasury_cfdata d ON d.bs_id = bs.id
+    GROUP BY bs.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0021_daily_balance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StatementQuality",
+            fields=[
+                (
+                    "bs",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="quality",
+                        serialize=False,
+                        to="treasury.bankstatements",
+                        verbose_name="Выписка",
+                    ),
+                ),
+                ("rows", models.PositiveIntegerField(default=0, verbose_name="Строк")),
+                (
+                    "dt",
+                    models.DecimalField(
+                        decimal_places=2, default=0, max_digits=16, verbose_name="Дт"
+                    ),
+                ),
+                (
+                    "cr",
+                    models.DecimalField(
+                        decimal_places=2, default=0, max_digits=16, verbose_name="Кр"
+                    ),
+                ),
+                (
+                    "missing_contract",
+                    models.PositiveIntegerField(default=0, verbose_name="Без договора"),
+                ),
+                (
+                    "missing_cfitem",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Без статьи CF"
+                    ),
+                ),
+                (
+                    "missing_cp_final",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Без финального контрагента"
+                    ),
+                ),
+                (
+                    "missing_any",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="С незаполненными полями"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(auto_now=True, verbose_name="Пересчитано"),
+                ),
+            ],
+            options={
+                "verbose_name": "Качество выписки",
+                "verbose_name_plural": "Качество выписок",
+            },
+        ),
+        migrations.RunSQL(BACKFILL_QUALITY, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,117 @@
+# Generated by Django 5.2.10 on 2026-10-18 23:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("contracts", "0004_alter_contracts_regex"),
+        ("corporate", "0009_alter_countries_options_and_more"),
+        ("counterparties", "0001_initial"),
+        ("treasury", "0023_cf_pivot_data_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IntercompanyMatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "amount",
+                    models.DecimalField(
+                        decimal_places=2, max_digits=12, verbose_name="Сумма"
+                    ),
+                ),
+                ("currency", models.CharField(max_length=3, verbose_name="Валюта")),
+                (
+                    "out_date",
+                    models.DateField(db_index=True, verbose_name="Дата списания"),
+                ),
+                (
+                    "in_date",
+                    models.DateField(db_index=True, verbose_name="Дата зачисления"),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True, verbose_name="Сопоставлено"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Перевод между своими счетами",
+                "verbose_name_plural": "Переводы между своими счетами",
+                "ordering": ["-out_date", "-id"],
+            },
+        ),
+        migrations.AddField(
+            model_name="cfdata",
+            name="ic_status",
+            field=models.CharField(
+                blank=True,
+                choices=[("matched", "Есть пара"), ("unmatched", "Без пары")],
+                editable=False,
+                max_length=10,
+                null=True,
+                verbose_name="Перевод между своими счетами",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cfdata",
+            index=models.Index(
+                condition=models.Q(("ic_status", "unmatched")),
+                fields=["payer_account", "reciver_account"],
+                name="cfdata_ic_unmatched",
+            ),
+        ),
+        migrations.AddField(
+            model_name="intercompanymatch",
+            name="in_ba",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="corporate.bankaccount",
+                verbose_name="На счёт",
+            ),
+        ),
+        migrations.AddField(
+            model_name="intercompanymatch",
+            name="in_leg",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ic_match_in",
+                to="treasury.cfdata",
+                verbose_name="Зачисление",
+            ),
+        ),
+        migrations.AddField(
+            model_name="intercompanymatch",
+            name="out_ba",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="corporate.bankaccount",
+                verbose_name="Со счёта",
+            ),
+        ),
+        migrations.AddField(
+            model_name="intercompanymatch",
+            name="out_leg",
+            field=models.OneToOneField(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="ic_match_out",
+                to="treasury.cfdata",
+                verbose_name="Списание",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-18 23:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0024_intercompany_match"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="classificationcache",
+            name="vat_rate",
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.10 on 2026-10-18 23:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0025_classificationcache_drop_vat_rate"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="statementjob",
+            name="heartbeat_at",
+            field=models.DateTimeField(
+                blank=True, null=True, verbose_name="Сигнал воркера"
+            ),
+        ),
+    ]
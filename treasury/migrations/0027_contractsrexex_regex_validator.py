@@ -0,0 +1,24 @@
+# Generated by Django 5.2.10 on 2026-10-18 23:43
+
+import utils.bsparsers.pg_regex
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("treasury", "0026_statementjob_heartbeat"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="contractsrexex",
+            name="regex",
+            field=models.CharField(
+                default="^.*$",
+                max_length=500,
+                validators=[utils.bsparsers.pg_regex.validate_rule_regex],
+                verbose_name="RegEx",
+            ),
+        ),
+    ]
@@ -1,11 +1,48 @@
 # treasury/models.py
+import hashlib
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
 from django.db import models
+from django.db.models import Q
 from corporate.models import BankAccount,Owners, CfItems
 from contracts.models import Contracts
 from counterparties.models import Counterparty
 from django.core.exceptions import ValidationError
 
 from utils.bsparsers.bsparser import get_bs_details
+from utils.bsparsers.pg_regex import validate_rule_regex
+
+
+def file_sha256(path, chunk_size=1 << 20) -> str:
+    """SHA-256 файла, читаем кусками, чтобы не держать файл в памяти."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Отпечаток документа: один и тот же платёж в перекрывающихся выписках счёта.
+# Та же формула, что в миграции 0018: md5(concat_ws('|', ba_id, date, doc_numner, dt, cr))
+def _fingerprint_part(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (float, np.floating, Decimal)):
+        # как numeric(12,2) в Postgres; + 0.0 убирает "-0.00"
+        return f"{round(float(value), 2) + 0.0:.2f}"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def doc_fingerprint(ba_id, date, doc_numner, dt, cr) -> str:
+    # concat_ws пропускает NULL — пропускаем и мы
+    parts = [_fingerprint_part(v) for v in (ba_id, date, doc_numner, dt, cr)]
+    key = "|".join(p for p in parts if p is not None)
+    return hashlib.md5(key.encode("utf-8")).hexdigest()
 
 
 class BankStatements(models.Model):
@@ -18,6 +55,7 @@ class BankStatements(models.Model):
     bb = models.DecimalField("Начальный остаток",max_digits=12,decimal_places=2,null=True,blank=True)
     eb = models.DecimalField("Конечный остаток",max_digits=12,decimal_places=2,null=True,blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата загрузки")
+    file_hash = models.CharField("SHA-256 файла", max_length=64, null=True, blank=True, db_index=True, editable=False)
 
     class Meta:
         verbose_name = "Выписка"
@@ -25,8 +63,23 @@ class BankStatements(models.Model):
 
     def __str__(self):
         return f"{self.start}-{self.finish} {self.owner} ({self.ba})"
-    
+
+    def duplicate_of(self):
+        """Ранее загруженная выписка с тем же файлом байт в байт (или None)."""
+        if not self.file_hash:
+            return None
+        return (
+            type(self).objects
+            .filter(file_hash=self.file_hash, pk__lt=self.pk)
+            .order_by("pk")
+            .first()
+        )
+
     def save(self, *args, **kwargs):
+        # Новый файл — хэш посчитаем заново после сохранения
+        if self.file and not self.file._committed:
+            self.file_hash = None
+
         # Сначала сохраняем, чтобы файл точно оказался на диске и был путь
         is_new = self.pk is None
         super().save(*args, **kwargs)
@@ -35,13 +88,22 @@ class BankStatements(models.Model):
         if not self.file:
             return
 
+        if self.file_hash is None:
+            self.file_hash = file_sha256(self.file.path)
+            type(self).objects.filter(pk=self.pk).update(file_hash=self.file_hash)
+
         # Триггер: заполняем только если поля ещё пустые (можешь поменять условие)
         need_parse = any(v is None for v in (self.start, self.finish, self.bb, self.eb))
         if not need_parse:
             return
 
-        # Парсим файл
-        bank, start_date,end_date,bb,eb = get_bs_details(self.file.path)
+        # Тот же файл уже загружали — шапку берём оттуда, файл не разбираем
+        original = self.duplicate_of()
+        if original is not None and original.start is not None:
+            bank = original.ba.account if original.ba else None
+            start_date, end_date, bb, eb = original.start, original.finish, original.bb, original.eb
+        else:
+            bank, start_date,end_date,bb,eb = get_bs_details(self.file.path)
         
 
         self.start = start_date
@@ -71,7 +133,114 @@ class BankStatements(models.Model):
 
         self.ba_id = ba_id
         self.owner_id = owner_id
+
+        # новая выписка может стать опорной для своих дней
+        if ba_id and self.start:
+            from treasury.services.daily_balance import refresh_daily_balance
+            refresh_daily_balance(ba_id, since=self.start)
         
+class StatementJob(models.Model):
+    """
+    Очередь обработки выписок: задачи забирает воркер
+    (python manage.py process_statements).
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    STATUSES = [
+        (QUEUED, "В очереди"),
+        (RUNNING, "Выполняется"),
+        (DONE, "Готово"),
+        (FAILED, "Ошибка"),
+    ]
+
+    # Этапы update_cf_data
+    STAGES = [
+        ("parse", "Разбор файла"),
+        ("prepare", "Подготовка операций"),
+        ("classify", "Разноска"),
+        ("upsert", "Загрузка операций"),
+    ]
+
+    bs = models.ForeignKey(BankStatements, on_delete=models.CASCADE, verbose_name="Выписка", related_name="jobs")
+    status = models.CharField("Статус", max_length=20, choices=STATUSES, default=QUEUED, db_index=True)
+    stage = models.CharField("Этап", max_length=20, choices=STAGES, null=True, blank=True)
+    result = models.TextField("Результат", null=True, blank=True)
+    error = models.TextField("Ошибка", null=True, blank=True)
+    worker = models.CharField("Воркер", max_length=255, null=True, blank=True)
+    created_at = models.DateTimeField("Поставлена", auto_now_add=True)
+    started_at = models.DateTimeField("Начата", null=True, blank=True)
+    # воркер обновляет при взятии задачи и на каждом этапе; давно не обновлялся — воркер упал
+    heartbeat_at = models.DateTimeField("Сигнал воркера", null=True, blank=True)
+    finished_at = models.DateTimeField("Завершена", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Обработка выписки"
+        verbose_name_plural = "Обработка выписок"
+        ordering = ["-id"]
+
+    def __str__(self):
+        return f"{self.bs} — {self.get_status_display()}"
+
+    @property
+    def is_active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+
+class ImportRun(models.Model):
+    """
+    История загрузок выписок: время и строки по этапам, SQL-запросы,
+    пиковая память. Пишется на каждый запуск update_cf_data
+    (очередь, пакетная обработка, кнопка в карточке выписки) —
+    по ней видно, какие форматы и размеры выписок замедляются.
+    """
+
+    OK = "ok"
+    FAILED = "failed"
+
+    STATUSES = [
+        (OK, "Успешно"),
+        (FAILED, "Ошибка"),
+    ]
+
+    bs = models.ForeignKey(BankStatements, on_delete=models.CASCADE, verbose_name="Выписка", related_name="import_runs")
+    job = models.ForeignKey(StatementJob, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Задача", related_name="import_runs")
+    format = models.CharField("Формат", max_length=50, null=True, blank=True, db_index=True)
+    status = models.CharField("Статус", max_length=20, choices=STATUSES, default=OK)
+    started_at = models.DateTimeField("Начата", db_index=True)
+    finished_at = models.DateTimeField("Завершена")
+    seconds = models.FloatField("Время, с")
+    docs = models.IntegerField("Документов в файле", null=True, blank=True)
+    skipped = models.IntegerField("Пропущено (уже загружены)", null=True, blank=True)
+    inserted = models.IntegerField("Добавлено строк", null=True, blank=True)
+    updated = models.IntegerField("Обновлено строк", null=True, blank=True)
+    cache_hits = models.IntegerField("Из кэша разноски", null=True, blank=True)
+    # {"parse": {"seconds": 1.2, "rows": 5000}, "classify": {...}, "upsert": {...}}
+    stages = models.JSONField("Этапы", default=dict, blank=True)
+    queries = models.IntegerField("SQL-запросов", default=0)
+    query_seconds = models.FloatField("Время SQL, с", default=0)
+    peak_memory_mb = models.FloatField("Пик памяти, МБ", null=True, blank=True)
+    result = models.TextField("Результат", null=True, blank=True)
+    error = models.TextField("Ошибка", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Загрузка выписки"
+        verbose_name_plural = "Загрузки выписок"
+        ordering = ["-started_at"]
+
+    def __str__(self):
+        return f"{self.bs} — {self.started_at:%d.%m.%Y %H:%M} ({self.seconds:.1f} с)"
+
+    @property
+    def docs_per_second(self):
+        if not self.docs or not self.seconds:
+            return None
+        return self.docs / self.seconds
+
+
 class CfData(models.Model):
     bs = models.ForeignKey(BankStatements,on_delete=models.CASCADE,verbose_name="Выписка",null=True,blank=True)
     doc_type = models.CharField("Документ",max_length=250,null=True,blank=True)
@@ -93,6 +262,15 @@ class CfData(models.Model):
     contract = models.ForeignKey(Contracts,on_delete=models.CASCADE,null=True,blank=True,verbose_name="Договор")
     cfitem = models.ForeignKey(CfItems,on_delete=models.CASCADE,null=True,blank=True,verbose_name="Статья CF" )
     ba = models.ForeignKey(BankAccount,on_delete=models.CASCADE,null=True,blank=True,verbose_name="Расчетный счет")
+    # md5(ba_id|date|doc_numner|dt|cr) — один и тот же документ в перекрывающихся выписках счёта
+    fingerprint = models.CharField("Отпечаток документа", max_length=32, null=True, blank=True, editable=False)
+    # сверка переводов между своими счетами (services/intercompany_match.py)
+    IC_MATCHED = "matched"
+    IC_UNMATCHED = "unmatched"
+    IC_STATUSES = [(IC_MATCHED, "Есть пара"), (IC_UNMATCHED, "Без пары")]
+    ic_status = models.CharField(
+        "Перевод между своими счетами", max_length=10, choices=IC_STATUSES, null=True, blank=True, editable=False
+    )
     
     
     class Meta:
@@ -104,10 +282,138 @@ class CfData(models.Model):
                 name="uniq_cfdata_bs_row",
             )
         ]
+        indexes = [
+            models.Index(fields=["ba", "fingerprint"], name="cfdata_ba_fingerprint"),
+            # триграммный cfdata_temp_trgm (pg_trgm) — не здесь: он необязательный,
+            # его ставит миграция 0020 или manage.py trgm_index (services/trgm_index.py)
+            # вторые половины переводов без пары ищем только среди них
+            models.Index(
+                fields=["payer_account", "reciver_account"],
+                name="cfdata_ic_unmatched",
+                condition=Q(ic_status="unmatched"),
+            ),
+        ]
 
     def __str__(self):
         return f"{self.doc_type} № {self.doc_numner} от {self.doc_date} (на сумму {self.dt - self.cr})"
+
+    # поля отпечатка документа и поля, от которых зависят остатки по дням
+    FINGERPRINT_FIELDS = ("ba_id", "date", "doc_numner", "dt", "cr")
+    BALANCE_FIELDS = ("ba_id", "date", "dt", "cr", "fingerprint")
+
+    def compute_fingerprint(self) -> str:
+        # суммы — как numeric(12,2), даже если в поле пока int или строка из формы
+        dt, cr = (None if v is None else Decimal(str(v)) for v in (self.dt, self.cr))
+        return doc_fingerprint(self.ba_id, self.date, self.doc_numner, dt, cr)
     
+class DailyBalance(models.Model):
+    """
+    Остатки и обороты счёта по дням — одна строка на счёт и календарный день
+    периода его выписок. Считается так же, как остаток на дату в services/eod.py:
+    опорная выписка дня (раньше всех начинается), её входящий остаток и
+    операции счёта от её начала (один документ — один раз).
+    Поддерживается при загрузке выписок (services/daily_balance.py),
+    пересчёт целиком — manage.py rebuild_daily_balance.
+    """
+
+    ba = models.ForeignKey(BankAccount, on_delete=models.CASCADE, verbose_name="Расчетный счет", related_name="daily_balances")
+    bs = models.ForeignKey(BankStatements, on_delete=models.CASCADE, verbose_name="Опорная выписка", related_name="daily_balances")
+    date = models.DateField("Дата", db_index=True)
+    opening = models.DecimalField("Остаток на начало дня", max_digits=16, decimal_places=2)
+    dt = models.DecimalField("Дт за день", max_digits=16, decimal_places=2)
+    cr = models.DecimalField("Кт за день", max_digits=16, decimal_places=2)
+    closing = models.DecimalField("Остаток на конец дня", max_digits=16, decimal_places=2)
+    # обороты от начала опорной выписки до дня включительно
+    period_dt = models.DecimalField("Дт с начала выписки", max_digits=16, decimal_places=2)
+    period_cr = models.DecimalField("Кт с начала выписки", max_digits=16, decimal_places=2)
+    currency = models.CharField("Валюта", max_length=3)
+
+    class Meta:
+        verbose_name = "Остаток на день"
+        verbose_name_plural = "Остатки по дням"
+        constraints = [
+            models.UniqueConstraint(fields=["ba", "date"], name="uniq_daily_balance_ba_date"),
+        ]
+
+    def __str__(self):
+        return f"{self.ba} {self.date:%d.%m.%Y}: {self.closing}"
+
+
+class StatementQuality(models.Model):
+    """
+    Сводка качества разноски по выписке: строк, обороты и сколько строк
+    без договора / статьи CF / финального контрагента.
+    Считается одним GROUP BY (services/statement_quality.py) после загрузки
+    и переразноски — changelist выписок не считает её по строкам.
+    """
+
+    bs = models.OneToOneField(
+        BankStatements, on_delete=models.CASCADE, primary_key=True,
+        verbose_name="Выписка", related_name="quality",
+    )
+    rows = models.PositiveIntegerField("Строк", default=0)
+    dt = models.DecimalField("Дт", max_digits=16, decimal_places=2, default=0)
+    cr = models.DecimalField("Кр", max_digits=16, decimal_places=2, default=0)
+    missing_contract = models.PositiveIntegerField("Без договора", default=0)
+    missing_cfitem = models.PositiveIntegerField("Без статьи CF", default=0)
+    missing_cp_final = models.PositiveIntegerField("Без финального контрагента", default=0)
+    missing_any = models.PositiveIntegerField("С незаполненными полями", default=0)
+    updated_at = models.DateTimeField("Пересчитано", auto_now=True)
+
+    class Meta:
+        verbose_name = "Качество выписки"
+        verbose_name_plural = "Качество выписок"
+
+    def __str__(self):
+        return f"{self.bs}: {self.missing_any} из {self.rows}"
+
+
+class DataVersion(models.Model):
+    """
+    Счётчик версии данных: растёт при каждой записи, которая меняет
+    операции (загрузка, переразноска, правки, сплиты, дерево статей CF).
+    По нему кэши отчётов понимают, что пора пересчитать (services/data_version.py).
+    """
+
+    name = models.CharField("Набор данных", max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField("Версия", default=0)
+    updated_at = models.DateTimeField("Изменено", auto_now=True)
+
+    class Meta:
+        verbose_name = "Версия данных"
+        verbose_name_plural = "Версии данных"
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class IntercompanyMatch(models.Model):
+    """
+    Пара половин перевода между своими счетами: списание с одного счёта
+    и зачисление на другой (та же сумма, те же счета плательщика и получателя).
+    Счета, даты и валюта повторены здесь, чтобы отчёты исключали пары,
+    не читая CfData.
+    """
+
+    out_leg = models.OneToOneField(CfData, on_delete=models.CASCADE, related_name="ic_match_out", verbose_name="Списание")
+    in_leg = models.OneToOneField(CfData, on_delete=models.CASCADE, related_name="ic_match_in", verbose_name="Зачисление")
+    amount = models.DecimalField("Сумма", max_digits=12, decimal_places=2)
+    currency = models.CharField("Валюта", max_length=3)
+    out_ba = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name="+", verbose_name="Со счёта")
+    in_ba = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name="+", verbose_name="На счёт")
+    out_date = models.DateField("Дата списания", db_index=True)
+    in_date = models.DateField("Дата зачисления", db_index=True)
+    created_at = models.DateTimeField("Сопоставлено", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Перевод между своими счетами"
+        verbose_name_plural = "Переводы между своими счетами"
+        ordering = ["-out_date", "-id"]
+
+    def __str__(self):
+        return f"{self.out_date:%d.%m.%Y} {self.out_ba} → {self.in_ba}: {self.amount}"
+
+
 class CfSplits(models.Model):
     transaction = models.ForeignKey(CfData,on_delete=models.CASCADE,verbose_name='Транскация')
     dt = models.DecimalField("Дт",max_digits=12,decimal_places=2,null=True,blank=True)
@@ -125,7 +431,7 @@ class CfSplits(models.Model):
     
 class ContractsRexex(models.Model):
     cp = models.ForeignKey(Counterparty,on_delete=models.CASCADE,verbose_name='Контрагент')
-    regex = models.CharField(max_length=500,verbose_name='RegEx',default=r"^.*$")
+    regex = models.CharField(max_length=500,verbose_name='RegEx',default=r"^.*$",validators=[validate_rule_regex])
     contract = models.ForeignKey(Contracts,on_delete=models.CASCADE,verbose_name='Договор')
     comments = models.TextField('Комментарии')
     
@@ -162,4 +468,91 @@ class ContractsRexex(models.Model):
     def save(self, *args, **kwargs):
         # чтобы валидация срабатывала и в админке, и при save() из кода
         self.full_clean()
-        return super().save(*args, **kwargs)
\ No newline at end of file
+        return super().save(*args, **kwargs)
+
+class RuleChange(models.Model):
+    """
+    Журнал изменений правил разноски — версия правил растёт с каждой записью.
+    Сигналы (treasury/signals.py) пишут старый и новый шаблон правила,
+    manage.py reclassify пересчитывает только строки CfData,
+    которые мог задеть любой из них.
+    """
+
+    CONTRACT = "contract"
+    EXCEPTION = "exception"
+    CFITEM = "cfitem"
+
+    RULES = [
+        (CONTRACT, "RegEx договора"),
+        (EXCEPTION, "Исключение по контрагенту"),
+        (CFITEM, "Статья CF по договору"),
+    ]
+
+    rule = models.CharField("Правило", max_length=20, choices=RULES)
+    rule_id = models.BigIntegerField("ID правила")
+    old_regex = models.TextField("Старый RegEx", null=True, blank=True)
+    new_regex = models.TextField("Новый RegEx", null=True, blank=True)
+    # cp_id для исключения, contract_id для статьи CF
+    old_scope = models.BigIntegerField("Старая область", null=True, blank=True)
+    new_scope = models.BigIntegerField("Новая область", null=True, blank=True)
+    created_at = models.DateTimeField("Изменено", auto_now_add=True)
+    processed_at = models.DateTimeField("Пересчитано", null=True, blank=True, db_index=True)
+    rows = models.IntegerField("Строк пересчитано", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Изменение правила разноски"
+        verbose_name_plural = "Изменения правил разноски"
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"v{self.pk} {self.get_rule_display()} #{self.rule_id}"
+
+
+class ClassificationCache(models.Model):
+    """
+    Кэш разноски: повторяющиеся назначения платежа (аренда, коммуналка, маркетплейсы)
+    отличаются только датами и суммами — их не гоняем через RegEx заново.
+    fingerprint — md5 от контрагента, temp с числами, заменёнными на 0, и правил,
+    которые числа различают и совпали с текстом (Classifier.fingerprint).
+    Записи сбрасываются при изменении договоров и правил (см. treasury/signals.py).
+    """
+
+    fingerprint = models.CharField("Отпечаток", max_length=32, unique=True)
+    cp = models.ForeignKey(Counterparty, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Контрагент", related_name="+")
+    temp = models.TextField("Назначение (пример)")
+    contract = models.ForeignKey(Contracts, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Договор", related_name="+")
+    by_exception = models.BooleanField("Договор по исключению", default=False)
+    cfitem_dt = models.ForeignKey(CfItems, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Статья CF для Дт", related_name="+")
+    cfitem_cr = models.ForeignKey(CfItems, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Статья CF для Кт", related_name="+")
+    created_at = models.DateTimeField("Создано", auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Кэш разноски"
+        verbose_name_plural = "Кэш разноски"
+
+    def __str__(self):
+        return self.temp[:80]
+
+
+class IntercompanyRule(models.Model):
+    """
+    Ручные правки признака "внутригрупповой" для отдельных платежей:
+    дата платежа + фрагмент назначения -> intercompany.
+    Если на строку подходят оба вида правил, включение важнее исключения.
+    """
+
+    date = models.DateField("Дата платежа", db_index=True)
+    fragment = models.TextField("Фрагмент назначения")
+    intercompany = models.BooleanField(
+        "Внутригрупповой",
+        help_text="Включено — считать внутригрупповым, выключено — исключить из внутригрупповых",
+    )
+    comment = models.CharField("Комментарий", max_length=250, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Правило внутригрупповых"
+        verbose_name_plural = "Правила внутригрупповых"
+        ordering = ["-date", "id"]
+
+    def __str__(self):
+        return f"{self.date:%d.%m.%Y} {'+' if self.intercompany else '−'} {self.fragment[:60]}"
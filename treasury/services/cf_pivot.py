@@ -0,0 +1,216 @@
+# treasury/services/cf_pivot.py
+# Свод денежного потока: статья CF × месяц × компания × счёт.
+#
+# Один SQL-проход агрегирует операции (а где есть сплиты — сплиты) по листовым
+# статьям, дальше итоги поднимаются по дереву CfItems (MPTT) в numpy — уровень
+# за уровнем, от глубоких к корням. Куб кэшируется одной записью вместе с версией
+# данных (services/data_version.py): загрузка и правки её увеличивают, и следующий
+# запрос соберёт куб заново и перезапишет старый. Срез по компаниям / счетам / месяцам — сумма по осям.
+
+import datetime as dt
+from dataclasses import dataclass
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+
+from corporate.models import CfItems
+from treasury.services.data_version import data_version
+
+# Операция со сплитами идёт в свод сплитами (у них свои статьи и суммы).
+# Документ, лежащий в нескольких выписках, считаем один раз (fingerprint), как в EOD.
+PIVOT_SQL = """
+    WITH docs AS (
+        SELECT DISTINCT ON (fingerprint) id
+        FROM treasury_cfdata
+        WHERE fingerprint IS NOT NULL
+        ORDER BY fingerprint, id
+    ),
+    ops AS (
+        SELECT d.id, d.date, d.owner_id, d.ba_id, d.cfitem_id, d.dt, d.cr
+        FROM treasury_cfdata d
+        WHERE d.date IS NOT NULL
+          AND (d.fingerprint IS NULL OR d.id IN (SELECT id FROM docs))
+    ),
+    lines AS (
+        SELECT o.date, o.owner_id, o.ba_id, o.cfitem_id, o.dt, o.cr
+        FROM ops o
+        WHERE NOT EXISTS (SELECT 1 FROM treasury_cfsplits s WHERE s.transaction_id = o.id)
+        UNION ALL
+        SELECT o.date, o.owner_id, o.ba_id, s.cfitem_id, s.dt, s.cr
+        FROM treasury_cfsplits s
+        JOIN ops o ON o.id = s.transaction_id
+    )
+    SELECT
+        cfitem_id,
+        date_trunc('month', date)::date AS month,
+        owner_id,
+        ba_id,
+        COALESCE(SUM(dt), 0)::float8,
+        COALESCE(SUM(cr), 0)::float8
+    FROM lines
+    GROUP BY 1, 2, 3, 4
+"""
+
+# одна запись на весь кэш: куб новой версии перезаписывает старый (версия — в самом кубе)
+CACHE_KEY = "cf_pivot"
+
+NO_ITEM = "Без статьи"
+
+MEASURES = {
+    "net": "Сальдо (Дт − Кт)",
+    "dt": "Поступления (Дт)",
+    "cr": "Списания (Кт)",
+}
+
+
+def _month_range(first: dt.date, last: dt.date) -> list[dt.date]:
+    months = []
+    y, m = first.year, first.month
+    while (y, m) <= (last.year, last.month):
+        months.append(dt.date(y, m, 1))
+        y, m = (y + 1, 1) if m == 12 else (y, m + 1)
+    return months
+
+
+@dataclass
+class CfPivot:
+    """
+    Куб сумм: cube[статья, месяц, счёт, (дт, кт)], статья — вместе с подстатьями.
+    Статьи — в порядке дерева (tree_id, lft), последняя строка — операции без статьи.
+    Счёт — пара (компания, р/сч), как они встречаются в операциях.
+    """
+
+    version: int
+    item_ids: list
+    codes: list
+    names: list
+    levels: np.ndarray
+    months: list
+    owner_ids: np.ndarray  # по счетам куба; -1 — компания не указана
+    ba_ids: np.ndarray  # по счетам куба; -1 — счёт не распознан
+    cube: np.ndarray
+
+    def slice(self, owner_ids=None, ba_ids=None, start=None, end=None, measure="net", max_level=None) -> dict:
+        """
+        Срез куба: выбранные компании / счета / месяцы [start, end] и мера
+        (net, dt, cr). Возвращает месяцы, строки дерева (только с оборотами)
+        и итог — сумму по корневым статьям и "без статьи".
+        """
+        acct = np.ones(len(self.ba_ids), dtype=bool)
+        if owner_ids:
+            acct &= np.isin(self.owner_ids, [int(pk) for pk in owner_ids])
+        if ba_ids:
+            acct &= np.isin(self.ba_ids, [int(pk) for pk in ba_ids])
+
+        month_mask = np.array(
+            [(start is None or m >= start) and (end is None or m <= end) for m in self.months], dtype=bool
+        )
+        months = [m for m, keep in zip(self.months, month_mask) if keep]
+
+        # [статья, месяц, (дт, кт)]
+        part = self.cube[:, month_mask][:, :, acct].sum(axis=2)
+        if measure == "dt":
+            values = part[:, :, 0]
+        elif measure == "cr":
+            values = part[:, :, 1]
+        else:
+            values = part[:, :, 0] - part[:, :, 1]
+
+        active = np.abs(part).sum(axis=(1, 2)) > 0.005
+        if max_level is not None:
+            active &= self.levels <= max_level
+
+        totals = values.sum(axis=1)
+        rows = [
+            {
+                "id": self.item_ids[i],
+                "code": self.codes[i],
+                "name": self.names[i],
+                "level": int(self.levels[i]),
+                "values": values[i].tolist(),
+                "total": float(totals[i]),
+            }
+            for i in np.flatnonzero(active)
+        ]
+
+        # итог: корни дерева (в них уже сидят подстатьи) + операции без статьи
+        roots = self.levels == 0
+        grand = values[roots].sum(axis=0)
+        return {
+            "months": months,
+            "rows": rows,
+            "total_values": grand.tolist(),
+            "total": float(grand.sum()),
+        }
+
+
+def build_pivot(version: int = 0) -> CfPivot:
+    """Собирает куб: один запрос по операциям + дерево статей, подъём итогов в numpy."""
+    items = list(
+        CfItems.objects.order_by("tree_id", "lft").values_list("id", "code", "name", "level", "parent_id")
+    )
+    item_ids = [row[0] for row in items] + [None]
+    codes = [row[1] for row in items] + [""]
+    names = [row[2] for row in items] + [NO_ITEM]
+    levels = np.array([row[3] for row in items] + [0], dtype=np.int16)
+    index = {pk: i for i, pk in enumerate(item_ids)}
+    parents = np.array([index.get(row[4], -1) for row in items] + [-1], dtype=np.int64)
+
+    with connection.cursor() as cursor:
+        cursor.execute(PIVOT_SQL)
+        facts = cursor.fetchall()
+
+    if not facts:
+        return CfPivot(
+            version=version, item_ids=item_ids, codes=codes, names=names, levels=levels, months=[],
+            owner_ids=np.empty(0, dtype=np.int64), ba_ids=np.empty(0, dtype=np.int64),
+            cube=np.zeros((len(item_ids), 0, 0, 2)),
+        )
+
+    months = _month_range(min(f[1] for f in facts), max(f[1] for f in facts))
+    month_index = {m: i for i, m in enumerate(months)}
+    accounts = sorted({(f[2] or -1, f[3] or -1) for f in facts})
+    account_index = {a: i for i, a in enumerate(accounts)}
+
+    ii = np.fromiter((index[f[0]] for f in facts), dtype=np.int64, count=len(facts))
+    mi = np.fromiter((month_index[f[1]] for f in facts), dtype=np.int64, count=len(facts))
+    ai = np.fromiter((account_index[(f[2] or -1, f[3] or -1)] for f in facts), dtype=np.int64, count=len(facts))
+    amounts = np.array([(f[4], f[5]) for f in facts], dtype=np.float64)
+
+    cube = np.zeros((len(item_ids), len(months), len(accounts), 2))
+    np.add.at(cube, (ii, mi, ai), amounts)
+
+    # подъём по дереву: каждый уровень добавляет себя (уже с детьми) к родителю
+    for level in range(int(levels.max()), 0, -1):
+        nodes = np.flatnonzero((levels == level) & (parents >= 0))
+        np.add.at(cube, parents[nodes], cube[nodes])
+
+    return CfPivot(
+        version=version, item_ids=item_ids, codes=codes, names=names, levels=levels, months=months,
+        owner_ids=np.array([a[0] for a in accounts], dtype=np.int64),
+        ba_ids=np.array([a[1] for a in accounts], dtype=np.int64),
+        cube=cube,
+    )
+
+
+_local = {}
+
+
+def get_pivot() -> CfPivot:
+    """
+    Куб для текущей версии данных: из памяти процесса, из кэша Django
+    или собранный заново. В кэше всегда один куб — последней собранной версии.
+    """
+    version = data_version()
+    pivot = _local.get("pivot")
+    if pivot is not None and pivot.version == version:
+        return pivot
+
+    pivot = cache.get(CACHE_KEY)
+    if pivot is None or pivot.version != version:
+        pivot = build_pivot(version)
+        cache.set(CACHE_KEY, pivot, timeout=None)
+
+    _local["pivot"] = pivot
+    return pivot
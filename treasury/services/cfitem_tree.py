@@ -0,0 +1,17 @@
+# treasury/services/cfitem_tree.py
+# Пути статей CF (CfItems, MPTT) одним запросом — вместо get_ancestors() на каждую строку.
+
+from corporate.models import CfItems
+
+
+def cfitem_paths() -> dict[int, list[str]]:
+    """
+    {id статьи: [имя корня, ..., имя статьи]} для всего дерева.
+    В порядке (tree_id, lft) родитель всегда идёт раньше детей —
+    путь ребёнка = путь родителя + своё имя.
+    """
+    paths = {}
+    nodes = CfItems.objects.order_by("tree_id", "lft").values_list("id", "name", "parent_id")
+    for pk, name, parent_id in nodes:
+        paths[pk] = paths.get(parent_id, []) + [name]
+    return paths
@@ -0,0 +1,165 @@
+# treasury/services/consolidation.py
+# Консолидация по валютам: остатки и обороты счетов в одной валюте (RUB или любой другой).
+#
+# Курсы — macro.CurrencyRate (ЦБ РФ: рублей за единицу валюты). Курс на дату —
+# последний известный на эту дату или раньше: выходные и праздники берут курс
+# предыдущего рабочего дня. История курса каждой валюты — отсортированные
+# массивы дат и значений, курс на целую колонку дат — один np.searchsorted.
+# Кросс-курс к небазовой валюте — через рубль.
+# Переводы между своими счетами, у которых найдена пара (IntercompanyMatch),
+# из консолидированных оборотов исключаются — по таблице пар, без прохода по CfData.
+
+import datetime as dt
+from itertools import groupby
+
+import numpy as np
+from django.db.models import Q
+
+from macro.models import CurrencyRate
+from treasury.models import DailyBalance, IntercompanyMatch
+
+RUB = "RUB"
+UNKNOWN = "—"
+
+
+class RateTable:
+    """
+    Курсы к рублю по валютам. Загружаются одним запросом
+    (только нужные валюты, до даты until), дальше — поиск в массивах.
+    """
+
+    def __init__(self, currencies, until: dt.date | None = None):
+        self._dates = {}  # валюта -> datetime64[D] по возрастанию
+        self._rates = {}  # валюта -> рублей за единицу
+
+        codes = {c for c in currencies if c and c != RUB}
+        qs = (
+            CurrencyRate.objects
+            .filter(base_currency=RUB, currency__in=codes)
+            .order_by("currency", "date")
+            .values_list("currency", "date", "rate")
+        )
+        if until:
+            qs = qs.filter(date__lte=until)
+
+        for code, rows in groupby(qs, key=lambda row: row[0]):
+            rows = list(rows)
+            self._dates[code] = np.array([row[1] for row in rows], dtype="datetime64[D]")
+            self._rates[code] = np.array([row[2] for row in rows], dtype=np.float64)
+
+    def to_rub(self, currency: str, dates) -> np.ndarray:
+        """Рублей за единицу валюты на каждую дату; NaN — курса на дату ещё нет."""
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        if currency == RUB:
+            return np.ones(len(dates))
+        known = self._dates.get(currency)
+        if known is None:
+            return np.full(len(dates), np.nan)
+
+        pos = np.searchsorted(known, dates, side="right") - 1
+        rates = self._rates[currency][np.maximum(pos, 0)]
+        rates[pos < 0] = np.nan
+        return rates
+
+    def rate(self, currency: str, dates, base: str = RUB) -> np.ndarray:
+        """Единиц базовой валюты за единицу currency на каждую дату."""
+        rates = self.to_rub(currency, dates)
+        if base != RUB:
+            rates = rates / self.to_rub(base, dates)
+        return rates
+
+    def convert(self, amounts, currencies, dates, base: str = RUB) -> np.ndarray:
+        """
+        Суммы в базовую валюту по курсу на дату каждой строки.
+        Колонки одной длины; валюты в колонке — любые, NaN — нет курса.
+        """
+        amounts = np.asarray(amounts, dtype=np.float64)
+        currencies = np.asarray(currencies, dtype=object)
+        dates = np.asarray(dates, dtype="datetime64[D]")
+
+        result = np.full(len(amounts), np.nan)
+        if not len(amounts):
+            return result
+        codes, inverse = np.unique(currencies.astype(str), return_inverse=True)
+        for i, code in enumerate(codes):
+            rows = inverse == i
+            result[rows] = amounts[rows] * self.rate(code, dates[rows], base)
+        return result
+
+
+def _summary(base: str, measures: dict) -> dict:
+    """
+    Итоги в базовой валюте. measures: мера -> (суммы, валюты, суммы в базовой валюте).
+    Валюты, ненулевые суммы которых пересчитать не удалось (нет курса), — в missing.
+    """
+    result, missing = {"base": base}, set()
+    for name, (amounts, currencies, converted) in measures.items():
+        lost = np.isnan(converted) & (np.asarray(amounts, dtype=np.float64) != 0)
+        missing.update(currencies[i] or UNKNOWN for i in np.flatnonzero(lost))
+        result[name] = round(float(np.nansum(converted)), 2)
+    result["missing"] = sorted(missing)
+    return result
+
+
+def consolidate_balances(balances, selected_date: dt.date, base: str = RUB, net_intercompany: bool = True) -> dict:
+    """
+    Остатки на дату (eod_balances) в базовой валюте: остаток — по курсу на дату,
+    обороты периода — по курсу каждого дня (дневные обороты из DailyBalance).
+    net_intercompany — не считать в оборотах переводы, обе половины которых
+    на счетах из balances (на остатке группы они и так не сказываются).
+    """
+    base = base.upper()
+    currencies = [(b.currency or "").upper() for b in balances]
+    rates = RateTable(set(currencies) | {base}, until=selected_date)
+
+    dates = np.full(len(balances), np.datetime64(selected_date, "D"))
+    closing = [float(b.closing or 0) for b in balances]
+
+    # обороты периода: дни от начала опорной выписки счёта до даты
+    starts = {b.ba_id: b.bs.start for b in balances if b.ba_id and b.bs_id}
+    days = list(
+        DailyBalance.objects
+        .filter(ba_id__in=starts, date__lte=selected_date, date__gte=min(starts.values(), default=selected_date))
+        .values_list("ba_id", "date", "currency", "dt", "cr")
+    )
+    days = [d for d in days if d[1] >= starts[d[0]]]
+    day_dates = [d[1] for d in days]
+    day_currencies = [(d[2] or "").upper() for d in days]
+    day_dt = [float(d[3]) for d in days]
+    day_cr = [float(d[4]) for d in days]
+
+    if net_intercompany and starts:
+        first = min(starts.values())
+        pairs = (
+            IntercompanyMatch.objects
+            .filter(out_ba_id__in=starts, in_ba_id__in=starts)
+            .filter(Q(out_date__range=(first, selected_date)) | Q(in_date__range=(first, selected_date)))
+            .values_list("out_ba_id", "out_date", "in_ba_id", "in_date", "currency", "amount")
+        )
+        # каждая половина — в своём дне, если он в периоде своего счёта
+        for out_ba_id, out_date, in_ba_id, in_date, currency, amount in pairs:
+            if starts[out_ba_id] <= out_date <= selected_date:
+                day_dates.append(out_date)
+                day_currencies.append(currency.upper())
+                day_dt.append(0.0)
+                day_cr.append(-float(amount))
+            if starts[in_ba_id] <= in_date <= selected_date:
+                day_dates.append(in_date)
+                day_currencies.append(currency.upper())
+                day_dt.append(-float(amount))
+                day_cr.append(0.0)
+
+    # счета без DailyBalance (выписки без распознанного счёта) — оборот периода целиком
+    orphans = [b for b in balances if not b.ba_id]
+    day_dates += [selected_date] * len(orphans)
+    day_currencies += [(b.currency or "").upper() for b in orphans]
+    day_dt += [float(b.period_dt or 0) for b in orphans]
+    day_cr += [float(b.period_cr or 0) for b in orphans]
+
+    summary = _summary(base, {
+        "eod": (closing, currencies, rates.convert(closing, currencies, dates, base)),
+        "dt": (day_dt, day_currencies, rates.convert(day_dt, day_currencies, day_dates, base)),
+        "cr": (day_cr, day_currencies, rates.convert(day_cr, day_currencies, day_dates, base)),
+    })
+    summary.update(date=selected_date, cnt=len(balances))
+    return summary
@@ -0,0 +1,140 @@
+# treasury/services/daily_balance.py
+# Остатки по дням (DailyBalance): пересчёт по счёту от даты и целиком.
+#
+# Правила те же, что у остатка на дату (services/eod.py): на каждый день
+# опорная выписка — та, что раньше всех начинается; остаток дня —
+# её входящий остаток плюс обороты счёта от её начала до дня.
+# Документ, лежащий в нескольких выписках, считаем один раз (fingerprint).
+
+from datetime import date as date_type, datetime, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from corporate.models import BankAccount
+from treasury.models import BankStatements, DailyBalance
+
+ZERO = Decimal("0.00")
+
+# Обороты счёта по дням, документ с отпечатком — один раз
+DAILY_TURNOVER_SQL = """
+    SELECT date, COALESCE(SUM(dt), 0), COALESCE(SUM(cr), 0)
+    FROM (
+        SELECT DISTINCT ON (fingerprint) date, dt, cr
+        FROM treasury_cfdata
+        WHERE ba_id = %(ba_id)s AND date BETWEEN %(lo)s AND %(hi)s AND fingerprint IS NOT NULL
+        ORDER BY fingerprint, id
+    ) AS docs
+    GROUP BY date
+    UNION ALL
+    SELECT date, COALESCE(SUM(dt), 0), COALESCE(SUM(cr), 0)
+    FROM treasury_cfdata
+    WHERE ba_id = %(ba_id)s AND date BETWEEN %(lo)s AND %(hi)s AND fingerprint IS NULL
+    GROUP BY date
+"""
+
+
+def _days(start: date_type, finish: date_type):
+    for n in range((finish - start).days + 1):
+        yield start + timedelta(days=n)
+
+
+def _turnover(ba_id, lo, hi) -> dict:
+    """{дата: [дт, кт]} за период."""
+    result = {}
+    with connection.cursor() as cursor:
+        cursor.execute(DAILY_TURNOVER_SQL, {"ba_id": ba_id, "lo": lo, "hi": hi})
+        for day, dt, cr in cursor.fetchall():
+            acc = result.setdefault(day, [ZERO, ZERO])
+            acc[0] += dt
+            acc[1] += cr
+    return result
+
+
+def refresh_daily_balance(ba_id, since: date_type | None = None) -> int:
+    """
+    Пересчитывает остатки счёта с даты since (None — целиком).
+    Более ранние дни от новых операций и выписок не меняются:
+    выписка влияет только на дни от своего начала.
+    Returns:
+        число записанных дней
+    """
+    if isinstance(since, datetime):  # в т.ч. pd.Timestamp из парсеров
+        since = since.date()
+
+    currency = BankAccount.objects.filter(pk=ba_id).values_list("currency", flat=True).first()
+    if currency is None:
+        return 0
+
+    statements = (
+        BankStatements.objects
+        .filter(ba_id=ba_id, start__isnull=False, finish__isnull=False)
+        .order_by("start", "id")
+        .values("id", "start", "finish", "bb")
+    )
+
+    # опорная выписка каждого дня: первая по началу, которая его покрывает
+    anchors = {}
+    for bs in statements:
+        for day in _days(max(bs["start"], since) if since else bs["start"], bs["finish"]):
+            anchors.setdefault(day, bs)
+
+    rows = []
+    if anchors:
+        lo = min(bs["start"] for bs in anchors.values())
+        hi = max(anchors)
+        turnover = _turnover(ba_id, lo, hi)
+
+        # накопленные обороты на конец каждого дня [lo, hi]
+        cumulative = {lo - timedelta(days=1): (ZERO, ZERO)}
+        total_dt = total_cr = ZERO
+        for day in _days(lo, hi):
+            dt, cr = turnover.get(day, (ZERO, ZERO))
+            total_dt += dt
+            total_cr += cr
+            cumulative[day] = (total_dt, total_cr)
+
+        for day in sorted(anchors):
+            bs = anchors[day]
+            dt, cr = turnover.get(day, (ZERO, ZERO))
+            before_dt, before_cr = cumulative[bs["start"] - timedelta(days=1)]
+            period_dt = cumulative[day][0] - before_dt
+            period_cr = cumulative[day][1] - before_cr
+            closing = (bs["bb"] or ZERO) + period_dt - period_cr
+            rows.append(DailyBalance(
+                ba_id=ba_id, bs_id=bs["id"], date=day, currency=currency,
+                opening=closing - dt + cr, dt=dt, cr=cr, closing=closing,
+                period_dt=period_dt, period_cr=period_cr,
+            ))
+
+    with transaction.atomic():
+        stale = DailyBalance.objects.filter(ba_id=ba_id)
+        if since:
+            stale = stale.filter(date__gte=since)
+        stale.delete()
+        DailyBalance.objects.bulk_create(rows, batch_size=1_000)
+
+    return len(rows)
+
+
+def rebuild_daily_balance(ba_ids=None) -> int:
+    """Полный пересчёт по счетам ba_ids (None — все счета с выписками)."""
+    if ba_ids is None:
+        ba_ids = BankStatements.objects.filter(ba__isnull=False).values_list("ba_id", flat=True).distinct()
+        # остатки счетов, у которых выписок не осталось
+        DailyBalance.objects.exclude(ba_id__in=ba_ids).delete()
+
+    return sum(refresh_daily_balance(ba_id) for ba_id in list(ba_ids))
+
+
+def refresh_daily_balances(points) -> int:
+    """
+    Пересчёт после правки операций: points — пары (ba_id, дата) задетых строк.
+    По каждому счёту один пересчёт — с самой ранней задетой даты.
+    """
+    since = {}
+    for ba_id, day in points:
+        if ba_id is None or day is None:
+            continue
+        since[ba_id] = min(since.get(ba_id, day), day)
+    return sum(refresh_daily_balance(ba_id, since=day) for ba_id, day in since.items())
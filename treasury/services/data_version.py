@@ -0,0 +1,29 @@
+# treasury/services/data_version.py
+# Версия данных CfData для кэшей отчётов (DataVersion).
+# Кто меняет операции — вызывает bump_data_version(), кэш сводов
+# держится под ключом с номером версии и сам становится неактуальным.
+
+from django.db import connection
+
+from treasury.models import DataVersion
+
+CFDATA = "cfdata"
+
+BUMP_SQL = """
+    INSERT INTO treasury_dataversion (name, version, updated_at)
+    VALUES (%s, 1, now())
+    ON CONFLICT (name) DO UPDATE
+    SET version = treasury_dataversion.version + 1, updated_at = now()
+    RETURNING version
+"""
+
+
+def bump_data_version(name: str = CFDATA) -> int:
+    """Увеличивает версию набора данных (одним запросом) и возвращает новую."""
+    with connection.cursor() as cursor:
+        cursor.execute(BUMP_SQL, [name])
+        return cursor.fetchone()[0]
+
+
+def data_version(name: str = CFDATA) -> int:
+    return DataVersion.objects.filter(pk=name).values_list("version", flat=True).first() or 0
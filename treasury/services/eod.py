@@ -0,0 +1,90 @@
+# treasury/services/eod.py
+# Остаток на дату: выписки, покрывающие дату, и операции до неё.
+#
+# Выписки по одному счёту могут перекрываться (месячная + квартальная).
+# Складывать их нельзя — одни и те же платежи посчитаются дважды.
+# Поэтому на каждый счёт берём одну опорную выписку (раньше всех начинается),
+# её входящий остаток и все операции счёта от её начала до даты —
+# в какой бы выписке они ни лежали.
+# По счетам это уже посчитано по дням в DailyBalance (services/daily_balance.py).
+
+from decimal import Decimal
+
+from django.db.models import Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from treasury.models import BankStatements, CfData, DailyBalance
+
+
+def eod_balances(selected_date, owner_id=None, ba_id=None) -> list[DailyBalance]:
+    """
+    Остатки на дату: по одной строке DailyBalance на счёт (один запрос).
+    Выписки без распознанного счёта в DailyBalance не попадают —
+    для них остаток считаем по операциям выписки (несохранённый DailyBalance).
+    """
+    balances = (
+        DailyBalance.objects
+        .filter(date=selected_date)
+        .select_related("bs", "bs__owner", "ba", "ba__bank")
+        .order_by("ba_id")
+    )
+    if owner_id:
+        balances = balances.filter(ba__corporate_id=owner_id)
+    if ba_id:
+        balances = balances.filter(ba_id=ba_id)
+    balances = list(balances)
+
+    if ba_id:
+        return balances
+
+    orphans = (
+        BankStatements.objects
+        .filter(ba__isnull=True, start__lte=selected_date, finish__gte=selected_date)
+        .select_related("owner")
+        .order_by("start", "id")
+    )
+    if owner_id:
+        orphans = orphans.filter(owner_id=owner_id)
+
+    for bs in orphans:
+        agg = statement_rows(bs, selected_date).aggregate(
+            dt=Coalesce(Sum("dt"), Decimal("0.00")),
+            cr=Coalesce(Sum("cr"), Decimal("0.00")),
+        )
+        balances.append(DailyBalance(
+            bs=bs, date=selected_date, currency="",
+            period_dt=agg["dt"], period_cr=agg["cr"],
+            closing=(bs.bb or Decimal("0.00")) + agg["dt"] - agg["cr"],
+        ))
+    return balances
+
+
+def _statement_rows(bs: BankStatements) -> Q:
+    if bs.ba_id is None:
+        return Q(bs_id=bs.pk)
+    return Q(ba_id=bs.ba_id, date__gte=bs.start)
+
+
+def eod_rows(anchors, selected_date):
+    """
+    Операции опорных выписок до даты включительно.
+    Один документ (CfData.fingerprint) считаем один раз: строки,
+    загруженные до дедупликации, могут повторяться в нескольких выписках.
+    """
+    if not anchors:
+        return CfData.objects.none()
+
+    cond = Q()
+    for bs in anchors:
+        cond |= _statement_rows(bs)
+
+    base = CfData.objects.filter(cond, date__lte=selected_date)
+    first = base.filter(fingerprint__isnull=False).order_by("fingerprint", "id").distinct("fingerprint")
+    return CfData.objects.filter(
+        Q(id__in=Subquery(first.values("id"))) | Q(cond, date__lte=selected_date, fingerprint__isnull=True)
+    )
+
+
+def statement_rows(bs: BankStatements, selected_date):
+    """Операции одной опорной выписки до даты (см. eod_rows)."""
+    return eod_rows([bs], selected_date)
@@ -0,0 +1,252 @@
+# treasury/services/import_runs.py
+# Замеры загрузки выписки: время этапов, SQL-запросы, память -> ImportRun
+#
+# Память — пик RSS процесса за время загрузки сверх RSS на её старте, в МБ:
+# сколько памяти загрузке понадобилось дополнительно. Разбор файлов в пуле
+# процессов (пакетная загрузка) сюда не входит. Без /proc (не Linux) —
+# прирост ru_maxrss за загрузку: 0, если раньше процесс уже поднимался выше.
+
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from treasury.models import ImportRun
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+MB = 1024 * 1024
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> int | None:
+    """RSS процесса в байтах из /proc/self/statm; None — не Linux."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def max_rss() -> int | None:
+    """Пиковый RSS процесса за всё время в байтах (ru_maxrss: Linux — КБ, macOS — байты)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemoryWatch:
+    """
+    Пик RSS по открытым окнам замера. Один фоновый поток на процесс
+    раз в INTERVAL секунд читает RSS и поднимает пик всех открытых окон;
+    поток работает, пока есть хотя бы одно окно.
+    """
+
+    INTERVAL = 0.02
+
+    def __init__(self):
+        self._windows = {}  # ключ -> [RSS на старте, пик]
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def open(self, key):
+        rss = current_rss()
+        with self._lock:
+            if rss is None:
+                self._windows[key] = [max_rss(), None]
+                return
+            self._windows[key] = [rss, rss]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, name="import-memory-watch", daemon=True)
+                self._thread.start()
+
+    def close(self, key) -> float | None:
+        """Пик сверх старта окна, МБ."""
+        rss = current_rss()
+        with self._lock:
+            window = self._windows.pop(key, None)
+        if window is None:
+            return None
+        baseline, peak = window
+        if peak is None:  # без /proc — прирост пожизненного пика
+            now = max_rss()
+            return None if baseline is None or now is None else (now - baseline) / MB
+        return (max(peak, rss or 0) - baseline) / MB
+
+    def _poll(self):
+        while True:
+            rss = current_rss()
+            with self._lock:
+                if not self._windows:
+                    self._thread = None
+                    return
+                for window in self._windows.values():
+                    if window[1] is not None and rss > window[1]:
+                        window[1] = rss
+            time.sleep(self.INTERVAL)
+
+
+memory_watch = MemoryWatch()
+
+
+class ImportRecorder:
+    """
+    Один запуск загрузки выписки.
+
+        recorder = ImportRecorder(bs.pk, job)
+        with recorder.counting():
+            result = update_cf_data(path, bs.pk, progress=recorder.progress, stats=recorder.stats)
+        recorder.finish(result)
+
+    progress(stage) совместим с callback из bsupdater: каждый вызов
+    закрывает предыдущий этап. Сам объект — connection.execute_wrapper,
+    считает запросы и их время (COPY сюда не попадает).
+    Память меряется от restart() до finish() (см. MemoryWatch).
+    """
+
+    def __init__(self, bs_id, job=None, on_stage=None):
+        self.bs_id = bs_id
+        self.job = job
+        self.on_stage = on_stage
+        self.stats = {}
+        self.restart()
+
+    def restart(self):
+        """Начать замер заново (в пакете — когда до выписки дошла очередь записи)."""
+        self.started_at = timezone.now()
+        self._started = time.perf_counter()
+        self.stage_seconds = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self._stage = None
+        self._stage_started = None
+        memory_watch.open(self)
+
+    def progress(self, stage):
+        self._close_stage()
+        self._stage = stage
+        self._stage_started = time.perf_counter()
+        if self.on_stage is not None:
+            self.on_stage(stage)
+
+    def _close_stage(self):
+        if self._stage is not None:
+            elapsed = time.perf_counter() - self._stage_started
+            self.stage_seconds[self._stage] = self.stage_seconds.get(self._stage, 0.0) + elapsed
+            self._stage = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - started
+
+    @contextmanager
+    def counting(self):
+        with connection.execute_wrapper(self):
+            yield self
+
+    def _stages(self) -> dict:
+        rows = {
+            "parse": self.stats.get("docs"),
+            "prepare": self.stats.get("docs"),
+            "classify": self.stats.get("rows"),
+            "upsert": (
+                self.stats["inserted"] + self.stats["updated"]
+                if "inserted" in self.stats else None
+            ),
+        }
+        # в пакете разбор идёт в пуле процессов, его время приходит в stats
+        seconds = dict(self.stage_seconds)
+        if "parse_seconds" in self.stats:
+            seconds["parse"] = self.stats["parse_seconds"]
+        return {
+            stage: {"seconds": round(value, 4), "rows": rows.get(stage)}
+            for stage, value in seconds.items()
+        }
+
+    def finish(self, result) -> ImportRun:
+        self._close_stage()
+        peak_memory_mb = memory_watch.close(self)
+        # разбор в пуле процессов шёл до restart() — добавляем его время
+        seconds = time.perf_counter() - self._started + self.stats.get("parse_seconds", 0.0)
+        failed = isinstance(result, Exception)
+
+        return ImportRun.objects.create(
+            bs_id=self.bs_id,
+            job=self.job,
+            format=self.stats.get("format"),
+            status=ImportRun.FAILED if failed else ImportRun.OK,
+            started_at=self.started_at,
+            finished_at=timezone.now(),
+            seconds=seconds,
+            docs=self.stats.get("docs"),
+            skipped=self.stats.get("skipped"),
+            inserted=self.stats.get("inserted"),
+            updated=self.stats.get("updated"),
+            cache_hits=self.stats.get("cache_hits"),
+            stages=self._stages(),
+            queries=self.queries,
+            query_seconds=self.query_seconds,
+            peak_memory_mb=peak_memory_mb,
+            result=None if failed else result,
+            error="".join(traceback.format_exception(result)) if failed else None,
+        )
+
+
+def import_trends(days: int = 90) -> dict:
+    """
+    Данные для графиков скорости загрузки за последние days дней:
+    точки по запускам (формат, документы, время, этапы) и средние по этапам.
+    """
+    since = timezone.now() - timedelta(days=days)
+    runs = list(
+        ImportRun.objects
+        .filter(started_at__gte=since)
+        .select_related("bs", "bs__ba")
+        .order_by("started_at")
+    )
+
+    points = []
+    stage_totals = {}
+    for run in runs:
+        fmt = run.format or "—"
+        points.append({
+            "id": run.pk,
+            "bs": run.bs_id,
+            "account": run.bs.ba.account if run.bs.ba else None,
+            "format": fmt,
+            "status": run.status,
+            "started_at": run.started_at.isoformat(),
+            "docs": run.docs,
+            "seconds": round(run.seconds, 3),
+            "docs_per_second": round(run.docs_per_second, 1) if run.docs_per_second else None,
+            "queries": run.queries,
+            "query_seconds": round(run.query_seconds, 3),
+            "peak_memory_mb": round(run.peak_memory_mb, 1) if run.peak_memory_mb else None,
+            "stages": {stage: data["seconds"] for stage, data in run.stages.items()},
+        })
+        if run.status == ImportRun.OK:
+            by_stage = stage_totals.setdefault(fmt, {"runs": 0})
+            by_stage["runs"] += 1
+            for stage, data in run.stages.items():
+                by_stage[stage] = by_stage.get(stage, 0.0) + data["seconds"]
+
+    stage_avg = {
+        fmt: {stage: value / totals["runs"] for stage, value in totals.items() if stage != "runs"}
+        for fmt, totals in stage_totals.items()
+    }
+    return {"runs": points, "stage_avg": stage_avg}
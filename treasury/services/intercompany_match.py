@@ -0,0 +1,167 @@
+# treasury/services/intercompany_match.py
+# Сверка переводов между своими счетами.
+#
+# Перевод со счёта A на счёт B лежит в двух выписках: списание в выписке A
+# и зачисление в выписке B. У обеих половин одни и те же сумма, счёт плательщика
+# и счёт получателя — по этому ключу половины соединяются через словарь (хэш),
+# из кандидатов берётся ближайший по дате в пределах окна.
+# Пары пишутся в IntercompanyMatch, половины без пары помечаются в CfData.ic_status.
+# После загрузки выписки сверяются только её строки: вторые половины ищутся
+# среди ещё не сопоставленных (частичный индекс cfdata_ic_unmatched).
+
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from treasury.models import CfData, IntercompanyMatch
+
+Leg = namedtuple("Leg", "id date ba_id other_ba_id currency is_out amount payer_account reciver_account")
+
+# Половина перевода: строка нашего счёта, второй счёт — тоже наш и в той же валюте.
+# Списание — Кт со счёта плательщика, зачисление — Дт на счёт получателя.
+# Документ из перекрывающихся выписок берём один раз (fingerprint).
+LEGS_SQL = """
+    SELECT DISTINCT ON (COALESCE(d.fingerprint, d.id::text))
+        d.id, d.date, d.ba_id, other.id, own.currency,
+        d.payer_account = own.account AS is_out,
+        CASE WHEN d.payer_account = own.account THEN d.cr ELSE d.dt END,
+        d.payer_account, d.reciver_account
+    FROM treasury_cfdata d
+    JOIN corporate_bankaccount own ON own.id = d.ba_id
+    JOIN corporate_bankaccount other
+      ON other.account = CASE WHEN d.payer_account = own.account THEN d.reciver_account ELSE d.payer_account END
+     AND other.id <> own.id
+     AND other.currency = own.currency
+    WHERE d.date IS NOT NULL
+      AND ((d.payer_account = own.account AND d.cr > 0) OR (d.reciver_account = own.account AND d.dt > 0))
+      {scope}
+    ORDER BY COALESCE(d.fingerprint, d.id::text), d.id
+"""
+
+# строки выписки, ещё не попавшие в пары
+STATEMENT_SCOPE = "AND d.bs_id = %(bs_id)s AND d.ic_status IS DISTINCT FROM 'matched'"
+
+# вторые половины: только без пары, по ключам счетов и в окне дат
+COUNTERPART_SCOPE = """
+    AND d.ic_status = 'unmatched'
+    AND (d.payer_account, d.reciver_account) IN (
+        SELECT * FROM unnest(%(payers)s::text[], %(recivers)s::text[])
+    )
+    AND d.date BETWEEN %(lo)s AND %(hi)s
+"""
+
+ALL_SCOPE = "AND d.ic_status IS DISTINCT FROM 'matched'"
+
+SET_STATUS_SQL = """
+    UPDATE treasury_cfdata SET ic_status = %s
+    WHERE id = ANY(%s) AND ic_status IS DISTINCT FROM %s
+"""
+
+
+def _window(window):
+    return settings.INTERCOMPANY_MATCH_WINDOW_DAYS if window is None else window
+
+
+def _lock():
+    """Сверки из параллельных загрузок идут по очереди: одна половина — одна пара."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('treasury_intercompany_match'))")
+
+
+def _legs(scope: str, params: dict) -> list[Leg]:
+    with connection.cursor() as cursor:
+        cursor.execute(LEGS_SQL.format(scope=scope), params)
+        return [Leg(*row) for row in cursor.fetchall()]
+
+
+def pair_legs(legs, window: int) -> list[tuple[Leg, Leg]]:
+    """
+    Хэш-соединение по (сумма, счёт плательщика, счёт получателя).
+    Списания идут по дате, каждому — ближайшее свободное зачисление,
+    если между ними не больше window дней.
+    """
+    inflows = defaultdict(list)
+    for leg in legs:
+        if not leg.is_out:
+            inflows[(leg.amount, leg.payer_account, leg.reciver_account)].append(leg)
+
+    pairs = []
+    for out in sorted((leg for leg in legs if leg.is_out), key=lambda leg: (leg.date, leg.id)):
+        candidates = inflows.get((out.amount, out.payer_account, out.reciver_account))
+        if not candidates:
+            continue
+        best = min(candidates, key=lambda leg: (abs((leg.date - out.date).days), leg.id))
+        if abs((best.date - out.date).days) > window:
+            continue
+        candidates.remove(best)
+        pairs.append((out, best))
+    return pairs
+
+
+def _save(pairs, legs) -> dict:
+    """Пишет пары и статусы: половины из pairs — с парой, остальные из legs — без пары."""
+    IntercompanyMatch.objects.bulk_create(
+        [
+            IntercompanyMatch(
+                out_leg_id=out.id, in_leg_id=inflow.id, amount=out.amount, currency=out.currency,
+                out_ba_id=out.ba_id, in_ba_id=inflow.ba_id, out_date=out.date, in_date=inflow.date,
+            )
+            for out, inflow in pairs
+        ],
+        batch_size=1_000,
+    )
+
+    matched = {leg.id for pair in pairs for leg in pair}
+    unmatched = [leg.id for leg in legs if leg.id not in matched]
+    with connection.cursor() as cursor:
+        cursor.execute(SET_STATUS_SQL, [CfData.IC_MATCHED, list(matched), CfData.IC_MATCHED])
+        cursor.execute(SET_STATUS_SQL, [CfData.IC_UNMATCHED, unmatched, CfData.IC_UNMATCHED])
+
+    return {"legs": len(legs), "pairs": len(pairs), "unmatched": len(unmatched)}
+
+
+def match_statement(bs_id, window: int | None = None) -> dict:
+    """
+    Сверка после загрузки выписки: её половины переводов против
+    несопоставленных половин других счетов.
+    Returns:
+        {"legs": половин в выписке, "pairs": новых пар, "unmatched": осталось без пары}
+    """
+    window = _window(window)
+    with transaction.atomic():
+        _lock()
+        legs = _legs(STATEMENT_SCOPE, {"bs_id": bs_id})
+        if not legs:
+            return {"legs": 0, "pairs": 0, "unmatched": 0}
+
+        keys = {(leg.payer_account, leg.reciver_account) for leg in legs}
+        counterparts = _legs(COUNTERPART_SCOPE, {
+            "payers": [k[0] for k in keys],
+            "recivers": [k[1] for k in keys],
+            "lo": min(leg.date for leg in legs) - timedelta(days=window),
+            "hi": max(leg.date for leg in legs) + timedelta(days=window),
+        })
+        own = {leg.id for leg in legs}
+        pairs = pair_legs(legs + [leg for leg in counterparts if leg.id not in own], window)
+
+        return _save(pairs, legs)
+
+
+def match_all(window: int | None = None, reset: bool = False) -> dict:
+    """
+    Сверка по всей таблице: первый запуск на старых данных, смена окна.
+    reset — удалить найденные пары и сопоставить всё заново.
+    """
+    window = _window(window)
+    with transaction.atomic():
+        _lock()
+        if reset:
+            # мимо сигналов: статусы всё равно пересчитываются ниже
+            with connection.cursor() as cursor:
+                cursor.execute("DELETE FROM treasury_intercompanymatch")
+                cursor.execute("UPDATE treasury_cfdata SET ic_status = NULL WHERE ic_status IS NOT NULL")
+
+        legs = _legs(ALL_SCOPE, {})
+        return _save(pair_legs(legs, window), legs)
@@ -0,0 +1,301 @@
+# treasury/services/reclassify.py
+# Точечная переразноска CfData после изменения правил (RuleChange)
+
+import logging
+from collections import defaultdict
+
+import pandas as pd
+from django.db import connection, transaction
+from django.utils import timezone
+
+from treasury.models import BankStatements, CfData, ClassificationCache, RuleChange
+from treasury.services.data_version import bump_data_version
+from treasury.services.statement_quality import refresh_statement_quality
+from treasury.services.trgm_index import has_trgm_index
+from utils.bsparsers.classifier import Classifier, normalize_temp
+from utils.bsparsers.contract_matcher import required_literals
+from utils.bsparsers.pg_regex import reads_digits
+
+logger = logging.getLogger(__name__)
+
+# Сколько поисков affected_rows склеиваем в один запрос
+BRANCHES_PER_QUERY = 500
+
+# Без триграммного индекса до стольких изменений один проход по таблице
+# не медленнее отдельных поисков (manage.py bench_reclassify, 100 тыс. строк:
+# 50 изменений 4,2 с против 5,4 с, 200 — поровну, 774 — 114 с против 76 с).
+# С индексом поиски быстрее всегда: 100 изменений 3,1 с -> 0,8 с, 774 — 112 с -> 5,7 с
+SCAN_MAX_CHANGES = 200
+
+
+def _escape_like(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _match(pattern, key, params, empty_matches=True) -> str | None:
+    """
+    SQL-условие "шаблон может совпасть со строкой d".
+    ~* с шаблоном-константой Postgres проверяет по триграммному индексу
+    cfdata_temp_trgm (если он есть), дешёвый ILIKE по обязательным кускам — при перепроверке строк.
+    """
+    if pattern is None:
+        return None
+    if pattern == "":
+        # пустой RegEx в ~* совпадает с чем угодно
+        return "d.temp IS NOT NULL" if empty_matches else None
+
+    params[f"{key}_rx"] = pattern
+    cond = f"d.temp ~* %({key}_rx)s"
+
+    literals = required_literals(pattern)
+    if literals:
+        params[f"{key}_like"] = [f"%{_escape_like(s)}%" for s in literals]
+        cond = f"d.temp ILIKE ANY(%({key}_like)s) AND {cond}"
+
+    return cond
+
+
+def _cache_match(pattern, key, params, empty_matches=True) -> str | None:
+    """
+    То же для записей ClassificationCache. temp записи — лишь пример текстов с её ключом:
+    шаблон, который различает числа, мог совпасть с другим текстом той же маски.
+    Для такого шаблона сравниваем обязательные куски по маске (числа -> 0),
+    а без кусков считаем задетыми все записи.
+    """
+    if not reads_digits(pattern):
+        return _match(pattern, key, params, empty_matches)
+    literals = required_literals(pattern)
+    if not literals:
+        return "d.temp IS NOT NULL"
+    params[f"{key}_masked"] = [f"%{_escape_like(normalize_temp(s))}%" for s in literals]
+    return f"regexp_replace(d.temp, '[0-9]+', '0', 'g') ILIKE ANY(%({key}_masked)s)"
+
+
+def _change_branches(change: RuleChange, params: dict, match=_match) -> list[str]:
+    """
+    Условия, по которым изменение могло задеть строку: старый или новый шаблон.
+    Каждое условие само по себе индексируемо (договор, контрагент или триграммы temp).
+    """
+    key = f"c{change.pk}"
+    parts = []
+
+    if change.rule == RuleChange.CONTRACT:
+        params[f"{key}_id"] = change.rule_id
+        parts.append(f"d.contract_id = %({key}_id)s")
+        for n, pattern in enumerate((change.old_regex, change.new_regex)):
+            cond = match(pattern, f"{key}_{n}", params, empty_matches=False)
+            if cond:
+                parts.append(cond)
+    else:
+        # исключение — в пределах контрагента, статья CF — в пределах договора
+        column = "d.cp_id" if change.rule == RuleChange.EXCEPTION else "d.contract_id"
+        versions = ((change.old_regex, change.old_scope), (change.new_regex, change.new_scope))
+        for n, (pattern, scope) in enumerate(versions):
+            cond = match(pattern, f"{key}_{n}", params)
+            if cond and scope is not None:
+                params[f"{key}_{n}_scope"] = scope
+                parts.append(f"({column} = %({key}_{n}_scope)s AND {cond})")
+
+    return parts
+
+
+def _change_condition(change: RuleChange, params: dict, match=_match) -> str:
+    parts = _change_branches(change, params, match)
+    if not parts:
+        return "FALSE"
+    return "(" + " OR ".join(f"({p})" for p in parts) + ")"
+
+
+def scan_affected_rows(changes) -> tuple[list[int], dict]:
+    """
+    То же, что lookup_affected_rows, одним проходом: все условия в одном WHERE,
+    шаблоны проверяются на каждой строке таблицы.
+    """
+    params = {}
+    conds = [_change_condition(change, params) for change in changes]
+    flags = ",\n            ".join(f"COALESCE({c}, FALSE)" for c in conds)
+    q = f"""
+        SELECT d.id,
+            {flags}
+        FROM treasury_cfdata d
+        WHERE {" OR ".join(conds)}
+    """
+
+    counts = {change.pk: 0 for change in changes}
+    ids = []
+    with connection.cursor() as cursor:
+        cursor.execute(q, params)
+        for cf_id, *hits in cursor.fetchall():
+            ids.append(cf_id)
+            for change, hit in zip(changes, hits):
+                counts[change.pk] += bool(hit)
+    return sorted(ids), counts
+
+
+def lookup_affected_rows(changes) -> tuple[list[int], dict]:
+    """
+    Каждое условие — отдельный поиск (UNION ALL): Postgres планирует его
+    по своему индексу (договор, контрагент, триграммы temp).
+    """
+    params = {}
+    branches = []
+    for change in changes:
+        params[f"c{change.pk}"] = change.pk
+        branches += [
+            f"SELECT d.id, %(c{change.pk})s FROM treasury_cfdata d WHERE {cond}"
+            for cond in _change_branches(change, params)
+        ]
+
+    hits = defaultdict(set)
+    with connection.cursor() as cursor:
+        for i in range(0, len(branches), BRANCHES_PER_QUERY):
+            cursor.execute("\nUNION ALL\n".join(branches[i:i + BRANCHES_PER_QUERY]), params)
+            for cf_id, change_id in cursor.fetchall():
+                hits[change_id].add(cf_id)
+
+    ids = sorted(set().union(*hits.values()))
+    return ids, {change.pk: len(hits[change.pk]) for change in changes}
+
+
+def affected_rows(changes) -> tuple[list[int], dict]:
+    """
+    Строки treasury_cfdata, которые могли задеть изменения.
+    С индексом cfdata_temp_trgm или при большом числе изменений — отдельные
+    поиски по условиям, иначе — один проход по таблице.
+    Returns:
+        (ids строк, {change_id: число строк})
+    """
+    changes = list(changes)
+    if not changes:
+        return [], {}
+    if len(changes) <= SCAN_MAX_CHANGES and not has_trgm_index():
+        return scan_affected_rows(changes)
+    return lookup_affected_rows(changes)
+
+
+def invalidate_cache(changes) -> int:
+    """
+    Сбрасываем записи ClassificationCache, которые могли задеть изменения:
+    те же условия, что для строк CfData, по назначению-примеру в записи кэша (_cache_match).
+    """
+    params = {}
+    conds = [_change_condition(change, params, _cache_match) for change in changes]
+    if not conds:
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM treasury_classificationcache d WHERE {' OR '.join(conds)}",
+            params,
+        )
+        return cursor.rowcount
+
+
+def _write_classification(df: pd.DataFrame) -> int:
+    """
+    Пишем договор, финального контрагента и статью CF одним UPDATE,
+    только в строки, где что-то поменялось. Сводку качества
+    пересчитываем по задетым выпискам, версию данных CF увеличиваем.
+    """
+    if df.empty:
+        return 0
+
+    def column(name):
+        return [None if pd.isna(v) else int(v) for v in df[name]]
+
+    q = """
+        UPDATE treasury_cfdata d
+        SET contract_id = v.contract_id,
+            cp_final_id = v.cp_final_id,
+            cfitem_id = v.cfitem_id
+        FROM unnest(
+            %(id)s::bigint[], %(contract_id)s::bigint[],
+            %(cp_final_id)s::bigint[], %(cfitem_id)s::bigint[]
+        ) AS v(id, contract_id, cp_final_id, cfitem_id)
+        WHERE d.id = v.id
+          AND (d.contract_id, d.cp_final_id, d.cfitem_id)
+              IS DISTINCT FROM (v.contract_id, v.cp_final_id, v.cfitem_id)
+        RETURNING d.bs_id
+    """
+    params = {name: column(name) for name in ("id", "contract_id", "cp_final_id", "cfitem_id")}
+
+    with connection.cursor() as cursor:
+        cursor.execute(q, params)
+        changed = [bs_id for (bs_id,) in cursor.fetchall()]
+
+    refresh_statement_quality(set(changed))
+    if changed:
+        bump_data_version()
+    return len(changed)
+
+
+def _reclassify(qs, classifier: Classifier) -> int:
+    df = pd.DataFrame.from_records(
+        qs.values("id", "temp", "cp_id", "dt"),
+        columns=["id", "temp", "cp_id", "dt"],
+    )
+    classifier.classify(df)
+    return _write_classification(df)
+
+
+def reclassify_rows(ids, classifier: Classifier | None = None) -> int:
+    """
+    Пересчёт договора, финального контрагента и статьи CF только для строк ids —
+    те же правила, что при загрузке выписки (Classifier).
+    Returns:
+        число строк, у которых что-то поменялось
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    return _reclassify(CfData.objects.filter(id__in=ids), classifier or Classifier.load())
+
+
+def apply_rule_changes() -> tuple[int, int]:
+    """
+    Применяет накопленные изменения правил.
+    SKIP LOCKED — несколько воркеров не возьмут одни и те же изменения.
+    Returns:
+        (изменений, строк пересчитано)
+    """
+    with transaction.atomic():
+        changes = list(
+            RuleChange.objects
+            .select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .order_by("id")
+        )
+        if not changes:
+            return 0, 0
+
+        ids, counts = affected_rows(changes)
+        reclassify_rows(ids)
+
+        now = timezone.now()
+        for change in changes:
+            change.processed_at = now
+            change.rows = counts[change.pk]
+        RuleChange.objects.bulk_update(changes, ["processed_at", "rows"])
+
+    logger.info("Правила v%s: пересчитано %s строк", changes[-1].pk, len(ids))
+    return len(changes), len(ids)
+
+
+def reclassify_all() -> int:
+    """
+    Полная переразноска всех выписок без перезагрузки файлов
+    (после массовых правок правил мимо сигналов).
+    Правила грузим один раз, выписки идут по одной.
+    Кэш разноски очищаем целиком: правки мимо сигналов его не сбросили.
+    """
+    classifier = Classifier.load()
+    total = 0
+
+    with transaction.atomic():
+        ClassificationCache.objects.all().delete()
+        RuleChange.objects.filter(processed_at__isnull=True).update(processed_at=timezone.now())
+
+        for bs_id in BankStatements.objects.values_list("id", flat=True):
+            total += _reclassify(CfData.objects.filter(bs_id=bs_id), classifier)
+
+    return total
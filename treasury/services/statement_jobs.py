@@ -0,0 +1,305 @@
+# treasury/services/statement_jobs.py
+# Очередь обработки выписок: админка ставит задачи, воркер их выполняет
+
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from treasury.models import BankStatements, CfData, StatementJob
+from treasury.services.import_runs import ImportRecorder
+from utils.bsparsers.bsupdater import update_cf_data, batch_update_cf_data
+
+logger = logging.getLogger(__name__)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _worker_alive(worker: str | None) -> bool:
+    """Воркер с этого хоста проверяем по pid; про чужие хосты судим только по сигналу."""
+    host, _, pid = (worker or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reclaim_stale_jobs(worker: str | None = None) -> int:
+    """
+    Снимает задачи RUNNING, которые уже никто не выполняет — иначе выписку
+    не поставить в очередь заново. Брошенной считаем задачу:
+      - от воркера которой дольше STATEMENT_JOB_TIMEOUT_MINUTES не было сигнала;
+      - воркера с этого хоста, процесса которого больше нет;
+      - с именем воркера worker — при его старте все его прежние задачи брошены.
+    Такие задачи помечаем ошибкой (повторный запуск — обычной постановкой в очередь:
+    файл, на котором падает воркер, сам по кругу не пойдёт).
+    Returns:
+        сколько задач снято
+    """
+    stale_before = timezone.now() - timedelta(minutes=settings.STATEMENT_JOB_TIMEOUT_MINUTES)
+    running = StatementJob.objects.filter(status=StatementJob.RUNNING)
+
+    stale = set(
+        running
+        .filter(Q(heartbeat_at__lt=stale_before) | Q(heartbeat_at__isnull=True, started_at__lt=stale_before))
+        .values_list("id", flat=True)
+    )
+    for job_id, job_worker in running.exclude(id__in=stale).values_list("id", "worker"):
+        if job_worker == worker or not _worker_alive(job_worker):
+            stale.add(job_id)
+    if not stale:
+        return 0
+
+    jobs = list(StatementJob.objects.filter(id__in=stale, status=StatementJob.RUNNING))
+    for job in jobs:
+        logger.warning("Задача %s (выписка %s) брошена воркером %s — снимаем", job.pk, job.bs_id, job.worker)
+        _finish(job, RuntimeError(f"Воркер {job.worker} перестал отвечать на этапе {job.stage or '—'}, задача снята"))
+    return len(jobs)
+
+
+def enqueue_statements(ids) -> tuple[int, int]:
+    """
+    Ставит в очередь по одной задаче на выписку.
+    Выписки без файла и с уже активной задачей пропускаем
+    (задачи упавших воркеров перед этим снимаем).
+    Returns:
+        (поставлено, пропущено)
+    """
+    ids = list(ids)
+    reclaim_stale_jobs()
+
+    active = set(
+        StatementJob.objects
+        .filter(bs_id__in=ids, status__in=(StatementJob.QUEUED, StatementJob.RUNNING))
+        .values_list("bs_id", flat=True)
+    )
+
+    jobs = [
+        StatementJob(bs=bs)
+        for bs in BankStatements.objects.filter(pk__in=ids).only("id", "file")
+        if bs.file and bs.pk not in active
+    ]
+    StatementJob.objects.bulk_create(jobs)
+
+    return len(jobs), len(ids) - len(jobs)
+
+
+def claim_jobs(worker: str | None = None, limit: int = 1) -> list[StatementJob]:
+    """
+    Забираем следующие задачи. SKIP LOCKED позволяет запускать
+    несколько воркеров без дублей и без ожидания блокировок.
+    """
+    with transaction.atomic():
+        jobs = list(
+            StatementJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=StatementJob.QUEUED)
+            .order_by("id")[:limit]
+        )
+
+        now = timezone.now()
+        for job in jobs:
+            job.status = StatementJob.RUNNING
+            job.worker = worker or worker_name()
+            job.started_at = now
+            job.heartbeat_at = now
+        StatementJob.objects.bulk_update(jobs, ["status", "worker", "started_at", "heartbeat_at"])
+
+    return jobs
+
+
+def claim_job(worker: str | None = None) -> StatementJob | None:
+    jobs = claim_jobs(worker, limit=1)
+    return jobs[0] if jobs else None
+
+
+class Heartbeat:
+    """
+    Пока задачи выполняются, фоновый поток раз в STATEMENT_JOB_HEARTBEAT_SECONDS
+    обновляет им heartbeat_at: долгий этап или ожидание записи в пакете
+    не выглядят брошенной задачей. Завершённые и снятые задачи не трогаем.
+    """
+
+    def __init__(self, jobs, interval: float | None = None):
+        self.ids = [job.pk for job in jobs]
+        self.interval = settings.STATEMENT_JOB_HEARTBEAT_SECONDS if interval is None else interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="statement-job-heartbeat", daemon=True)
+
+    def beat(self):
+        StatementJob.objects.filter(pk__in=self.ids, status=StatementJob.RUNNING).update(heartbeat_at=timezone.now())
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    self.beat()
+                except Exception:
+                    logger.exception("Не удалось обновить сигнал задач %s", self.ids)
+        finally:
+            connection.close()  # соединение этого потока
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _set_stage(job: StatementJob, stage: str):
+    now = timezone.now()
+    StatementJob.objects.filter(pk=job.pk, status=StatementJob.RUNNING).update(stage=stage, heartbeat_at=now)
+    job.stage = stage
+    job.heartbeat_at = now
+
+
+def _finish(job: StatementJob, result):
+    """
+    Записывает итог, только если задача всё ещё за этим воркером:
+    снятую (reclaim_stale_jobs) задачу поздний результат не воскрешает.
+    """
+    if isinstance(result, Exception):
+        job.status = StatementJob.FAILED
+        job.error = "".join(traceback.format_exception(result))
+    else:
+        job.status = StatementJob.DONE
+        job.result = result
+
+    job.finished_at = timezone.now()
+    updated = (
+        StatementJob.objects
+        .filter(pk=job.pk, status=StatementJob.RUNNING, worker=job.worker)
+        .update(status=job.status, stage=job.stage, result=job.result, error=job.error, finished_at=job.finished_at)
+    )
+    if not updated:
+        logger.warning("Задача %s (выписка %s) уже снята — итог воркера %s не записан", job.pk, job.bs_id, job.worker)
+        job.refresh_from_db()
+    return job
+
+
+def duplicate_result(bs: BankStatements) -> str | None:
+    """
+    Тот же файл (байт в байт) уже загружен другой выпиской —
+    разбирать его повторно незачем.
+    """
+    original = bs.duplicate_of()
+    if original is None or not CfData.objects.filter(bs=original).exists():
+        return None
+    return f"Файл совпадает с выпиской #{original.pk} ({original}), уже загруженной — разбор пропущен"
+
+
+def run_statement(bs: BankStatements, job: StatementJob | None = None, on_stage=None):
+    """
+    update_cf_data с замерами: каждый запуск (и ошибка) остаётся в ImportRun.
+    Дубликат файла не разбираем и не записываем. Ошибку возвращаем, а не бросаем.
+    """
+    if duplicate := duplicate_result(bs):
+        return duplicate
+
+    recorder = ImportRecorder(bs.pk, job, on_stage=on_stage)
+    try:
+        with recorder.counting():
+            result = update_cf_data(bs.file.path, bs.pk, progress=recorder.progress, stats=recorder.stats)
+    except Exception as e:
+        logger.exception("Ошибка обработки выписки %s", bs.pk)
+        result = e
+
+    recorder.finish(result)
+    return result
+
+
+def run_job(job: StatementJob) -> StatementJob:
+    """
+    Выполняет update_cf_data для выписки задачи, этапы пишем в job.stage.
+    """
+    try:
+        bs = BankStatements.objects.get(pk=job.bs_id)
+        if not bs.file:
+            raise FileNotFoundError("У выписки нет файла")
+        with Heartbeat([job]):
+            result = run_statement(bs, job, on_stage=lambda stage: _set_stage(job, stage))
+    except Exception as e:
+        logger.exception("Ошибка обработки выписки %s", job.bs_id)
+        result = e
+
+    return _finish(job, result)
+
+
+def run_jobs_batch(jobs: list[StatementJob], workers: int | None = None) -> list[StatementJob]:
+    """
+    Пакет задач: файлы разбираются параллельно, запись — по одной выписке.
+    Сигнал идёт всем задачам пакета, пока последняя не записана.
+    """
+    with Heartbeat(jobs):
+        return _run_jobs_batch(jobs, workers)
+
+
+def _run_jobs_batch(jobs: list[StatementJob], workers: int | None = None) -> list[StatementJob]:
+    by_bs = {job.bs_id: job for job in jobs}
+    statements = []
+    done = []
+
+    for bs in BankStatements.objects.filter(pk__in=by_bs).only("id", "file", "file_hash"):
+        if not bs.file:
+            done.append(_finish(by_bs[bs.pk], FileNotFoundError("У выписки нет файла")))
+        elif duplicate := duplicate_result(bs):
+            done.append(_finish(by_bs[bs.pk], duplicate))
+        else:
+            statements.append((bs.file.path, bs.pk))
+
+    for bs_id in set(by_bs) - {job.bs_id for job in done} - {bs_id for _, bs_id in statements}:
+        done.append(_finish(by_bs[bs_id], FileNotFoundError("У выписки нет файла")))
+
+    recorders = {
+        bs_id: ImportRecorder(bs_id, by_bs[bs_id], on_stage=lambda stage, job=by_bs[bs_id]: _set_stage(job, stage))
+        for _, bs_id in statements
+    }
+    current = {}
+
+    def progress(bs_id, stage):
+        # parse — постановка в пул, замер выписки начинается, когда до неё дошла запись
+        if stage == "parse":
+            _set_stage(by_bs[bs_id], stage)
+            return
+        if stage == "prepare":
+            recorders[bs_id].restart()
+            current["recorder"] = recorders[bs_id]
+        recorders[bs_id].progress(stage)
+
+    def count_queries(execute, sql, params, many, context):
+        recorder = current.get("recorder")
+        if recorder is None:
+            return execute(sql, params, many, context)
+        return recorder(execute, sql, params, many, context)
+
+    results = batch_update_cf_data(
+        statements,
+        workers=workers,
+        progress=progress,
+        stats={bs_id: recorder.stats for bs_id, recorder in recorders.items()},
+    )
+    with connection.execute_wrapper(count_queries):
+        for bs_id, result in results:
+            current.pop("recorder", None)
+            if isinstance(result, Exception):
+                logger.error("Ошибка обработки выписки %s", bs_id, exc_info=result)
+            recorders[bs_id].finish(result)
+            done.append(_finish(by_bs[bs_id], result))
+
+    return done
@@ -0,0 +1,58 @@
+# treasury/services/statement_quality.py
+# Сводка качества разноски по выпискам (StatementQuality).
+# Один проход по CfData с GROUP BY bs_id и FILTER на каждый счётчик,
+# результат — upsert в treasury_statementquality.
+
+from django.db import connection
+
+# updated_at пишем сами: auto_now работает только через ORM
+REFRESH_SQL = """
+    INSERT INTO treasury_statementquality (
+        bs_id, rows, dt, cr,
+        missing_contract, missing_cfitem, missing_cp_final, missing_any, updated_at
+    )
+    SELECT
+        bs.id,
+        COUNT(d.id),
+        COALESCE(SUM(d.dt), 0),
+        COALESCE(SUM(d.cr), 0),
+        COUNT(d.id) FILTER (WHERE d.contract_id IS NULL),
+        COUNT(d.id) FILTER (WHERE d.cfitem_id IS NULL),
+        COUNT(d.id) FILTER (WHERE d.cp_final_id IS NULL),
+        COUNT(d.id) FILTER (
+            WHERE d.contract_id IS NULL OR d.cfitem_id IS NULL OR d.cp_final_id IS NULL
+        ),
+        now()
+    FROM treasury_bankstatements bs
+    LEFT JOIN treasury_cfdata d ON d.bs_id = bs.id
+    {where}
+    GROUP BY bs.id
+    ON CONFLICT (bs_id) DO UPDATE SET
+        rows = EXCLUDED.rows,
+        dt = EXCLUDED.dt,
+        cr = EXCLUDED.cr,
+        missing_contract = EXCLUDED.missing_contract,
+        missing_cfitem = EXCLUDED.missing_cfitem,
+        missing_cp_final = EXCLUDED.missing_cp_final,
+        missing_any = EXCLUDED.missing_any,
+        updated_at = EXCLUDED.updated_at
+"""
+
+
+def refresh_statement_quality(bs_ids=None) -> int:
+    """
+    Пересчитывает сводку по выпискам bs_ids (None — по всем).
+    Returns:
+        число пересчитанных выписок
+    """
+    if bs_ids is None:
+        q, params = REFRESH_SQL.format(where=""), {}
+    else:
+        bs_ids = [int(pk) for pk in bs_ids if pk is not None]
+        if not bs_ids:
+            return 0
+        q, params = REFRESH_SQL.format(where="WHERE bs.id = ANY(%(ids)s)"), {"ids": bs_ids}
+
+    with connection.cursor() as cursor:
+        cursor.execute(q, params)
+        return cursor.rowcount
@@ -0,0 +1,46 @@
+# treasury/services/trgm_index.py
+# Необязательный триграммный индекс cfdata_temp_trgm (pg_trgm) на treasury_cfdata.temp.
+#
+# С ним temp ~* шаблон и ILIKE при поиске строк, задетых изменением правил
+# (services/reclassify.py), идут по индексу, а не по всей таблице.
+# pg_trgm есть не на каждом сервере (contrib), поэтому индекса нет в модели:
+# его ставит миграция 0020, если расширение доступно и TREASURY_TRGM_INDEX не выключен,
+# а позже — manage.py trgm_index.
+
+from django.db import connection
+
+INDEX_NAME = "cfdata_temp_trgm"
+
+CREATE_SQL = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON treasury_cfdata USING gin (temp gin_trgm_ops)"
+DROP_SQL = f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}"
+
+
+def trgm_available() -> bool:
+    """pg_trgm установлен в базе или его можно установить."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def has_trgm_index() -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", [INDEX_NAME])
+        return cursor.fetchone() is not None
+
+
+def create_trgm_index() -> bool:
+    """
+    Ставит расширение и строит индекс без блокировки записи (CONCURRENTLY —
+    только вне транзакции). Returns: False — pg_trgm на сервере нет.
+    """
+    if not trgm_available():
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(CREATE_SQL)
+    return True
+
+
+def drop_trgm_index():
+    with connection.cursor() as cursor:
+        cursor.execute(DROP_SQL)
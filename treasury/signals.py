@@ -0,0 +1,141 @@
+# treasury/signals.py
+# Отслеживаем изменения правил разноски и пишем их в RuleChange.
+# Кэш разноски (ClassificationCache) по изменению сбрасываем сразу.
+# Массовые queryset.update() сигналов не вызывают — для них manage.py reclassify --all
+# Удалённая выписка: пересчитываем остатки по дням её счёта (DailyBalance).
+# Сплиты, дерево статей CF и удаление выписок меняют свод CF — увеличиваем версию данных.
+# Удалённая пара переводов (вместе с одной из половин): оставшиеся половины — снова без пары.
+# Правка операции CfData: отпечаток документа пересчитываем, остатки по дням —
+# по старым и новым (счёт, дата). Удаление пачкой — один пересчёт после коммита.
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from contracts.models import CfItemAuto, Contracts
+from corporate.models import CfItems
+from .models import BankStatements, CfData, CfSplits, ContractsRexex, IntercompanyMatch, RuleChange
+from .services.daily_balance import refresh_daily_balance, refresh_daily_balances
+from .services.data_version import bump_data_version
+from .services.reclassify import invalidate_cache
+
+# модель -> (тип правила, поля, от которых зависит разноска, поле области)
+TRACKED = {
+    Contracts: (RuleChange.CONTRACT, ("regex", "cp_id"), None),
+    ContractsRexex: (RuleChange.EXCEPTION, ("regex", "cp_id", "contract_id"), "cp_id"),
+    CfItemAuto: (RuleChange.CFITEM, ("regex", "contract_id", "defaultcfdt_id", "defaultcfcr_id"), "contract_id"),
+}
+
+
+def _state(instance, fields):
+    return {f: getattr(instance, f) for f in fields}
+
+
+def _log(rule, instance, old, new, scope):
+    change = RuleChange.objects.create(
+        rule=rule,
+        rule_id=instance.pk,
+        old_regex=old.get("regex"),
+        new_regex=new.get("regex"),
+        old_scope=old.get(scope) if scope else None,
+        new_scope=new.get(scope) if scope else None,
+    )
+    invalidate_cache([change])
+
+
+@receiver(pre_save)
+def remember_rule(sender, instance, raw=False, **kwargs):
+    if sender not in TRACKED or raw:
+        return
+    _, fields, _ = TRACKED[sender]
+    old = None
+    if instance.pk:
+        old = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    instance._rule_before = old or {}
+
+
+@receiver(post_save)
+def log_rule_save(sender, instance, created, raw=False, **kwargs):
+    if sender not in TRACKED or raw:
+        return
+    rule, fields, scope = TRACKED[sender]
+    old = getattr(instance, "_rule_before", {})
+    new = _state(instance, fields)
+    if old != new:
+        _log(rule, instance, old, new, scope)
+    instance._rule_before = new
+
+
+@receiver(post_delete)
+def log_rule_delete(sender, instance, **kwargs):
+    if sender not in TRACKED:
+        return
+    rule, fields, scope = TRACKED[sender]
+    _log(rule, instance, _state(instance, fields), {}, scope)
+
+
+@receiver(post_delete, sender=BankStatements)
+def refresh_balance_on_delete(sender, instance, **kwargs):
+    if instance.ba_id and instance.start:
+        refresh_daily_balance(instance.ba_id, since=instance.start)
+    bump_data_version()
+
+
+@receiver(post_save, sender=CfSplits)
+@receiver(post_delete, sender=CfSplits)
+@receiver(post_save, sender=CfItems)
+@receiver(post_delete, sender=CfItems)
+def bump_cf_version(sender, raw=False, **kwargs):
+    if not raw:
+        bump_data_version()
+
+
+@receiver(post_delete, sender=IntercompanyMatch)
+def unmatch_legs_on_delete(sender, instance, **kwargs):
+    CfData.objects.filter(
+        pk__in=[instance.out_leg_id, instance.in_leg_id], ic_status=CfData.IC_MATCHED
+    ).update(ic_status=CfData.IC_UNMATCHED)
+
+
+@receiver(pre_save, sender=CfData)
+def remember_cf_row(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = None
+    if instance.pk:
+        old = sender.objects.filter(pk=instance.pk).values(*CfData.FINGERPRINT_FIELDS, "fingerprint").first()
+    instance._balance_before = old
+
+    # документ поменялся — отпечаток тоже (дубли в перекрывающихся выписках)
+    if old is None or any(old[f] != getattr(instance, f) for f in CfData.FINGERPRINT_FIELDS):
+        instance.fingerprint = instance.compute_fingerprint()
+
+
+@receiver(post_save, sender=CfData)
+def refresh_balance_on_cf_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = getattr(instance, "_balance_before", None)
+    if old and all(old[f] == getattr(instance, f) for f in CfData.BALANCE_FIELDS):
+        return
+    points = {(instance.ba_id, instance.date)}
+    if old:
+        points.add((old["ba_id"], old["date"]))
+    refresh_daily_balances(points)
+
+
+@receiver(post_delete, sender=CfData)
+def refresh_balance_on_cf_delete(sender, instance, origin=None, **kwargs):
+    point = (instance.ba_id, instance.date)
+    if origin is instance or origin is None:
+        refresh_daily_balances([point])
+        return
+    if getattr(origin, "model", type(origin)) is BankStatements:
+        return  # удаляются выписки — пересчитает refresh_balance_on_delete
+
+    # queryset.delete() и каскады: копим строки и пересчитываем один раз после коммита
+    pending = getattr(origin, "_balance_points", None)
+    if pending is None:
+        pending = origin._balance_points = set()
+        transaction.on_commit(lambda: refresh_daily_balances(pending))
+    pending.add(point)
@@ -1,3 +1,724 @@
-from django.test import TestCase
+import csv
+import datetime as dt
+import json
+import os
+import socket
+import tempfile
+import time
+from decimal import Decimal
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import Workbook, load_workbook
+
+from contracts.models import Contracts, ContractsTitle
+from corporate.models import Bank, BankAccount, CfItems, Owners
+from counterparties.models import Counterparty
+from macro.models import CurrencyRate
+
+from treasury.models import (
+    BankStatements, CfData, ClassificationCache, DailyBalance, IntercompanyMatch, RuleChange, StatementJob,
+    doc_fingerprint,
+)
+from treasury.services import cf_pivot
+from treasury.services.consolidation import RateTable, consolidate_balances
+from treasury.services.daily_balance import refresh_daily_balance
+from treasury.services.data_version import bump_data_version, data_version
+from treasury.services.eod import eod_balances
+from treasury.services.eod_export import export_eod_xlsx
+from treasury.services.import_runs import MemoryWatch
+from treasury.services.intercompany_match import Leg, pair_legs
+from treasury.services.reclassify import lookup_affected_rows, reclassify_all, scan_affected_rows
+from treasury.services import statement_jobs
+from treasury.services.statement_jobs import claim_job, enqueue_statements, reclaim_stale_jobs, run_job, worker_name
+from utils.bsparsers import synthetic
+from utils.bsparsers.bsparser import get_bs_details, iter_bs_documents, parse_statement
+from utils.bsparsers.bsupdater import find_vat_rate, update_cf_data
+from utils.bsparsers.classifier import Classifier
+from utils.bsparsers.contract_matcher import ContractMatcher, LiteralAutomaton, required_literals
+from utils.bsparsers.intercompany_rules import apply_intercompany_overrides
+from utils.bsparsers.pg_regex import compile_rule, pg_regex, reads_digits, validate_rule_regex
+
+
+def empty_classifier(**rules):
+    rules = {"contracts": [], "exceptions": [], "contract_cp": [], "cfitem_rules": [], "accounts": [], **rules}
+    return Classifier(**rules)
+
+
+class ClassificationCacheTests(TestCase):
+    def classify(self, temps, classifier=None):
+        df = find_vat_rate(pd.DataFrame({"temp": temps, "cp_id": [None] * len(temps), "dt": [100] * len(temps)}))
+        stats = (classifier or empty_classifier()).classify(df, use_cache=True)
+        return df, stats
+
+    def test_vat_rate_stays_per_row(self):
+        # тексты отличаются только ставкой; ставка из кэша не подменяет свою
+        first, _ = self.classify(["Оплата по счету за аренду, в т.ч. НДС 20.00%"])
+        second, _ = self.classify(["Оплата по счету за аренду, в т.ч. НДС 10.00%"])
+
+        self.assertEqual(first["vat_rate"].tolist(), [20])
+        self.assertEqual(second["vat_rate"].tolist(), [10])
+        self.assertFalse(hasattr(ClassificationCache(), "vat_rate"))
+
+    RENT = "Арендная плата за период 01.{0}.2024-3{1}.{0}.2024 по дог. №15 от 01.02.2023, сумма {2}-00, в т.ч. НДС 20%"
+
+    def contract(self, **kwargs):
+        return Contracts.objects.create(
+            title=ContractsTitle.objects.create(title="Договор"),
+            owner=Owners.objects.get_or_create(name="Собственник", inn="7700000001")[0],
+            cp=Counterparty.objects.get_or_create(tax_id="7700000002", name="Арендодатель")[0],
+            **kwargs,
+        )
+
+    def test_numbers_in_text_are_part_of_key(self):
+        # шаблон различает строки по году — маска чисел их не склеивает
+        contract = self.contract()
+        classifier = empty_classifier(contracts=[(contract.pk, r"аренда\D+2023")])
+        first, _ = self.classify(["Аренда за 2023 год"], classifier)
+        second, stats = self.classify(["Аренда за 2024 год"], classifier)
+
+        self.assertEqual(first["contract_id"].tolist(), [contract.pk])
+        self.assertEqual(second["contract_id"].tolist(), [None])
+        self.assertEqual(stats["cache_hits"], 0)
+
+    def test_rent_of_next_month_hits_cache(self):
+        contract = self.contract(regex=r"№\s*15\s+от\s+01\.02\.2023")
+        item = CfItems.objects.create(code="100100", name="Аренда")
+        classifier = empty_classifier(
+            contracts=[(contract.pk, contract.regex)],
+            cfitem_rules=[(1, contract.pk, "арендная плата", item.pk, None)],
+        )
+        may, _ = self.classify([self.RENT.format("05", "1", "150 000")], classifier)
+        june, stats = self.classify([self.RENT.format("06", "0", "152 500")], classifier)
+
+        self.assertEqual(stats["cache_hits"], 1)
+        self.assertEqual(june["contract_id"].tolist(), may["contract_id"].tolist())
+        self.assertEqual(june["cfitem_id"].tolist(), [item.pk])
+
+    def test_digit_rule_drops_entries_of_same_mask(self):
+        classifier = empty_classifier(contracts=[])
+        self.classify([self.RENT.format("05", "1", "150 000")], classifier)
+        # новый договор совпадает с июнем, а не с маем-примером записи — запись всё равно сбрасываем
+        contract = self.contract(regex=r"за период 01\.06\.2024")
+        self.assertFalse(ClassificationCache.objects.exists())
+
+        june, stats = self.classify([self.RENT.format("06", "0", "150 000")], Classifier.load())
+        self.assertEqual(stats["cache_hits"], 0)
+        self.assertEqual(june["contract_id"].tolist(), [contract.pk])
+
+    def test_same_text_hits_cache(self):
+        self.classify(["Оплата по счету 123 за услуги связи"])
+        _, stats = self.classify(["Оплата по счету 123 за услуги связи"])
+        self.assertEqual(stats["cache_hits"], 1)
+
+    def test_reclassify_all_clears_cache(self):
+        ClassificationCache.objects.create(fingerprint="0" * 32, temp="Аренда за 2023 год")
+        reclassify_all()
+        self.assertFalse(ClassificationCache.objects.exists())
+
+
+class CfDataEditTests(TestCase):
+    def setUp(self):
+        owner = Owners.objects.create(name="Собственник", inn="7700000001")
+        self.ba = BankAccount.objects.create(corporate=owner, account="40702810000000000001", currency="RUB")
+        self.bs = BankStatements.objects.create(
+            owner=owner, ba=self.ba, start=dt.date(2024, 1, 1), finish=dt.date(2024, 1, 10), bb=1000, eb=1000,
+        )
+        refresh_daily_balance(self.ba.pk)
+
+    def closing(self, day):
+        return DailyBalance.objects.get(ba=self.ba, date=dt.date(2024, 1, day)).closing
+
+    def add_row(self, day, dt_amount, doc_numner="1"):
+        return CfData.objects.create(
+            bs=self.bs, ba=self.ba, date=dt.date(2024, 1, day), doc_numner=doc_numner, dt=dt_amount, cr=0,
+            intercompany=False,
+        )
+
+    def test_edit_moves_balance_and_fingerprint(self):
+        row = self.add_row(3, 100)
+        self.assertEqual(row.fingerprint, doc_fingerprint(self.ba.pk, dt.date(2024, 1, 3), "1", 100.0, 0.0))
+        self.assertEqual(self.closing(3), 1100)
+
+        row.date, row.dt = dt.date(2024, 1, 5), 50
+        row.save()
+        row.refresh_from_db()
+
+        self.assertEqual(row.fingerprint, doc_fingerprint(self.ba.pk, dt.date(2024, 1, 5), "1", 50.0, 0.0))
+        self.assertEqual(self.closing(3), 1000)
+        self.assertEqual(self.closing(5), 1050)
+
+    def test_delete_refreshes_balance(self):
+        self.add_row(3, 100).delete()
+        self.assertEqual(self.closing(3), 1000)
+
+        self.add_row(4, 100, "2")
+        self.add_row(6, 100, "3")
+        with self.captureOnCommitCallbacks(execute=True):
+            CfData.objects.filter(bs=self.bs).delete()
+        self.assertEqual(self.closing(10), 1000)
+
+
+class MemoryWatchTests(TestCase):
+    def test_peak_is_measured_from_window_start(self):
+        watch = MemoryWatch()
+        ballast = bytearray(64 * 1024 * 1024)  # до окна — в замер не входит
+        watch.open("run")
+        chunk = bytearray(32 * 1024 * 1024)
+        chunk[::4096] = b"x" * len(chunk[::4096])  # страницы реально заняты
+        peak = watch.close("run")
+        del ballast, chunk
+
+        self.assertGreater(peak, 24)
+        self.assertLess(peak, 56)
+
+
+class StaleJobTests(TestCase):
+    def setUp(self):
+        # хэш и шапка заполнены — save() файл не читает
+        self.bs = BankStatements.objects.create(
+            file="migrations/statement.txt", file_hash="0" * 64,
+            start=dt.date(2024, 1, 1), finish=dt.date(2024, 1, 31), bb=0, eb=0,
+        )
+
+    def running(self, worker, minutes_ago=0):
+        at = timezone.now() - dt.timedelta(minutes=minutes_ago)
+        return StatementJob.objects.create(
+            bs=self.bs, status=StatementJob.RUNNING, worker=worker, started_at=at, heartbeat_at=at,
+        )
+
+    def test_live_job_is_kept(self):
+        job = self.running(worker_name())
+        self.assertEqual(reclaim_stale_jobs(), 0)
+        self.assertEqual(enqueue_statements([self.bs.pk]), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, StatementJob.RUNNING)
+
+    def test_dead_worker_job_is_reclaimed(self):
+        job = self.running(f"{socket.gethostname()}:999999999")
+        self.assertEqual(enqueue_statements([self.bs.pk]), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual(job.status, StatementJob.FAILED)
+
+    def test_silent_job_is_reclaimed(self):
+        job = self.running("other-host:1", minutes_ago=24 * 60)
+        self.assertEqual(reclaim_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertIn("other-host:1", job.error)
+
+    def test_worker_restart_reclaims_own_jobs(self):
+        self.running("other-host:1")
+        self.assertEqual(reclaim_stale_jobs(), 0)
+        self.assertEqual(reclaim_stale_jobs("other-host:1"), 1)
+
+    def test_reclaimed_job_keeps_failed_status(self):
+        job = self.running("other-host:1", minutes_ago=24 * 60)
+        with self.assertLogs("treasury.services.statement_jobs", "WARNING") as logs:
+            reclaim_stale_jobs()
+            statement_jobs._finish(job, "готово")  # первый воркер всё-таки дописал
+        self.assertIn("уже снята", logs.output[-1])
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, StatementJob.FAILED)
+
+
+# сигнал пишет отдельный поток со своим соединением — нужны настоящие коммиты
+@override_settings(STATEMENT_JOB_TIMEOUT_MINUTES=0.01, STATEMENT_JOB_HEARTBEAT_SECONDS=0.1)
+class HeartbeatTests(TransactionTestCase):
+    def test_long_single_stage_is_not_reclaimed(self):
+        bs = BankStatements.objects.create(
+            file="migrations/statement.txt", file_hash="0" * 64,
+            start=dt.date(2024, 1, 1), finish=dt.date(2024, 1, 31), bb=0, eb=0,
+        )
+        enqueue_statements([bs.pk])
+        job = claim_job("other-host:1")
+        reclaimed = []
+
+        def run_statement(bs, job, on_stage):
+            on_stage("write")
+            time.sleep(1.5)  # этап дольше таймаута в 0.6 с
+            reclaimed.append(reclaim_stale_jobs())
+            return "готово"
+
+        with mock.patch.object(statement_jobs, "run_statement", run_statement):
+            run_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual(reclaimed, [0])
+        self.assertEqual(job.status, StatementJob.DONE)
+        self.assertEqual(enqueue_statements([bs.pk]), (1, 0))
+
+
+class StatementLoadTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.tmp = media.name
+        owner = Owners.objects.create(name=synthetic.OWN_NAME, inn=synthetic.OWN_INN)
+        self.ba = BankAccount.objects.create(corporate=owner, account=synthetic.OWN_ACCOUNT)
+
+    def upload(self, name, n):
+        """Синтетическая выписка 1С из n документов, сохранённая как BankStatements."""
+        path = synthetic.write_1c(os.path.join(self.tmp, name), n, cps=8, seed=3)
+        bs = BankStatements()
+        with open(path, "rb") as f:
+            bs.file.save(name, File(f), save=False)
+            bs.save()
+        return bs
+
+    def test_second_load_updates_rows(self):
+        bs = self.upload("statement.txt", 20)
+        first, second = {}, {}
+
+        update_cf_data(bs.file.path, bs.pk, stats=first)
+        update_cf_data(bs.file.path, bs.pk, stats=second)
+
+        self.assertEqual((first["inserted"], first["updated"]), (20, 0))
+        self.assertEqual((second["inserted"], second["updated"]), (0, 20))
+        self.assertEqual(CfData.objects.filter(bs=bs, ba=self.ba).count(), 20)
+
+    def test_identical_upload_is_skipped(self):
+        first = self.upload("statement.txt", 20)
+        statement_jobs.run_statement(first)
+        second = self.upload("statement.txt", 20)
+
+        self.assertEqual(second.duplicate_of(), first)
+        self.assertIn("Файл совпадает", statement_jobs.run_statement(second))
+        self.assertFalse(CfData.objects.filter(bs=second).exists())
+
+    def test_overlapping_upload_adds_only_new_documents(self):
+        # выписка с начала года повторяет первые 10 документов прошлой
+        month = self.upload("month.txt", 10)
+        update_cf_data(month.file.path, month.pk)
+        year = self.upload("year.txt", 25)
+        stats = {}
+
+        update_cf_data(year.file.path, year.pk, stats=stats)
+
+        self.assertEqual((stats["docs"], stats["skipped"], stats["inserted"]), (25, 10, 15))
+        self.assertEqual(CfData.objects.filter(bs=year).count(), 15)
+        self.assertEqual(CfData.objects.filter(ba=self.ba).count(), 25)
+
+
+class AffectedRowsTests(TestCase):
+    def test_scan_and_lookups_find_same_rows(self):
+        temps = ["Аренда по дог. № 15 от 01.02.2024", "Аренда по дог. № 16 от 01.02.2024", "Связь за январь", None]
+        for n, temp in enumerate(temps):
+            CfData.objects.create(doc_numner=str(n), temp=temp, dt=1, cr=0, intercompany=False)
+        changes = [
+            RuleChange.objects.create(rule=RuleChange.CONTRACT, rule_id=1, old_regex=None, new_regex=r"№\s*15\M"),
+            RuleChange.objects.create(rule=RuleChange.CONTRACT, rule_id=2, old_regex="связь", new_regex="интернет"),
+        ]
+
+        scan = scan_affected_rows(changes)
+        self.assertEqual(scan, lookup_affected_rows(changes))
+        self.assertEqual(list(scan[1].values()), [1, 1])
+
+
+class PgRegexTests(SimpleTestCase):
+    def matches(self, pattern, text):
+        return bool(compile_rule(pattern).search(text))
+
+    def test_word_bounds(self):
+        for start, end in ((r"\m", r"\M"), ("[[:<:]]", "[[:>:]]")):
+            self.assertTrue(self.matches(start + "аренд", "Оплата аренды"))
+            self.assertFalse(self.matches(start + "аренд", "Оплата субаренды"))
+            self.assertTrue(self.matches("договор" + end, "по договор №1"))
+            self.assertFalse(self.matches("договор" + end, "по договору"))
+
+    def test_reads_digits(self):
+        for pattern in (r"№\s*15", "[[:digit:]]+", r"аренда\w+", "аренда.июнь", "[^а-я]", r"(?=[0-5])аренда"):
+            self.assertTrue(reads_digits(pattern), pattern)
+        for pattern in ("аренд", r"\mаренд[[:>:]]", r"\yсчет\y", r"(аренда|субаренда)\s+помещ", r"(?<!\d)аренда", "***=a.b"):
+            self.assertFalse(reads_digits(pattern), pattern)
+        self.assertTrue(reads_digits("аренда ("))
+
+    def test_classes_and_prefixes(self):
+        self.assertEqual(pg_regex("[[:digit:]]{4}"), "[0-9]{4}")
+        self.assertTrue(self.matches("[[:alpha:]]+ [[:digit:]]+", "Счёт 15"))
+        self.assertEqual(pg_regex("***=a.b"), r"a\.b")
+        self.assertEqual(pg_regex(r"***:\yсчет\y"), r"\bсчет\b")
+        # как у ~*: без учёта регистра, точка ловит перевод строки
+        self.assertTrue(self.matches("аренда.июнь", "АРЕНДА\nИЮНЬ"))
+
+    def test_broken_pattern_is_reported(self):
+        errors = []
+        with self.assertLogs("utils.bsparsers.pg_regex", "WARNING"):
+            self.assertIsNone(compile_rule("аренда (", errors))
+        self.assertEqual(errors[0][0], "аренда (")
+        with self.assertRaises(ValidationError):
+            validate_rule_regex("аренда (")
+        validate_rule_regex(r"\mаренд[[:>:]]")
+
+        with self.assertLogs("utils.bsparsers.pg_regex", "WARNING"):
+            classifier = empty_classifier(contracts=[(1, "аренда (")], exceptions=[(7, 3, "[", 1)])
+        self.assertEqual([(rule, rule_id) for rule, rule_id, _, _ in classifier.broken], [("Договор", 1), ("Исключение", 7)])
+
+
+class ContractMatcherTests(SimpleTestCase):
+    def test_required_literals(self):
+        self.assertEqual(required_literals(r"№\s*15\s+от\s+01\.02\.2024"), {"01.02.2024"})
+        self.assertEqual(required_literals("(аренда|субаренда) помещ"), {" помещ"})
+        # без длинных кусков и с синтаксисом только Postgres — без предфильтра
+        self.assertIsNone(required_literals("a.b"))
+        self.assertIsNone(required_literals("[[:digit:]]+ аренда"))
+        self.assertIsNone(required_literals(r"\mаренд"))
+
+    def test_automaton_finds_overlapping_literals(self):
+        automaton = LiteralAutomaton(["аренд", "аренда", "ренда п", "связь"])
+        self.assertEqual(automaton.find("оплата аренда помещения"), {"аренд", "аренда", "ренда п"})
+        self.assertEqual(automaton.find("услуги связи"), set())
+
+    def test_candidates(self):
+        matcher = ContractMatcher([(1, r"№\s*15\s+от\s+01\.02\.2024"), (2, "a.b"), (3, None)])
+        self.assertEqual(matcher.unfiltered, [2])
+        self.assertEqual(matcher.candidates("по дог. №15 от 01.02.2024"), {1})
+        self.assertEqual(matcher.candidates("по дог. №15 от 02.02.2024"), set())
+
+
+class IntercompanyRulesTests(SimpleTestCase):
+    def test_overrides_by_date_and_fragment(self):
+        df = pd.DataFrame({
+            "date": pd.to_datetime(["2024-01-10", "2024-01-10", "2024-01-11"]),
+            "temp": ["Возврат займа  по договору", "Перевод собственных средств", "Возврат займа"],
+            "intercompany": [True, False, True],
+        })
+        rules = [
+            (dt.date(2024, 1, 10), "возврат займа по", False),
+            (dt.date(2024, 1, 10), "собственных средств", True),
+            (dt.date(2024, 1, 10), "перевод", False),  # включение важнее исключения
+        ]
+        apply_intercompany_overrides(df, rules)
+        self.assertEqual(df["intercompany"].tolist(), [False, True, True])
+
+
+class IterBsDocumentsTests(SimpleTestCase):
+    def write(self, text):
+        fd, path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "wb") as f:
+            f.write(text.encode("cp1251"))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_documents_and_header(self):
+        path = self.write(
+            "1CClientBankExchange\n"
+            "ДатаНачала=01.01.2024\nДатаКонца=31.01.2024\nРасчСчет=40702810000000000001\n"
+            "СекцияРасчСчет\nНачальныйОстаток=100.00\nКонецРасчСчет\n"
+            "СекцияДокумент=Платежное поручение\nНомер=1\nСумма=10.00\nКонецДокумента\n"
+            "СекцияДокумент=Платежное поручение\nНомер=2\nНазначениеПлатежа=a=b\n"
+            "КонечныйОстаток=90.00\n"
+        )
+        header = {}
+        docs = list(iter_bs_documents(path, header))
+
+        self.assertEqual([d["Номер"] for d in docs], ["1", "2"])
+        self.assertEqual(docs[1]["НазначениеПлатежа"], "a=b")
+        # КонечныйОстаток после незакрытого документа — поле документа, а не шапки
+        self.assertEqual(header, {
+            "start_date": "01.01.2024", "end_date": "31.01.2024",
+            "account": "40702810000000000001", "bb": "100.00",
+        })
+
+
+STATEMENTS_BASELINE = os.path.join(os.path.dirname(__file__), "testdata", "statements_baseline.json")
+
+
+def write_xlsx_with_rules(path):
+    """Синтетическая выписка xlsx плюс строки под каждое правило xls_parser."""
+    synthetic.write_xlsx(path, 40, cps=8, seed=3)
+    rows = [list(r) for r in load_workbook(path).worksheets[0].iter_rows(values_only=True)]
+    total = rows.pop()
+    own = f"{synthetic.OWN_ACCOUNT}\nВнутреннее перемещение"
+    day = "20.01.2024"
+    extra = [
+        # (назначение, аналитика Дт, аналитика Кт, Дт, Кт)
+        ("Перевод собственных средств", own, "40702810000010018499\nВнутреннее перемещение", 1000, None),
+        ("Конвертация", "ПАО Банк\nКонвертация валюты\nx", own, 500, None),
+        ("Налог", None, "УФК\nПрочие налоги и сборы\nНалог", None, 300),
+        ("Взносы", "Налог (взносы): начислено / уплачено\nx", "УФК\nПрочие налоги и сборы\nВзносы", None, 200),
+        ("Перечисление заработной платы на счет Бердникова Сергея Алексеевича", "Зарплата\nx", own, None, 150),
+        ("Подотчет", "Гавшин Богдан Сергеевич\nx", "Касса\nВыдача подотчетных сумм", None, 120),
+        ("Займ", "Касса\nПолучение кредитов и займов", "ЗАО \"Экспорт Файненс\"\nx", 50000, None),
+        ("Проценты", "ЗАО \"Арминвест\"\nx", "Банк\nВыплата процентов по кредитам и займам", None, 700),
+        ("Проценты по вкладу", "СИТИЛИНК ООО\nx", "Проценты к получению, уплате\nx", 80, None),
+        ("Без аналитики", None, None, 10, None),
+    ]
+    for i, (temp, a_dt, a_cr, d, c) in enumerate(extra, start=900):
+        kind = "Поступление на расчетный счет" if d else "Списание с расчетного счета"
+        rows.append([day, f"{kind} {i} от {day}\n{temp}", a_dt, a_cr, None, d, None, None, c, None, None, None])
+        total[5] = (total[5] or 0) + (d or 0)
+        total[8] = (total[8] or 0) + (c or 0)
+    total[11] = rows[9][11] + total[5] - total[8]
+    rows.append(total)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Выписка"
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+
+
+def statement_snapshot(df, account, start, finish, bb, eb):
+    """df FIELDS_TO_KEEP и шапка выписки в виде, пригодном для json."""
+    def plain(value):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            return None
+        if isinstance(value, (pd.Timestamp, dt.date)):
+            return value.strftime("%Y-%m-%d")
+        return value.item() if isinstance(value, np.generic) else value
+
+    df = df.reset_index(drop=True).astype(object).where(df.notna(), None)
+    return {
+        "header": [account, plain(start), plain(finish), plain(bb), plain(eb)],
+        "columns": list(df.columns),
+        "rows": [[plain(v) for v in row] for row in df.itertuples(index=False)],
+    }
+
+
+class StatementBaselineTests(SimpleTestCase):
+    """
+    Разбор 1С и xlsx сверяется со снимком, снятым со старого adjust_df /
+    make_final_statemens на тех же синтетических файлах.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(STATEMENTS_BASELINE, encoding="utf-8") as f:
+            cls.baseline = json.load(f)
+
+    def check(self, kind, write):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"statement.{kind}")
+            write(path)
+            df, *header = parse_statement(path)
+            details = get_bs_details(path)
+
+        snapshot = statement_snapshot(df, *header)
+        expected = self.baseline[kind]
+        self.assertEqual(snapshot["columns"], expected["columns"])
+        self.assertEqual(snapshot["header"], expected["header"])
+        self.assertEqual(statement_snapshot(df.iloc[:0], *details)["header"], expected["header"])
+        self.assertEqual(len(snapshot["rows"]), len(expected["rows"]))
+        for got, want in zip(snapshot["rows"], expected["rows"]):
+            self.assertEqual(got, want)
+
+    def test_1c(self):
+        self.check("txt", lambda path: synthetic.write_1c(path, 40, cps=8, seed=3))
+
+    def test_xlsx(self):
+        self.check("xlsx", write_xlsx_with_rules)
+
+
+class PairLegsTests(SimpleTestCase):
+    def leg(self, id, day, is_out, amount=100, payer="A", reciver="B"):
+        return Leg(id, dt.date(2024, 1, day), 1 if is_out else 2, 2 if is_out else 1, "RUB", is_out, amount, payer, reciver)
+
+    def test_nearest_inflow_within_window(self):
+        out = self.leg(1, 10, True)
+        near, far, other_amount = self.leg(2, 11, False), self.leg(3, 9, False), self.leg(4, 10, False, amount=50)
+        pairs = pair_legs([out, far, near, other_amount], window=3)
+        self.assertEqual([(o.id, i.id) for o, i in pairs], [(1, 2)])
+
+    def test_each_inflow_used_once_and_window(self):
+        legs = [self.leg(1, 10, True), self.leg(2, 10, True), self.leg(3, 10, False), self.leg(4, 20, False)]
+        self.assertEqual([(o.id, i.id) for o, i in pair_legs(legs, window=3)], [(1, 3)])
+        self.assertEqual(len(pair_legs(legs, window=10)), 2)
+
+
+class CfPivotCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cf_pivot._local.clear()
+        self.addCleanup(cf_pivot._local.clear)
+
+    def test_new_version_overwrites_cached_cube(self):
+        first = cf_pivot.get_pivot()
+        bump_data_version()
+        cf_pivot._local.clear()  # другой процесс: куба в памяти нет
+        second = cf_pivot.get_pivot()
+
+        self.assertEqual(second.version, data_version())
+        self.assertNotEqual(first.version, second.version)
+        self.assertEqual(cache.get(cf_pivot.CACHE_KEY).version, second.version)
+        self.assertEqual(len(cache._cache), 1)
+
+
+class RateTableTests(TestCase):
+    def setUp(self):
+        for currency, day, rate in (("USD", 5, 90), ("USD", 8, 91), ("EUR", 5, 99)):
+            CurrencyRate.objects.create(date=dt.date(2024, 1, day), base_currency="RUB", currency=currency, rate=rate)
+        self.rates = RateTable({"USD", "EUR"})
+
+    def test_rate_as_of_date(self):
+        # 06-07.01 — выходные: курс пятницы; 04.01 — курса ещё нет
+        days = [dt.date(2024, 1, d) for d in (4, 5, 6, 7, 8)]
+        np.testing.assert_array_equal(self.rates.to_rub("USD", days), [np.nan, 90, 90, 90, 91])
+        np.testing.assert_array_equal(self.rates.to_rub("RUB", days), [1] * 5)
+
+    def test_convert_to_other_base(self):
+        saturday = dt.date(2024, 1, 6)
+        converted = self.rates.convert([99, 100, 99, 5], ["USD", "EUR", "RUB", "GBP"], [saturday] * 4, base="EUR")
+        np.testing.assert_allclose(converted[:3], [90, 100, 1])
+        self.assertTrue(np.isnan(converted[3]))
+
+
+class ConsolidationNettingTests(TestCase):
+    def setUp(self):
+        owner = Owners.objects.create(name="Собственник", inn="7700000001")
+        self.accounts = [
+            BankAccount.objects.create(corporate=owner, account=f"4070281000000000000{n}", currency="RUB")
+            for n in (1, 2)
+        ]
+        for ba in self.accounts:
+            BankStatements.objects.create(
+                owner=owner, ba=ba, start=dt.date(2024, 1, 1), finish=dt.date(2024, 1, 10), bb=1000, eb=1000,
+            )
+        first, second = self.accounts
+        out_leg = self.add_row(first, dt_amount=0, cr_amount=100)
+        in_leg = self.add_row(second, dt_amount=100, cr_amount=0)
+        self.add_row(first, dt_amount=50, cr_amount=0, doc="2")
+        IntercompanyMatch.objects.create(
+            out_leg=out_leg, in_leg=in_leg, amount=100, currency="RUB",
+            out_ba=first, in_ba=second, out_date=out_leg.date, in_date=in_leg.date,
+        )
+        for ba in self.accounts:
+            refresh_daily_balance(ba.pk)
+
+    def add_row(self, ba, dt_amount, cr_amount, doc="1"):
+        return CfData.objects.create(
+            bs=BankStatements.objects.get(ba=ba), ba=ba, date=dt.date(2024, 1, 3), doc_numner=doc,
+            dt=dt_amount, cr=cr_amount, intercompany=True,
+        )
+
+    def consolidate(self, net_intercompany):
+        day = dt.date(2024, 1, 10)
+        return consolidate_balances(eod_balances(day), day, net_intercompany=net_intercompany)
+
+    def test_matched_pair_is_excluded_from_turnover(self):
+        gross, net = self.consolidate(False), self.consolidate(True)
+
+        self.assertEqual((gross["dt"], gross["cr"]), (150, 100))
+        self.assertEqual((net["dt"], net["cr"]), (50, 0))
+        self.assertEqual(net["eod"], gross["eod"])
+        self.assertEqual(net["eod"], 2050)
+
+
+class LedgerExportTests(TestCase):
+    """Выгрузки операций: EOD в Excel и CSV из списка CfData."""
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = Owners.objects.create(name="Собственник", inn="7700000001")
+        bank = Bank.objects.create(name="Банк", bik="044525411")
+        cls.ba = BankAccount.objects.create(corporate=owner, bank=bank, account="40702810000000000001")
+        bs = BankStatements.objects.create(
+            file="migrations/statement.txt", file_hash="0" * 64, owner=owner, ba=cls.ba,
+            start=dt.date(2024, 1, 1), finish=dt.date(2024, 1, 10), bb=1000, eb=2600,
+        )
+        # статья пятого уровня: в CSV колонки уровней обрезаются на четвёртом
+        parent = None
+        for code, name in (("100000", "Операционная"), ("110000", "Поступления"), ("111000", "Выручка"),
+                           ("111100", "Аренда"), ("111110", "Аренда офиса")):
+            parent = CfItems.objects.create(code=code, name=name, parent=parent)
+        rent = CfItems.objects.get(code="111100")
+        taxes = CfItems.objects.create(code="200000", name="Налоги")
+
+        tenant = Counterparty.objects.create(tax_id="7700000002", name="Арендатор")
+        agency = Counterparty.objects.create(tax_id="7700000003", name="ИФНС")
+        cls.contract = contract = Contracts.objects.create(
+            title=ContractsTitle.objects.create(title="Договор аренды"), owner=owner, cp=tenant,
+            number="15", date=dt.date(2023, 2, 1),
+        )
+        for day, doc, dt_amount, cr_amount, cp, cp_final, cfitem, name in (
+            (3, "1", 500, 0, tenant, tenant, rent, None),
+            (3, "2", 0, 120, agency, None, taxes, None),
+            (5, "3", 300, 0, None, None, parent, "Физлицо"),
+            (5, "4", 0, 80, tenant, agency, None, None),
+            (8, "5", 1000, 0, tenant, tenant, rent, None),
+        ):
+            CfData.objects.create(
+                bs=bs, ba=cls.ba, owner=owner, date=dt.date(2024, 1, day), doc_numner=doc,
+                dt=dt_amount, cr=cr_amount, cp=cp, cp_final=cp_final, cfitem=cfitem, cp_bs_name=name,
+                contract=contract if cfitem == rent else None, temp=f"Операция {doc}", intercompany=False,
+            )
+        refresh_daily_balance(cls.ba.pk)
+
+    def test_eod_xlsx(self):
+        request = RequestFactory().get("/", {"in_period_date": "2024-01-05"})
+        wb = load_workbook(BytesIO(b"".join(export_eod_xlsx(request))), read_only=True)
+
+        def rows(title):
+            return [list(r) for r in wb[title].iter_rows(min_row=3, values_only=True)]
+
+        self.assertEqual(rows("Остатки"), [[
+            "Собственник", "Банк", "40702810000000000001", "RUB", 1380, 300, 80, 1600, "01.01.2024-10.01.2024",
+        ]])
+        self.assertEqual([r[:5] for r in rows("Расчеты с контрагентами")], [
+            ["Арендатор (ИНН: 7700000002)", 500, 0, 500, 1],
+            ["Физлицо", 300, 0, 300, 1],
+            ["ИФНС (ИНН: 7700000003)", 0, 200, -200, 2],
+            ["Итого", "=SUM(B3:B5)", "=SUM(C3:C5)", "=SUM(D3:D5)", None],
+        ])
+        self.assertEqual([r[:5] for r in rows("Cash Flow")], [
+            ["111100 Аренда", 500, 0, 500, 1],
+            ["111110 Аренда офиса", 300, 0, 300, 1],
+            ["200000 Налоги", 0, 120, -120, 1],
+            ["—", 0, 80, -80, 1],
+            ["Итого", "=SUM(B3:B6)", "=SUM(C3:C6)", "=SUM(D3:D6)", None],
+        ])
+
+        operations = rows("Все операции")
+        self.assertEqual([r[1] for r in operations[:-1]], ["1", "2", "3", "4"])
+        self.assertEqual(sum(r[6] for r in operations[:-1]), 800)
+        self.assertEqual(sum(r[7] for r in operations[:-1]), 200)
+        self.assertEqual(operations[-1][6:9], ["=SUM(G3:G6)", "=SUM(H3:H6)", "=SUM(I3:I6)"])
+        self.assertEqual(
+            [r[:5] for r in operations[:-1]],
+            [
+                ["03.01.2024", "1", None, "Арендатор (ИНН: 7700000002)", str(self.contract)],
+                ["03.01.2024", "2", None, "ИФНС (ИНН: 7700000003)", "—"],
+                ["05.01.2024", "3", None, "Физлицо", "—"],
+                ["05.01.2024", "4", None, "ИФНС (ИНН: 7700000003)", "—"],
+            ],
+        )
+        for title in ("День — контрагенты", "День — Cash Flow"):
+            grand = rows(title)[-1]
+            self.assertEqual([grand[0], grand[3], *grand[6:9]], ["ОБЩИЙ ИТОГ", "Операций: 2", 300, 80, 220])
+        self.assertEqual([r[0] for r in rows("Контроль качества")[:5]], [
+            "Всего операций", "Без статьи CF", "Без договора", "Без финального контрагента", "Нулевые суммы",
+        ])
+        self.assertEqual([r[1] for r in rows("Контроль качества")[:5]], [4, 1, 3, 2, 0])
+
+    def test_csv_export(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "admin"))
+        response = self.client.get(reverse("admin:treasury_cfdata_export_csv"))
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        header, *rows = csv.reader(content.splitlines(), delimiter="|")
+        rows = sorted((dict(zip(header, row)) for row in rows), key=lambda r: (r["date"], r["amount"]))
+
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(sum(Decimal(r["amount"]) for r in rows), 1600)
+        self.assertEqual(sum(Decimal(r["dt"] or 0) for r in rows), 1800)
+        self.assertEqual(sum(Decimal(r["cr"] or 0) for r in rows), 200)
+
+        # уровни статей — как раньше через get_ancestors() на каждую строку
+        for row in rows:
+            item = CfItems.objects.filter(name=row["cfitem_name"]).first()
+            names = [a.name for a in item.get_ancestors(include_self=True)] if item else []
+            self.assertEqual(row["cfitem_path_names"], " / ".join(names))
+            self.assertEqual([row[f"cfitem_lvl{i}_name"] for i in range(1, 5)], (names + [""] * 4)[:4])
+        self.assertEqual(
+            [row["cfitem_lvl4_name"] for row in rows], ["", "Аренда", "", "Аренда", "Аренда"],
+        )
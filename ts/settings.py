@@ -27,6 +27,24 @@ CHECKO_API_KEY = 'SIwfo6CFilGM4fUX'
 CHECKO_API_BANK_URL = "https://api.checko.ru/v2/bank"
 CHECKO_API_COMPANY_URL = "https://api.checko.ru/v2/company"
 
+# ---------------------------
+# Treasury
+# ---------------------------
+# Сверка переводов между своими счетами: сколько дней может пройти
+# между списанием и зачислением (services/intercompany_match.py)
+INTERCOMPANY_MATCH_WINDOW_DAYS = 3
+
+# Триграммный индекс по назначению платежа (нужно расширение pg_trgm):
+# поиск строк, задетых изменением правил. False — миграция 0020 его не строит
+TREASURY_TRGM_INDEX = True
+
+# Задача обработки выписки, от воркера которой столько минут не было сигнала
+# (heartbeat_at), считается брошенной: упавший воркер не держит выписку вечно
+STATEMENT_JOB_TIMEOUT_MINUTES = 60
+
+# Как часто воркер, пока выполняет задачи, обновляет им heartbeat_at, сек
+STATEMENT_JOB_HEARTBEAT_SECONDS = 60
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -326,6 +344,7 @@ JAZZMIN_SETTINGS = {
         "treasury.BankStatements": "fa-solid fa-receipt",
         "treasury.CfData": "fa-solid fa-arrows-rotate",
         "treasury.ContractsRexex": "fa-solid fa-robot",
+        "treasury.IntercompanyRule": "fa-solid fa-people-arrows",
     
 
 
@@ -1,8 +1,11 @@
 # Парсер банковских выписок для TS
 
+import os
+import time
+
 import numpy as np
 import pandas as pd
-from .xls_parser import adjust_df
+from .formats import SNIFF_BYTES, StatementFormat, detect, register
 
 
 # Поля выписок
@@ -77,20 +80,145 @@ ts_banks_accounts = [
 ]
 
 
-# Функция декодирования выписок 1С
-def bs_decode(filepath) -> str:
+# Кодировки, в которых 1С выгружает выписки
+BS_ENCODINGS = ("windows-1251", "cp866")
+
+# Маркеры шапки 1CClientBankExchange: в правильной кодировке они читаются как есть
+BS_HEADER_MARKERS = ("Кодировка", "ВерсияФормата", "ДатаНачала", "РасчСчет")
+
+# Поля шапки, которые подбираем по ходу чтения файла
+HEADER_FIELDS = {
+    "РасчСчет": "account",
+    "ДатаНачала": "start_date",
+    "ДатаКонца": "end_date",
+    "НачальныйОстаток": "bb",
+    "КонечныйОстаток": "eb",
+}
+
+# Сколько байт с конца файла смотрим, если остатки выгружены после документов
+HEADER_TAIL_BYTES = 64 * 1024
+
+
+def sniff_encoding(head: bytes) -> str:
     """
-    Args:
-        file (str): путь к файлу
+    Определяем кодировку по первому блоку файла.
+    cp866 декодирует любые байты, поэтому смотрим, в какой кодировке
+    читаются маркеры шапки 1С, а не просто ловим UnicodeDecodeError.
     """
+    for encoding in BS_ENCODINGS:
+        try:
+            text = head.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        if any(marker in text for marker in BS_HEADER_MARKERS):
+            return encoding
+
     try:
-        with open(filepath, "r", encoding="windows-1251") as f:
-            lines = f.readlines()
+        head.decode(BS_ENCODINGS[0])
+        return BS_ENCODINGS[0]
     except UnicodeDecodeError:
-        with open(filepath, "r", encoding="cp866") as f:
-            lines = f.readlines()
+        return BS_ENCODINGS[1]
+
+
+# Функция декодирования выписок 1С
+def bs_decode(filepath):
+    """
+    Построчно читает выписку 1С, файл открывается один раз.
+    Args:
+        filepath (str): путь к файлу
+    """
+    with open(filepath, "rb") as f:
+        encoding = sniff_encoding(f.read(SNIFF_BYTES))
+        f.seek(0)
+        for raw in f:
+            yield raw.decode(encoding, errors="replace")
+
+
+def iter_bs_documents(filepath: str, header: dict | None = None):
+    """
+    Генератор документов выписки 1С: один словарь на каждую СекцияДокумент.
+    Поля шапки (счет, период, остатки) складываются в header по мере чтения,
+    полностью он заполнен, когда генератор исчерпан.
+    Args:
+        filepath (str): путь к файлу выписок
+        header (dict): сюда пишем поля шапки
+    """
+    if header is None:
+        header = {}
+
+    entry = None
+
+    for line in bs_decode(filepath):
+        line = line.strip()
+        if not line:
+            continue
+
+        key, sep, value = line.partition("=")
+
+        if key == "СекцияДокумент":
+            # документ без КонецДокумента — отдаем то, что успели собрать
+            if entry is not None:
+                yield entry
+            entry = {key: value}
+            continue
+
+        if entry is not None:
+            if key.startswith("КонецДокумента"):
+                yield entry
+                entry = None
+            elif sep:
+                entry[key] = value
+            continue
+
+        _header_field(header, key, sep, value)
+
+    if entry is not None:
+        yield entry
 
-    return lines
+
+def _header_field(header: dict, key: str, sep: str, value: str):
+    field = HEADER_FIELDS.get(key)
+    if sep and field and field not in header:
+        header[field] = value.strip()
+
+
+def parse_bs_header(header: dict):
+    """
+    Приводим поля шапки к типам: счет, дата начала, дата конца, остатки.
+    """
+
+    def to_float(value) -> float:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.00
+
+    account_id = header.get("account", "")
+    start_date = pd.to_datetime(header.get("start_date", ""), errors="coerce", dayfirst=True)
+    end_date = pd.to_datetime(header.get("end_date", ""), errors="coerce", dayfirst=True)
+
+    return account_id, start_date, end_date, to_float(header.get("bb")), to_float(header.get("eb"))
+
+
+def collect_columns(docs) -> pd.DataFrame:
+    """
+    Собираем документы сразу по колонкам: на больших выписках это
+    в разы меньше памяти, чем список словарей.
+    """
+    columns = {}
+    n = 0
+    for doc in docs:
+        for key, value in doc.items():
+            col = columns.get(key)
+            if col is None:
+                col = columns[key] = [None] * n
+            col.append(value)
+        n += 1
+        for col in columns.values():
+            if len(col) < n:
+                col.append(None)
+
+    return pd.DataFrame(columns)
 
 
 # Функция которая делает словарь из декодированных выписок 1С
@@ -101,93 +229,40 @@ def bs_to_dict(filepath: str) -> pd.DataFrame:
     Returns:
         df: df для работы
     """
+    header = {}
+    df = collect_columns(iter_bs_documents(filepath, header))
+    return (df, *parse_bs_header(header))
 
-    doc_index = []
-    init_dic_list = []
-
-    lines = bs_decode(filepath)
 
-    # Находим номер манковского счета
-    def get_bank_account(lines) -> str:
-        account_id = ""
-        for line in lines:
-            line = line.strip()
-            if "РасчСчет" in line:
-                part = line.split("=")
-                account_id = part[1].strip()
-                break
-        return account_id
-    
-    def get_bb(lines) -> float:
-        b_ballance = 0.00
-        for line in lines:
-            line = line.strip()  
-            if 'НачальныйОстаток' in line:
-                part = line.split('=')
-                try:
-                    b_ballance = float(part[1].strip())
-                except:
-                    b_ballance = 0.00
-                break
-        return b_ballance
-    
-    def get_eb(lines) -> float:
-        b_ballance = 0.00
-        for line in lines:
-            line = line.strip()  
-            if 'КонечныйОстаток' in line:
-                part = line.split('=')
-                try:
-                    b_ballance = float(part[1].strip())
-                except:
-                    b_ballance = 0.00
-                break
-        return b_ballance
-    
-    def get_start_date(lines) -> str:        
-        date_start = ''
-        for line in lines:
-            line = line.strip()  
-            if 'ДатаНачала' in line:
-                part = line.split('=')
-                date_start = part[1].strip()
-                break
-        return  pd.to_datetime(date_start,errors='coerce',dayfirst=True)
-    
-    def get_end_date(lines) -> str:
-        date_start = ''
-        for line in lines:
-            line = line.strip()  
-            if 'ДатаКонца' in line:
-                part = line.split('=')
-                date_start = part[1].strip()
+def read_bs_header(filepath: str):
+    """
+    Шапка выписки 1С без разбора документов: читаем до первой СекцияДокумент.
+    Обычно СекцияРасчСчет со всеми остатками стоит перед документами; если
+    каких-то полей там нет (их пишут после документов), смотрим хвост файла
+    после последнего КонецДокумента. Сами документы не читаются.
+    """
+    header = {}
+    with open(filepath, "rb") as f:
+        encoding = sniff_encoding(f.read(SNIFF_BYTES))
+        f.seek(0)
+        for raw in f:
+            key, sep, value = raw.decode(encoding, errors="replace").strip().partition("=")
+            if key == "СекцияДокумент":
                 break
-        return  pd.to_datetime(date_start,errors='coerce',dayfirst=True)
+            _header_field(header, key, sep, value)
 
-    for index, line in enumerate(lines):
-        line = line.strip()
-        if "СекцияДокумент" in line:
-            doc_index.append(index)
-
-    for index in doc_index:
-        entry = {}
-        for i in range(500):
-            line = lines[int(index) + i].strip()
-            if "КонецДокумента" in line:
-                break
-            if line == "":
-                continue
-            parts = line.split("=")
-            entry[parts[0]] = parts[1]
-        init_dic_list.append(entry)
+        if len(header) < len(HEADER_FIELDS):
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - HEADER_TAIL_BYTES, 0))
+            tail = f.read().decode(encoding, errors="replace").rpartition("КонецДокумента")[2]
+            for line in tail.splitlines():
+                key, sep, value = line.strip().partition("=")
+                _header_field(header, key, sep, value)
 
-    return pd.DataFrame(init_dic_list), get_bank_account(lines), get_start_date(lines), get_end_date(lines),get_bb(lines),get_eb(lines)
+    return parse_bs_header(header)
 
 def get_bs_details(filepath:str):
-    if filepath.endswith('xlsx'):
-       df, bank, start_date,end_date,bb,eb = adjust_df(filepath) 
-    else:
-        df, bank, start_date,end_date,bb,eb = bs_to_dict(filepath)
+    bank, start_date,end_date,bb,eb = detect(filepath).header(filepath)
     return bank, start_date,end_date,bb,eb
     
 # df = bs_to_dict('/Users/pavelustenko/Desktop/Банковские_счета/Вайлдберриз.txt')[0]
@@ -196,12 +271,42 @@ def get_bs_details(filepath:str):
 # Здесь основная функция которая делает df для дальнейшей загрузки в базу данных
 # В дальнейшем подставляем id из связанных моделей. НЕ ЗАБЫТЬ
 def make_final_statemens(filepath: str, ts_inn=None, ts_banks_accounts=None):
-    
-    if filepath.endswith('xlsx'):
-       return adjust_df(filepath)[0]
-     
-    init_df, account_id, start_date, end_date,bb,eb = bs_to_dict(filepath)
-    
+    return parse_statement(filepath, ts_inn=ts_inn)[0]
+
+
+def parse_statement(filepath: str, ts_inn=None):
+    """
+    Полный разбор выписки за один проход по файлу, без обращений к БД,
+    поэтому годится для пула процессов.
+    Формат выписки определяется по первым байтам файла (formats.detect).
+    Returns:
+        (df, счет, дата начала, дата конца, нач. остаток, кон. остаток)
+    """
+    return detect(filepath).parse(filepath, ts_inn=ts_inn)
+
+
+def timed_parse_statement(filepath: str, ts_inn=None):
+    """parse_statement для пула процессов: (результат, секунды разбора в дочернем процессе)."""
+    started = time.perf_counter()
+    parsed = parse_statement(filepath, ts_inn=ts_inn)
+    return parsed, time.perf_counter() - started
+
+
+def parse_1c(filepath: str, ts_inn=None):
+    init_df, account_id, start_date, end_date, bb, eb = bs_to_dict(filepath)
+    return normalize_statement(init_df, account_id, ts_inn=ts_inn), account_id, start_date, end_date, bb, eb
+
+
+def is_1c_statement(head: bytes) -> bool:
+    """Текстовый 1CClientBankExchange: маркеры шапки читаются в одной из кодировок 1С."""
+    text = head.decode(sniff_encoding(head), errors="replace")
+    return "1CClientBankExchange" in text or any(marker in text for marker in BS_HEADER_MARKERS)
+
+
+def normalize_statement(init_df: pd.DataFrame, account_id: str, ts_inn=None) -> pd.DataFrame:
+    """
+    Из сырых полей 1С делаем df с колонками FIELDS_TO_KEEP.
+    """
     ts_inn = ts_inn if ts_inn else ts_inn_default
 
     payer_src = (
@@ -261,20 +366,7 @@ def make_final_statemens(filepath: str, ts_inn=None, ts_banks_accounts=None):
 
     # Выделям intercompany trasactions
     df["intercompany"] = np.where(df["tax_id"].isin(ts_inn), True, False)
-    
-    
-    
-    from .intercompany_rules import (
-    INTERCOMPANY_EXCLUDE,
-    INTERCOMPANY_INCLUDE,
-    apply_intercompany_overrides,
-        )
-
-    df = apply_intercompany_overrides(
-        df,
-        exclude=INTERCOMPANY_EXCLUDE,
-        include=INTERCOMPANY_INCLUDE,
-    )
+    # ручные правки (IntercompanyRule) применяются при записи, см. bsupdater.write_statement
 
 
     # Выделяем контрагента по выписки
@@ -291,3 +383,11 @@ def make_final_statemens(filepath: str, ts_inn=None, ts_banks_accounts=None):
 
     return df[FIELDS_TO_KEEP]
 
+
+register(StatementFormat(
+    name="1c",
+    title="1С: Клиент-банк (txt)",
+    sniff=is_1c_statement,
+    parse=parse_1c,
+    header=read_bs_header,
+))
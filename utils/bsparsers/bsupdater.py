@@ -1,18 +1,27 @@
 # Скрипты для апдейта выписок
 
-from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
+from django.utils.html import escape
 import locale
 
 locale.setlocale(locale.LC_TIME, "ru_RU.UTF-8")
 import pandas as pd
 import numpy as np
 import re
-
-from .bsparser import make_final_statemens, get_bs_details
-from treasury.models import CfData, ContractsRexex
-from corporate.models import Owners, BankAccount
-from contracts.models import Contracts
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .bsparser import parse_statement, timed_parse_statement
+from .formats import detect
+from .classifier import Classifier
+from .intercompany_rules import apply_intercompany_overrides
+from treasury.models import CfData, IntercompanyRule, doc_fingerprint
+from treasury.services.daily_balance import refresh_daily_balance
+from treasury.services.statement_quality import refresh_statement_quality
+from treasury.services.data_version import bump_data_version
+from treasury.services.intercompany_match import match_statement
+from corporate.models import BankAccount
 
 
 # Грузим паттерны для выделения ставки НДС
@@ -26,229 +35,257 @@ from counterparties.models import Counterparty
 # --------------------------
 
 
-def upsert_cf_data(df: pd.DataFrame) -> str:
+# Колонки treasury_cfdata, которые заполняем из выписки
+CF_COLUMNS = [
+    "bs_id", "doc_type", "doc_numner", "doc_date", "date",
+    "dt", "cr", "tax_id", "temp", "cp_bs_name", "intercompany",
+    "payer_account", "reciver_account", "vat_rate",
+    "cp_id", "cp_final_id", "owner_id", "contract_id", "cfitem_id", "ba_id",
+    "fingerprint",
+]
 
-    df = df.where(df.notna(), None)
+# Ключ uniq_cfdata_bs_row
+CF_CONFLICT = ["bs_id", "doc_numner", "date", "dt", "cr"]
 
-    sql = """
-        INSERT INTO treasury_cfdata (
-            bs_id, doc_type, doc_numner, doc_date, date,
-            dt, cr, tax_id, temp, cp_bs_name, intercompany,
-            payer_account, reciver_account, vat_rate,
-            cp_id, cp_final_id, owner_id, contract_id, cfitem_id, ba_id
-        )
-        VALUES (
-            %(bs_id)s, %(doc_type)s, %(doc_numner)s, %(doc_date)s, %(date)s,
-            %(dt)s, %(cr)s, %(tax_id)s, %(temp)s, %(cp_bs_name)s, %(intercompany)s,
-            %(payer_account)s, %(reciver_account)s, %(vat_rate)s,
-            %(cp_id)s, %(cp_final_id)s, %(owner_id)s, %(contract_id)s, %(cfitem_id)s, %(ba_id)s
-        )
-        ON CONFLICT (bs_id, doc_numner, date, dt, cr)
-        DO UPDATE SET
-            doc_type = EXCLUDED.doc_type,
-            doc_date = EXCLUDED.doc_date,
-            tax_id = EXCLUDED.tax_id,
-            temp = EXCLUDED.temp,
-            cp_bs_name = EXCLUDED.cp_bs_name,
-            intercompany = EXCLUDED.intercompany,
-            payer_account = EXCLUDED.payer_account,
-            reciver_account = EXCLUDED.reciver_account,
-            vat_rate = EXCLUDED.vat_rate,
-            cp_id = EXCLUDED.cp_id,
-            cp_final_id = EXCLUDED.cp_final_id,
-            owner_id = EXCLUDED.owner_id,
-            contract_id = EXCLUDED.contract_id,
-            cfitem_id = EXCLUDED.cfitem_id,
-            ba_id = EXCLUDED.ba_id
+
+def _copy_rows(df: pd.DataFrame):
+    """
+    Строки df в виде python-кортежей для COPY (+ порядковый номер строки).
     """
+    df = df[CF_COLUMNS].copy()
+    df["date"] = pd.to_datetime(df["date"], errors="coerce").dt.date
+    df = df.astype(object).where(df.notna(), None)
 
-    rows = df.to_dict(orient="records")
+    for seq, row in enumerate(df.itertuples(index=False, name=None)):
+        yield (*row, seq)
 
-    with connection.cursor() as cursor:
-        cursor.executemany(sql, rows)
 
-    return f"Загружено {len(df)} операций"
+def copy_upsert_cf_data(df: pd.DataFrame) -> tuple[int, int]:
+    """
+    Грузим выписку через COPY во временную таблицу и одним
+    INSERT ... SELECT ... ON CONFLICT сливаем в treasury_cfdata.
+    Returns:
+        (inserted, updated)
+    """
+    cols = ", ".join(CF_COLUMNS)
+    key = ", ".join(CF_CONFLICT)
+    updates = ",\n            ".join(
+        f"{c} = EXCLUDED.{c}" for c in CF_COLUMNS if c not in CF_CONFLICT
+    )
+    # строки с NULL в ключе не конфликтуют, их не схлопываем
+    nullable_key = " OR ".join(f"{c} IS NULL" for c in CF_CONFLICT)
+
+    create_sql = f"""
+        DROP TABLE IF EXISTS cfdata_stage;
+        CREATE TEMP TABLE cfdata_stage ON COMMIT DROP AS
+        SELECT {cols}, 0::bigint AS seq
+        FROM treasury_cfdata
+        WITH NO DATA;
+    """
 
+    # дубли ключа внутри одной выписки: как и при построчной вставке,
+    # побеждает последняя строка
+    merge_sql = f"""
+        WITH src AS (
+            SELECT *,
+                   row_number() OVER (PARTITION BY {key} ORDER BY seq DESC) AS rn
+            FROM cfdata_stage
+        ),
+        upserted AS (
+            INSERT INTO treasury_cfdata ({cols})
+            SELECT {cols}
+            FROM src
+            WHERE rn = 1 OR {nullable_key}
+            ORDER BY seq
+            ON CONFLICT ({key})
+            DO UPDATE SET
+            {updates}
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT
+            COUNT(*) FILTER (WHERE inserted),
+            COUNT(*) FILTER (WHERE NOT inserted)
+        FROM upserted;
+    """
 
-# --------------------------
-# Тут магия и геморой начинается ниже функции для авторазностки выписок
-# --------------------------
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(create_sql)
+        with cursor.cursor.copy(f"COPY cfdata_stage ({cols}, seq) FROM STDIN") as copy:
+            for row in _copy_rows(df):
+                copy.write_row(row)
+        cursor.execute(merge_sql)
+        inserted, updated = cursor.fetchone()
 
+    return inserted, updated
 
-# Находим ставку НДС !!!! НУЖНО ДОДЕЛАТЬ ЭТО ГЕМОР через SQL тоже никак 
-def find_vat_rate(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    s = df["temp"].fillna("").str.lower()
 
-    # Выделяем ставку НДС
-    df["vat_rate"] = None
+def upsert_cf_data(df: pd.DataFrame, stats: dict | None = None) -> str:
+    inserted, updated = copy_upsert_cf_data(df)
+    if stats is not None:
+        stats.update(inserted=inserted, updated=updated)
+    return f"Загружено {len(df)} операций: новых {inserted}, обновлено {updated}"
 
-    # без НДС → 0
-    mask_no_vat = s.str.contains(NO_VAT, regex=True, flags=re.VERBOSE)
-    df.loc[mask_no_vat, "vat_rate"] = 0
 
-    # НДС со ставкой → число
-    rates = s.str.extract(VAT_RATE, flags=re.VERBOSE)[0]
-    mask_rate = rates.notna()
-    df.loc[mask_rate, "vat_rate"] = rates[mask_rate].astype(int)
+# --------------------------
+# Отпечаток документа: один и тот же платёж в перекрывающихся выписках счёта.
+# Формула (doc_fingerprint) — в treasury/models.py, её же пересчитывает правка CfData.
+# --------------------------
 
-    return df
 
-def find_contracts(bs_id):
-    q = """
-    -- 1. Сбрасываем договоры только для нужного bs_id
-    UPDATE treasury_cfdata
-    SET contract_id = NULL
-    WHERE bs_id = %(bs_id)s;
-
-    -- 2. Подбираем договоры только для нужного bs_id
-    WITH contract_patterns AS (
-        SELECT id AS contract_id, regex AS pattern
-        FROM contracts_contracts
-        WHERE regex IS NOT NULL AND regex <> ''
-    ),
-    matched AS (
-        SELECT DISTINCT ON (d.id)
-            d.id AS cf_id,
-            cp.contract_id
-        FROM treasury_cfdata d
-        JOIN contract_patterns cp
-          ON d.temp IS NOT NULL
-         AND d.temp ~* cp.pattern
-        WHERE d.bs_id = %(bs_id)s
-        ORDER BY d.id, length(cp.pattern) DESC, cp.contract_id ASC
+def doc_fingerprints(df: pd.DataFrame) -> pd.Series:
+    dates = pd.to_datetime(df["date"], errors="coerce").dt.date
+    return pd.Series(
+        [
+            doc_fingerprint(ba_id, date, doc_numner, dt, cr)
+            for ba_id, date, doc_numner, dt, cr
+            in zip(df["ba_id"], dates, df["doc_numner"], df["dt"].astype(float), df["cr"].astype(float))
+        ],
+        index=df.index,
+        dtype=object,
     )
-    UPDATE treasury_cfdata d
-    SET contract_id = m.contract_id
-    FROM matched m
-    WHERE d.id = m.cf_id
-      AND d.bs_id = %(bs_id)s
-    RETURNING d.id;
-    """
-    
-    q_count = """
-    SELECT COUNT(*)
-    FROM treasury_cfdata
-    WHERE bs_id = %(bs_id)s
-      AND contract_id IS NOT NULL;
-    """
 
-    with connection.cursor() as cursor:
-        cursor.execute(q, {"bs_id": bs_id})
-        cursor.execute(q_count, {"bs_id": bs_id})
-        assigned_count = cursor.fetchone()[0]
-
-    return assigned_count
-
-# Ищем договор по exceptions и ИНН
-def contracts_exceptions_cp(bs_id):
-    q = """
-        UPDATE treasury_cfdata
-        SET contract_id = %(contract_id)s
-        WHERE bs_id = %(bs_id)s
-          AND cp_id = %(cp_id)s
-          AND temp IS NOT NULL
-          AND temp ~* %(pattern)s
-          AND contract_id IS NULL
-    """
 
-    total = 0
-
-    qs = ContractsRexex.objects.values("cp_id", "regex", "contract_id")
-
-    with connection.cursor() as cursor:
-        for row in qs:
-            cursor.execute(q, {
-                "bs_id": bs_id,
-                "cp_id": row["cp_id"],
-                "pattern": row["regex"],
-                "contract_id": row["contract_id"],
-            })
-            total += cursor.rowcount
-
-    return total
-
-# Теперь обновляем конечных контрагентов по договорам
-# ЛЮТЕЙШЕЕ НАРУШЕНИЕ ВСЕХ МЫСЛИМЫХ НФ НО БЛИН ТУТ НЕЧЕГО НЕ ПОДЕЛАЕШЬ
-def find_cp_final(bs_id):
-    q = """
-    UPDATE treasury_cfdata d
-    SET cp_final_id = c.cp_id
-    FROM contracts_contracts c
-    WHERE d.contract_id = c.id
-     AND d.bs_id = %(bs_id)s;
-    
+def drop_loaded_documents(df: pd.DataFrame, ba_id, bs_id) -> tuple[pd.DataFrame, int]:
     """
-    with connection.cursor() as cursor:
-        cursor.execute(q, {"bs_id": bs_id})
-    
-    return "Обновили финальных контрагентов"
-
-
-def find_cfitem(bs_id):
-    q = """
-    with def_cf as (
-    SELECT
-    d.id,
-    d.temp,
-    d.dt,
-    d.cr,
-    CASE WHEN d.dt = 0 then t.defaultcfcr_id else t.defaultcfdt_id end as cf_id
-    from treasury_cfdata as d
-    join contracts_cfitemauto as t on 
-    d.contract_id = t.contract_id AND d.temp ~* t.regex
+    Выписки по счёту перекрываются по периоду: документы, которые уже лежат
+    в других выписках этого счёта, не грузим второй раз.
+    Returns:
+        (df без таких документов, сколько отброшено)
+    """
+    dates = pd.to_datetime(df["date"], errors="coerce").dropna()
+    if df.empty or dates.empty:
+        return df, 0
+
+    loaded = set(
+        CfData.objects
+        .filter(ba_id=ba_id, date__range=(dates.min().date(), dates.max().date()))
+        .exclude(bs_id=bs_id)
+        .exclude(fingerprint__isnull=True)
+        .values_list("fingerprint", flat=True)
     )
+    if not loaded:
+        return df, 0
 
-    UPDATE treasury_cfdata d
-    SET cfitem_id = c.cf_id
-    FROM def_cf c
-    WHERE d.id = c.id
-    and d.bs_id = %(bs_id)s;
-    """
-    q_count = """
-    SELECT COUNT(*)
-    FROM treasury_cfdata
-    WHERE bs_id = %(bs_id)s
-      AND cfitem_id IS NOT NULL;
+    mask = df["fingerprint"].isin(loaded)
+    return df[~mask].copy(), int(mask.sum())
+
+
+# --------------------------
+# Тут магия и геморой начинается ниже функции для авторазностки выписок
+# --------------------------
+
+
+# Находим ставку НДС: шаблоны считаем один раз на каждый различный текст
+NO_VAT_RX = re.compile(NO_VAT, re.VERBOSE)
+VAT_RATE_RX = re.compile(VAT_RATE, re.VERBOSE)
+
+
+def vat_rate_for(temp: str):
+    """Ставка НДС из назначения: число, 0 для «без НДС», None — не нашли."""
+    text = temp.lower()
+    rate = VAT_RATE_RX.search(text)
+    if rate:
+        return int(rate.group(1))
+    if NO_VAT_RX.search(text):
+        return 0
+    return None
+
+
+def vat_rates(temps: pd.Series) -> pd.Series:
     """
-    
-    with connection.cursor() as cursor:
-        cursor.execute(q, {"bs_id": bs_id})
-        cursor.execute(q_count, {"bs_id": bs_id})
-        assigned_count = cursor.fetchone()[0]
-
-    return assigned_count
-
-def owner_id_to_null(bs_id,owner_tax_id):
-    q = """
-    UPDATE treasury_cfdata t
-    SET 
-        cp_id = NULL,
-        intercompany = FALSE
-    WHERE t.bs_id = %(bs_id)s and t.tax_id = %(owner_tax_id)s
-      AND NOT (
-          t.payer_account IN (SELECT account FROM corporate_bankaccount)
-          AND
-          t.reciver_account IN (SELECT account FROM corporate_bankaccount)
-      );
+    Ставки НДС для колонки temp: повторяющиеся назначения
+    (аренда, коммуналка) проверяем один раз и раскладываем обратно через map.
     """
-    with connection.cursor() as cursor:
-        cursor.execute(q, {"bs_id": bs_id,"owner_tax_id":owner_tax_id})
-    
-    
+    rates = {temp: vat_rate_for(temp) for temp in temps.dropna().unique()}
+    result = temps.map(rates).astype("Int64").astype(object)
+    return result.where(result.notna(), None)
 
 
+def find_vat_rate(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df["vat_rate"] = vat_rates(df["temp"])
+    return df
+
 # --------------------------
 # Это основныя функция которая вызывается по кнопке migrate из админки и готовит df для записи в CfData
 # --------------------------
 
 
-def update_cf_data(filename:str, bs_id):
+def update_cf_data(filename:str, bs_id, progress=None, stats=None):
+    """
+    progress: необязательный callback progress(stage), вызывается в начале
+    каждого этапа (parse, prepare, classify, upsert) —
+    через него очередь обработки показывает ход работы.
+    stats: необязательный dict, сюда пишутся счётчики загрузки (см. write_statement)
+    """
+    if progress is not None:
+        progress("parse")
+
+    parsed = parse_statement(filename)
+    return write_statement(parsed, filename, bs_id, progress=progress, stats=stats)
+
+
+def batch_update_cf_data(statements, workers=None, progress=None, stats=None):
+    """
+    Пакетная обработка нескольких выписок.
+    Файлы разбираются параллельно в пуле процессов (чистый pandas, без БД),
+    а запись и SQL-разноска идут в одном процессе строго по очереди —
+    так treasury_cfdata пишет один писатель и блокировки не конкурируют.
+    Args:
+        statements: [(filename, bs_id), ...]
+        workers: число процессов, по умолчанию по числу ядер
+        progress: callback progress(bs_id, stage)
+        stats: {bs_id: dict} — счётчики загрузки по выпискам (+ parse_seconds из пула)
+    Yields:
+        (bs_id, текст уведомления или Exception)
+    """
+    statements = list(statements)
+    if not statements:
+        return
+
+    workers = workers or min(len(statements), os.cpu_count() or 1)
+
+    def stage_for(bs_id):
+        if progress is None:
+            return None
+        return lambda stage: progress(bs_id, stage)
+
+    # spawn: дочерним процессам не достаются соединения Django с БД
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+        for filename, bs_id in statements:
+            if progress is not None:
+                progress(bs_id, "parse")
+            futures.append(pool.submit(timed_parse_statement, filename))
+
+        for (filename, bs_id), future in zip(statements, futures):
+            bs_stats = stats.get(bs_id) if stats is not None else None
+            try:
+                parsed, seconds = future.result()
+                if bs_stats is not None:
+                    bs_stats["parse_seconds"] = seconds
+                yield bs_id, write_statement(parsed, filename, bs_id, progress=stage_for(bs_id), stats=bs_stats)
+            except Exception as e:
+                yield bs_id, e
+
+
+def write_statement(parsed, filename: str, bs_id, progress=None, stats=None):
+    """
+    Запись разобранной выписки в CfData и разноска договоров/статей.
+    parsed: результат parse_statement
+    stats: необязательный dict — формат, документов в файле, пропущено как
+    уже загруженные, разнесено, из кэша, вставлено / обновлено строк
+    """
+    if stats is None:
+        stats = {}
+
+    def stage(name):
+        if progress is not None:
+            progress(name)
 
-    bank, start_date, end_date, bb, eb = get_bs_details(filepath=filename)
+    stage("prepare")
+    df, bank, start_date, end_date, bb, eb = parsed
     account_number = bank    
-    
-    df = make_final_statemens(filename)
 
     notifications = []
 
@@ -269,14 +306,25 @@ def update_cf_data(filename:str, bs_id):
             owner_inn = ba.corporate.inn  
             
 
-    df['vat_rate'] = None
+    df = find_vat_rate(df)
+
+    # Ручные правки внутригрупповых — одни и те же для 1С и xlsx
+    df = apply_intercompany_overrides(
+        df,
+        IntercompanyRule.objects.filter(
+            date__in=set(df["date"].dropna().dt.date)
+        ).values_list("date", "fragment", "intercompany"),
+    )
 
     df["bs_id"] = int(bs_id)
     df["ba_id"] = int(ba_id)
     df["owner_id"] = int(owner_id)
     df['contract_id'] = None
 
-    if filename.endswith('xlsx'):
+    fmt = detect(filename)
+    stats.update(format=fmt.name, docs=len(df.index))
+
+    if fmt.tax_id_by_name:
        name_map = dict(Counterparty.objects.values_list("name","tax_id")) 
        df['tax_id'] = df['cp_bs_name'].map(name_map)
     
@@ -288,6 +336,7 @@ def update_cf_data(filename:str, bs_id):
 
     df["cp_final_id"] = None
     df["cfitem_id"] = None
+    df["fingerprint"] = doc_fingerprints(df)
 
     notifications.append(
         f"Компания: {company_name}; {bank_name} Расчетный счет № ...{account_number[-4:]} "
@@ -298,23 +347,48 @@ def update_cf_data(filename:str, bs_id):
         f"Обороты по dt {df.dt.sum():,.2f}; Обороты по cr {df.cr.sum():,.2f}"
     )
     
-    total_count = len(df.index)
     notifications.append(f"Количество операций по выписке: {len(df.index)}")
-    notifications.append(upsert_cf_data(df))
-    owner_id_to_null(bs_id,owner_inn)
-    
-    contracts_count = find_contracts(bs_id)
-    exceptions_count = contracts_exceptions_cp(bs_id)
+
+    df, skipped = drop_loaded_documents(df, ba_id, bs_id)
+    if skipped:
+        notifications.append(f"Пропущено {skipped} операций, уже загруженных из других выписок по счёту")
+    total_count = len(df.index)
+
+    # Разносим в памяти до записи: каждая строка пишется в treasury_cfdata один раз
+    stage("classify")
+    classifier = Classifier.load()
+    classified = classifier.classify(df, owner_inn=owner_inn, use_cache=True)
+    contracts_count = classified["contracts"]
+    exceptions_count = classified["exceptions"]
     tot_contracts = contracts_count + exceptions_count
-    
+    stats.update(skipped=skipped, rows=total_count, cache_hits=classified["cache_hits"])
+
+    stage("upsert")
+    notifications.append(upsert_cf_data(df, stats))
+    refresh_daily_balance(ba_id, since=start_date)
+    refresh_statement_quality([bs_id])
+    bump_data_version()
+    ic = match_statement(bs_id)
+
     notifications.append(f"назначены договора на {contracts_count} строк")
     notifications.append(f"назначены исключения на {exceptions_count} строк")
     notifications.append(f"📌 Всего назначено договоров на {tot_contracts} строк из {total_count}")
-    
-    notifications.append(find_cp_final(bs_id))
-    
-    cfitems_count = find_cfitem(bs_id)
-    notifications.append(f"Добавлено {cfitems_count} строк со статьями затрат")
+    notifications.append("Обновили финальных контрагентов")
+    notifications.append(f"Добавлено {classified['cfitem']} строк со статьями затрат")
+    if ic["legs"]:
+        notifications.append(
+            f"Переводы между своими счетами: {ic['pairs']} сопоставлено, {ic['unmatched']} пока без пары"
+        )
+    if classified["cache_rows"]:
+        hit_rate = classified["cache_hits"] / classified["cache_rows"]
+        notifications.append(
+            f"Кэш разноски: {classified['cache_hits']} из {classified['cache_rows']} строк ({hit_rate:.0%})"
+        )
+    for rule, rule_id, pattern, error in classifier.broken:
+        # уведомление выводится как HTML (mark_safe), в шаблонах бывают < и >
+        notifications.append(
+            f"⚠️ {rule} #{rule_id}: RegEx «{escape(pattern)}» не компилируется ({escape(error)}) — правило не работает"
+        )
 
     login_text = "<br>".join(notifications)
 
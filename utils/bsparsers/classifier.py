@@ -0,0 +1,257 @@
+# Разноска выписки в памяти: договор, исключения, финальный контрагент, статья CF.
+#
+# Раньше после вставки строк шли четыре UPDATE по treasury_cfdata
+# (owner_id_to_null, find_contracts, find_cp_final, find_cfitem) — каждая строка
+# переписывалась несколько раз. Теперь правила грузятся один раз, df
+# разносится до записи, и каждая строка пишется одним upsert-ом.
+
+import hashlib
+import re
+
+import pandas as pd
+
+from contracts.models import CfItemAuto, Contracts
+from corporate.models import BankAccount
+from treasury.models import ClassificationCache, ContractsRexex
+
+from .contract_matcher import ContractMatcher
+from .pg_regex import compile_rule, reads_digits
+
+# Числа (даты, суммы, номера счетов) в ключе кэша сворачиваем в один "0"
+NUMBERS = re.compile(r"[0-9]+")
+
+
+def _text(value):
+    return value if isinstance(value, str) else None
+
+
+def normalize_temp(temp: str) -> str:
+    """Назначение платежа для ключа кэша: каждое число заменено на 0."""
+    return NUMBERS.sub("0", temp)
+
+
+class Classifier:
+    """
+    Скомпилированные правила разноски.
+    Порядок и правила выбора — как в прежних SQL-шагах:
+      1. строки с ИНН собственника (не внутригрупповые) — без контрагента;
+      2. договор по Contracts.regex: самый длинный шаблон, затем меньший id;
+      3. исключения ContractsRexex для строк без договора: первое правило по id;
+      4. cp_final — контрагент договора;
+      5. статья CF по CfItemAuto договора: dt = 0 -> defaultcfcr, иначе defaultcfdt.
+    """
+
+    def __init__(self, contracts, exceptions, contract_cp, cfitem_rules, accounts):
+        contracts = [(cid, rx) for cid, rx in contracts if rx]
+        # правила, шаблон которых не компилируется: (правило, id, шаблон, ошибка)
+        self.broken = []
+
+        self.matcher = ContractMatcher(contracts)
+        self.contract_rx = {cid: self._compile("Договор", cid, rx) for cid, rx in contracts}
+        self.contract_rank = {cid: (-len(rx), cid) for cid, rx in contracts}
+
+        # правила, которые различают числа в тексте (reads_digits): их ответ входит в ключ кэша
+        self.digit_contracts = {cid for cid, rx in contracts if self.contract_rx[cid] and reads_digits(rx)}
+        self.digit_exceptions = {}
+        self.digit_cfitems = {}
+
+        self.exceptions = {}
+        for rule_id, cp_id, rx, contract_id in sorted(exceptions):
+            compiled = self._compile("Исключение", rule_id, rx)
+            self.exceptions.setdefault(cp_id, []).append((compiled, contract_id))
+            if compiled and reads_digits(rx):
+                self.digit_exceptions.setdefault(cp_id, []).append((rule_id, compiled))
+
+        self.cfitem_rules = {}
+        for rule_id, contract_id, rx, dt_item, cr_item in sorted(cfitem_rules):
+            compiled = self._compile("Статья CF", rule_id, rx)
+            self.cfitem_rules.setdefault(contract_id, []).append((compiled, dt_item, cr_item))
+            if compiled and reads_digits(rx):
+                self.digit_cfitems.setdefault(contract_id, []).append((rule_id, compiled))
+
+        self.contract_cp = dict(contract_cp)
+        self.accounts = set(accounts)
+        self._contract_cache = {}
+
+    def _compile(self, rule, rule_id, pattern):
+        errors = []
+        compiled = compile_rule(pattern, errors)
+        self.broken += [(rule, rule_id, rx, error) for rx, error in errors]
+        return compiled
+
+    @classmethod
+    def load(cls):
+        return cls(
+            contracts=Contracts.objects.exclude(regex__isnull=True).exclude(regex="").values_list("id", "regex"),
+            exceptions=ContractsRexex.objects.values_list("id", "cp_id", "regex", "contract_id"),
+            contract_cp=Contracts.objects.values_list("id", "cp_id"),
+            cfitem_rules=CfItemAuto.objects.values_list("id", "contract_id", "regex", "defaultcfdt_id", "defaultcfcr_id"),
+            accounts=BankAccount.objects.values_list("account", flat=True),
+        )
+
+    def match_contract(self, temp):
+        """Договор по Contracts.regex для текста назначения платежа."""
+        temp = _text(temp)
+        if temp is None:
+            return None
+        if temp in self._contract_cache:
+            return self._contract_cache[temp]
+
+        candidates = self.matcher.candidates(temp).union(self.matcher.unfiltered)
+        winner = None
+        for cid in sorted(candidates, key=self.contract_rank.__getitem__):
+            rx = self.contract_rx[cid]
+            if rx is not None and rx.search(temp):
+                winner = cid
+                break
+
+        self._contract_cache[temp] = winner
+        return winner
+
+    def match_exception(self, cp_id, temp):
+        temp = _text(temp)
+        if temp is None or cp_id is None:
+            return None
+        for rx, contract_id in self.exceptions.get(cp_id, ()):
+            if rx is not None and rx.search(temp):
+                return contract_id
+        return None
+
+    def match_cfitems(self, contract_id, temp):
+        """(статья для Дт, статья для Кт) по первому подходящему правилу CfItemAuto."""
+        temp = _text(temp)
+        if temp is None or contract_id is None:
+            return None, None
+        for rx, dt_item, cr_item in self.cfitem_rules.get(contract_id, ()):
+            if rx is not None and rx.search(temp):
+                return dt_item, cr_item
+        return None, None
+
+    def digit_hits(self, temp, cp_id) -> list[str]:
+        """
+        Правила, которые различают числа и совпали с текстом.
+        Проверяем только те, что могут повлиять на ответ: договоры-кандидаты
+        предфильтра, исключения контрагента, статьи CF возможных договоров.
+        Непроверенное правило либо не совпадает, либо не участвует в resolve.
+        """
+        candidates = self.matcher.candidates(temp).union(self.matcher.unfiltered)
+        hits = [
+            f"Д{cid}" for cid in sorted(candidates & self.digit_contracts)
+            if self.contract_rx[cid].search(temp)
+        ]
+
+        contracts = set(candidates)
+        if cp_id is not None:
+            hits += [f"И{rule_id}" for rule_id, rx in self.digit_exceptions.get(cp_id, ()) if rx.search(temp)]
+            contracts.update(contract_id for _, contract_id in self.exceptions.get(cp_id, ()) if contract_id is not None)
+
+        hits += [
+            f"С{rule_id}" for cid in sorted(contracts) for rule_id, rx in self.digit_cfitems.get(cid, ())
+            if rx.search(temp)
+        ]
+        return hits
+
+    def fingerprint(self, temp, cp_id):
+        """
+        Ключ кэша: контрагент, назначение с замаскированными числами
+        и правила, которые числа различают и совпали с текстом (digit_hits).
+        Остальные правила числа не видят (reads_digits) и на текстах с одной
+        маской отвечают одинаково, поэтому одинаковый ключ — одинаковый resolve:
+        аренда за май и за июнь с новыми датами и суммами попадает в одну запись.
+        """
+        temp = _text(temp)
+        if temp is None:
+            return None
+        hits = ",".join(self.digit_hits(temp, cp_id))
+        key = f"{cp_id or ''}\x1f{normalize_temp(temp)}\x1f{hits}"
+        return hashlib.md5(key.encode("utf-8")).hexdigest()
+
+    def resolve(self, temp, cp_id):
+        """Договор (по шаблону или исключению) и статьи CF для одного текста."""
+        contract_id = self.match_contract(temp)
+        from_exception = False
+        if contract_id is None:
+            contract_id = self.match_exception(cp_id, temp)
+            from_exception = contract_id is not None
+        dt_item, cr_item = self.match_cfitems(contract_id, temp)
+        return contract_id, from_exception, dt_item, cr_item
+
+    def null_owner_cp(self, df: pd.DataFrame, owner_inn) -> int:
+        """
+        Строки с ИНН собственника — это не контрагент, если только оба счёта
+        не наши (внутригрупповой перевод). Логика NULL — как в прежнем SQL:
+        строка сбрасывается, если хотя бы один известный счёт не наш.
+        """
+        payer_foreign = df["payer_account"].notna() & ~df["payer_account"].isin(self.accounts)
+        reciver_foreign = df["reciver_account"].notna() & ~df["reciver_account"].isin(self.accounts)
+        mask = (df["tax_id"] == owner_inn) & (payer_foreign | reciver_foreign)
+
+        df.loc[mask, "cp_id"] = None
+        df.loc[mask, "intercompany"] = False
+        return int(mask.sum())
+
+    def classify(self, df: pd.DataFrame, owner_inn=None, use_cache=False) -> dict:
+        """
+        Заполняет в df contract_id, cp_final_id, cfitem_id
+        (и сбрасывает cp_id по ИНН собственника, если он передан).
+        Нужны колонки temp, cp_id, dt (+ tax_id, payer_account, reciver_account для owner_inn).
+        use_cache: сначала ищем готовый ответ в ClassificationCache,
+        новые ответы туда же и складываем. Ставка НДС в кэш не входит —
+        у каждой строки своя, из find_vat_rate.
+        Returns:
+            счётчики для уведомления
+        """
+        stats = {"owner": 0, "contracts": 0, "exceptions": 0, "cfitem": 0, "cache_hits": 0, "cache_rows": 0}
+
+        if owner_inn is not None:
+            stats["owner"] = self.null_owner_cp(df, owner_inn)
+
+        rows = [
+            (_text(temp), None if pd.isna(cp_id) else int(cp_id), dt)
+            for temp, cp_id, dt in zip(df["temp"], df["cp_id"], df["dt"])
+        ]
+
+        keys, cached, fresh = [None] * len(rows), {}, {}
+        if use_cache:
+            keys = [self.fingerprint(temp, cp_id) for temp, cp_id, _ in rows]
+            cached = {
+                entry[0]: entry[1:]
+                for entry in ClassificationCache.objects
+                .filter(fingerprint__in={k for k in keys if k})
+                .values_list("fingerprint", "contract_id", "by_exception", "cfitem_dt_id", "cfitem_cr_id")
+            }
+
+        contracts, cp_final, cfitems = [], [], []
+        for (temp, cp_id, dt), key in zip(rows, keys):
+            if key in cached:
+                stats["cache_hits"] += 1
+                contract_id, from_exception, dt_item, cr_item = cached[key]
+            else:
+                contract_id, from_exception, dt_item, cr_item = self.resolve(temp, cp_id)
+                if key is not None and key not in fresh:
+                    fresh[key] = ClassificationCache(
+                        fingerprint=key, cp_id=cp_id, temp=temp,
+                        contract_id=contract_id, by_exception=from_exception, cfitem_dt_id=dt_item, cfitem_cr_id=cr_item,
+                    )
+            if key is not None:
+                stats["cache_rows"] += 1
+
+            if contract_id is not None:
+                stats["exceptions" if from_exception else "contracts"] += 1
+
+            cfitem_id = cr_item if dt == 0 else dt_item
+            if cfitem_id is not None:
+                stats["cfitem"] += 1
+
+            contracts.append(contract_id)
+            cp_final.append(self.contract_cp.get(contract_id))
+            cfitems.append(cfitem_id)
+
+        df["contract_id"] = pd.Series(contracts, index=df.index, dtype=object)
+        df["cp_final_id"] = pd.Series(cp_final, index=df.index, dtype=object)
+        df["cfitem_id"] = pd.Series(cfitems, index=df.index, dtype=object)
+
+        if fresh:
+            ClassificationCache.objects.bulk_create(fresh.values(), ignore_conflicts=True)
+
+        return stats
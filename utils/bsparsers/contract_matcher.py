@@ -0,0 +1,196 @@
+# Предфильтр для подбора договоров по RegEx.
+#
+# Вместо проверки каждой строки выписки каждым шаблоном (строки × шаблоны)
+# вытаскиваем из шаблона обязательные куски текста — номер, дату, название,
+# без которых совпадение невозможно. Все куски складываем в один автомат,
+# одним проходом по назначению платежа находим, какие из них встретились,
+# и полный RegEx проверяем только на парах (строка, договор)-кандидатах.
+#
+# Модуль без Django: на вход пары (contract_id, regex) и (cf_id, temp).
+
+import re
+from collections import defaultdict
+from re import _constants as sre_c
+from re import _parser as sre_parse
+
+# Куски короче не фильтруют — шаблон проверяем на всех строках
+MIN_LITERAL = 3
+# Слишком много альтернатив ((a|b|c|...)) — тоже не фильтруем
+MAX_ALTERNATIVES = 32
+
+# Конструкции Postgres ARE, которые Python разбирает по-другому:
+# ***= / ***: в начале, [[:digit:]], [[.x.]], [[=x=]]
+PG_ONLY = re.compile(r"^\*\*\*|\[[:.=]")
+
+REPEATS = (sre_c.MAX_REPEAT, sre_c.MIN_REPEAT, sre_c.POSSESSIVE_REPEAT)
+
+
+def _score(alts):
+    shortest = min(len(s) for s in alts)
+    usable = shortest >= MIN_LITERAL and len(alts) <= MAX_ALTERNATIVES
+    return usable, shortest, -len(alts)
+
+
+def _required(items):
+    """
+    Для последовательности узлов разбора возвращает набор строк,
+    хотя бы одна из которых входит в любое совпадение. None — такого набора нет.
+    """
+    best = None
+    run = []
+
+    def consider(alts):
+        nonlocal best
+        if alts and (best is None or _score(alts) > _score(best)):
+            best = alts
+
+    def flush():
+        if run:
+            consider(frozenset(["".join(run)]))
+            run.clear()
+
+    for op, av in items:
+        if op is sre_c.LITERAL:
+            run.append(chr(av).lower())
+            continue
+
+        # Всё остальное (классы, якоря, \b и т.п.) разрывает кусок текста
+        flush()
+
+        if op is sre_c.SUBPATTERN:
+            consider(_required(av[-1]))
+        elif op is sre_c.ATOMIC_GROUP:
+            consider(_required(av))
+        elif op is sre_c.BRANCH:
+            alts = [_required(branch) for branch in av[1]]
+            if all(alts):
+                consider(frozenset().union(*alts))
+        elif op in REPEATS and av[0] >= 1:
+            consider(_required(av[2]))
+
+    flush()
+    return best
+
+
+def required_literals(pattern: str) -> frozenset | None:
+    """
+    Обязательные куски шаблона в нижнем регистре (сравнение как у ~*).
+    None — шаблон не фильтруется и проверяется на всех строках:
+    не разбирается Python-ом, использует синтаксис только Postgres
+    или не содержит достаточно длинных кусков.
+    """
+    if not pattern or PG_ONLY.search(pattern):
+        return None
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except (re.error, RecursionError, OverflowError):
+        return None
+
+    alts = _required(parsed)
+    if alts is None or not _score(alts)[0]:
+        return None
+    return alts
+
+
+def _trie_regex(node: dict) -> str:
+    branches = [re.escape(ch) + _trie_regex(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # "" — здесь заканчивается один из кусков, дальше можно не идти
+    return f"(?:{body})?" if "" in node else body
+
+
+class LiteralAutomaton:
+    """
+    Поиск всех кусков за один проход по тексту.
+    Куски складываются в префиксное дерево, дерево компилируется в одно
+    регулярное выражение (работает в C-движке re). Проверка с lookahead
+    на каждой позиции даёт самый длинный кусок, начинающийся здесь;
+    более короткие — это его префиксы, их знаем заранее.
+    """
+
+    def __init__(self, literals):
+        literals = set(literals)
+
+        trie = {}
+        for literal in literals:
+            node = trie
+            for ch in literal:
+                node = node.setdefault(ch, {})
+            node[""] = {}
+
+        self._rx = re.compile(f"(?=({_trie_regex(trie)}))", re.S)
+        self._prefixes = {
+            literal: [literal[:i] for i in range(1, len(literal) + 1) if literal[:i] in literals]
+            for literal in literals
+        }
+
+    def find(self, text: str) -> set:
+        found = set()
+        for longest in set(self._rx.findall(text)):
+            found.update(self._prefixes[longest])
+        return found
+
+
+class ContractMatcher:
+    """
+    patterns: [(contract_id, regex), ...] — как в contracts_contracts.
+    Правило выбора победителя не меняется (самый длинный шаблон,
+    затем меньший contract_id) и остаётся за тем, кто проверяет кандидатов полным RegEx.
+    """
+
+    def __init__(self, patterns):
+        by_literal = defaultdict(set)
+        self.unfiltered = []
+        self.size = 0
+
+        for contract_id, pattern in patterns:
+            if not pattern:
+                continue
+            self.size += 1
+
+            literals = required_literals(pattern)
+            if literals is None:
+                self.unfiltered.append(contract_id)
+                continue
+            for literal in literals:
+                by_literal[literal].add(contract_id)
+
+        self._by_literal = dict(by_literal)
+        self._automaton = LiteralAutomaton(by_literal) if by_literal else None
+
+    def literals(self, text: str) -> set:
+        """Куски шаблонов, которые встречаются в тексте."""
+        if not text or self._automaton is None:
+            return set()
+        return self._automaton.find(text.lower())
+
+    def candidates(self, text: str) -> set:
+        """Договоры, шаблоны которых могут совпасть с текстом (без unfiltered)."""
+        found = set()
+        for literal in self.literals(text):
+            found |= self._by_literal[literal]
+        return found
+
+    def candidate_pairs(self, rows) -> tuple[list, list]:
+        """
+        rows: [(cf_id, temp), ...]
+        Returns:
+            (cf_ids, contract_ids) — параллельные списки пар-кандидатов
+        """
+        by_text = defaultdict(list)
+        for cf_id, temp in rows:
+            if temp:
+                by_text[temp].append(cf_id)
+
+        cf_ids, contract_ids = [], []
+        for temp, ids in by_text.items():
+            for contract_id in self.candidates(temp):
+                for cf_id in ids:
+                    cf_ids.append(cf_id)
+                    contract_ids.append(contract_id)
+
+        return cf_ids, contract_ids
@@ -0,0 +1,72 @@
+# Реестр форматов банковских выписок.
+#
+# Каждый формат регистрирует дешёвую проверку по первым байтам файла (sniff)
+# и свои парсеры. Формат определяется по содержимому, а не по расширению:
+# читаем SNIFF_BYTES с начала файла один раз и спрашиваем форматы по очереди.
+# Новый банк — новый модуль с register(...) и строка в FORMAT_MODULES,
+# bsupdater и модели трогать не нужно.
+
+from dataclasses import dataclass
+from importlib import import_module
+from typing import Callable
+
+# Сколько байт читаем с начала файла для определения формата
+SNIFF_BYTES = 4096
+
+# Модули, которые регистрируют форматы при импорте
+FORMAT_MODULES = [
+    "utils.bsparsers.bsparser",
+    "utils.bsparsers.xls_parser",
+]
+
+
+class UnknownStatementFormat(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class StatementFormat:
+    """
+    name: код формата
+    title: название для уведомлений
+    sniff(head: bytes) -> bool: узнаёт формат по первым SNIFF_BYTES файла
+    parse(filepath, ts_inn=None) -> (df[FIELDS_TO_KEEP], счет, начало, конец, нач. остаток, кон. остаток)
+    header(filepath) -> (счет, начало, конец, нач. остаток, кон. остаток) — при загрузке
+        файла в BankStatements.save, поэтому без разбора операций
+    tax_id_by_name: в выписке нет ИНН — берём его из Counterparty по имени контрагента
+    """
+    name: str
+    title: str
+    sniff: Callable[[bytes], bool]
+    parse: Callable
+    header: Callable
+    tax_id_by_name: bool = False
+
+
+_registry: dict[str, StatementFormat] = {}
+
+
+def register(fmt: StatementFormat) -> StatementFormat:
+    """Форматы проверяются в порядке регистрации, повторная регистрация заменяет формат."""
+    _registry[fmt.name] = fmt
+    return fmt
+
+
+def formats() -> list[StatementFormat]:
+    for module in FORMAT_MODULES:
+        import_module(module)
+    return list(_registry.values())
+
+
+def read_head(filepath: str) -> bytes:
+    with open(filepath, "rb") as f:
+        return f.read(SNIFF_BYTES)
+
+
+def detect(filepath: str) -> StatementFormat:
+    """Формат выписки по первым SNIFF_BYTES файла."""
+    head = read_head(filepath)
+    for fmt in formats():
+        if fmt.sniff(head):
+            return fmt
+    raise UnknownStatementFormat(f"Неизвестный формат выписки: {filepath}")
@@ -0,0 +1,175 @@
+# Шаблоны правил разноски пишутся в синтаксисе Postgres ARE (как для ~*),
+# а проверяются в Python (Classifier). Здесь — перевод ARE -> re
+# для конструкций, которые в наших шаблонах встречаются, и проверка
+# шаблона при сохранении правила.
+# reads_digits — может ли шаблон отличить одни цифры в тексте от других
+# (от этого зависит, годится ли для правила ключ кэша разноски с замаскированными числами).
+
+import logging
+import re
+from re import _constants as sre_c
+from re import _parser as sre_parse
+
+from django.core.exceptions import ValidationError
+
+logger = logging.getLogger(__name__)
+
+# \m, \M, \y ... — в Python их нет или они значат другое
+PG_ESCAPES = {
+    "m": r"\b(?=\w)",    # начало слова
+    "M": r"\b(?<=\w)",   # конец слова
+    "y": r"\b",          # граница слова
+    "Y": r"\B",
+    "b": r"\x08",        # в ARE \b — это backspace, а не граница слова
+}
+
+# [[:<:]] и [[:>:]] — начало и конец слова, как \m и \M
+PG_WORD_BOUNDS = {
+    "<": PG_ESCAPES["m"],
+    ">": PG_ESCAPES["M"],
+}
+
+# [:digit:] внутри скобок -> диапазон (кириллица входит в буквы, как в ~* с ru_RU)
+PG_CLASSES = {
+    "digit": r"0-9",
+    "alpha": r"a-zA-Zа-яА-ЯёЁ",
+    "alnum": r"0-9a-zA-Zа-яА-ЯёЁ",
+    "upper": r"A-ZА-ЯЁ",
+    "lower": r"a-zа-яё",
+    "space": r"\s",
+    "xdigit": r"0-9a-fA-F",
+    "punct": r"!-/:-@\[-`{-~",
+    "word": r"\w",
+}
+
+# Цифры — только ASCII: ими пишутся даты, суммы и номера в выписках
+DIGITS = frozenset("0123456789")
+
+# Категории классов, в которые входят все цифры (\d, \w, \S); в остальные — ни одной
+DIGIT_CATEGORIES = {
+    sre_c.CATEGORY_DIGIT, sre_c.CATEGORY_WORD, sre_c.CATEGORY_NOT_SPACE, sre_c.CATEGORY_NOT_LINEBREAK,
+    sre_c.CATEGORY_UNI_DIGIT, sre_c.CATEGORY_UNI_WORD, sre_c.CATEGORY_UNI_NOT_SPACE,
+    sre_c.CATEGORY_UNI_NOT_LINEBREAK, sre_c.CATEGORY_LOC_WORD,
+}
+
+PG_TOKEN = re.compile(r"\[\[:([<>]):\]\]|\\(.)|\[:(\w+):\]", re.S)
+
+
+def pg_regex(pattern: str) -> str:
+    """Переводит шаблон Postgres ARE (~*) в синтаксис Python re."""
+    if pattern.startswith("***="):
+        return re.escape(pattern[4:])
+    if pattern.startswith("***:"):
+        pattern = pattern[4:]
+
+    def repl(m):
+        bound, escape, cls = m.groups()
+        if bound is not None:
+            return PG_WORD_BOUNDS[bound]
+        if escape is not None:
+            return PG_ESCAPES.get(escape, m.group(0))
+        return PG_CLASSES.get(cls, m.group(0))
+
+    return PG_TOKEN.sub(repl, pattern)
+
+
+def compile_rule(pattern, errors: list | None = None):
+    """
+    RegEx правила как в ~*: без учёта регистра, точка ловит перевод строки.
+    None — правило не срабатывает никогда (пустое поле или шаблон не компилируется).
+    Ошибку пишем в лог и, если передан errors, добавляем туда (шаблон, текст ошибки).
+    """
+    if pattern is None:
+        return None
+    try:
+        return re.compile(pg_regex(pattern), re.IGNORECASE | re.DOTALL)
+    except re.error as e:
+        logger.warning("Не компилируется RegEx %r: %s", pattern, e)
+        if errors is not None:
+            errors.append((pattern, str(e)))
+        return None
+
+
+def _class_digits(op, av) -> frozenset | None:
+    """Какие цифры ловит один символ шаблона. None — это не символ (группа, повтор, якорь)."""
+    if op is sre_c.LITERAL:
+        return DIGITS & {chr(av)}
+    if op is sre_c.NOT_LITERAL:
+        return DIGITS - {chr(av)}
+    if op is sre_c.ANY:
+        return DIGITS
+    if op is not sre_c.IN:
+        return None
+
+    found, negate = set(), False
+    for item, value in av:
+        if item is sre_c.NEGATE:
+            negate = True
+        elif item is sre_c.LITERAL:
+            found |= DIGITS & {chr(value)}
+        elif item is sre_c.RANGE:
+            found |= {d for d in DIGITS if value[0] <= ord(d) <= value[1]}
+        elif item is sre_c.CATEGORY and value in DIGIT_CATEGORIES:
+            found |= DIGITS
+    return DIGITS - found if negate else frozenset(found)
+
+
+def _reads_digits(items) -> bool:
+    for op, av in items:
+        digits = _class_digits(op, av)
+        if digits is not None:
+            if digits:
+                return True
+        elif op is sre_c.SUBPATTERN:
+            if _reads_digits(av[-1]):
+                return True
+        elif op is sre_c.BRANCH:
+            if any(_reads_digits(branch) for branch in av[1]):
+                return True
+        elif op in (sre_c.MAX_REPEAT, sre_c.MIN_REPEAT, sre_c.POSSESSIVE_REPEAT):
+            if _reads_digits(av[2]):
+                return True
+        elif op in (sre_c.ASSERT, sre_c.ASSERT_NOT):
+            # проверка одного соседнего символа (\m, \M): класс со всеми цифрами
+            # или без цифр отвечает одинаково для любой цифры
+            body = list(av[1])
+            single = _class_digits(*body[0]) if len(body) == 1 else None
+            if single is not None:
+                if single not in (DIGITS, frozenset()):
+                    return True
+            elif _reads_digits(body):
+                return True
+        elif op is sre_c.ATOMIC_GROUP:
+            if _reads_digits(av):
+                return True
+        elif op is sre_c.GROUPREF_EXISTS:
+            if any(branch is not None and _reads_digits(branch) for branch in av[1:]):
+                return True
+        elif op not in (sre_c.AT, sre_c.GROUPREF):
+            return True
+    return False
+
+
+def reads_digits(pattern) -> bool:
+    """
+    Может ли шаблон поглотить цифру: цифра в самом шаблоне, класс цифр или букв, точка, [^...] и т.п.
+    Шаблон, который не может, чисел не различает: два текста, которые отличаются
+    только цифрами (на месте одного числа — другое, любой длины), он разносит одинаково.
+    Неразборчивый шаблон считаем читающим цифры.
+    """
+    if not pattern:
+        return False
+    try:
+        return _reads_digits(sre_parse.parse(pg_regex(pattern), re.IGNORECASE | re.DOTALL))
+    except (re.error, RecursionError, OverflowError):
+        return True
+
+
+def validate_rule_regex(value):
+    """Валидатор поля RegEx правил: шаблон, который не компилируется, не сработает ни на одной строке."""
+    if not value:
+        return
+    try:
+        re.compile(pg_regex(value), re.IGNORECASE | re.DOTALL)
+    except re.error as e:
+        raise ValidationError(f"RegEx не компилируется: {e}", code="invalid_regex")
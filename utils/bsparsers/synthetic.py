@@ -0,0 +1,222 @@
+# Синтетические выписки для бенчмарков: 1С (txt) и Excel-выгрузка из 1С (xlsx).
+#
+# Похожи на настоящие: ограниченный круг контрагентов с ИНН и счетами,
+# у каждого несколько договоров, назначения платежа повторяются от месяца
+# к месяцу (аренда, связь, поставки), встречаются комиссии банка и налоги.
+# Файл пишется потоково — 500 тыс. документов не держим в памяти.
+# Модуль без Django.
+
+import datetime as dt
+import random
+from dataclasses import dataclass
+
+from openpyxl import Workbook
+
+OWN_INN = "9719052621"
+OWN_NAME = "ТРЕНДСЕТТЕР OOO"
+OWN_ACCOUNT = "40702810300000000394"
+BANK_BIK = "044525411"
+BANK_CORR = "30101810145250000411"
+
+SUBJECTS = [
+    "аренда нежилого помещения", "услуги связи", "поставка товара", "охрана объекта",
+    "уборка помещений", "консультационные услуги", "транспортные услуги", "рекламные услуги",
+    "обслуживание ПО", "коммунальные услуги",
+]
+MONTHS = [
+    "январь", "февраль", "март", "апрель", "май", "июнь",
+    "июль", "август", "сентябрь", "октябрь", "ноябрь", "декабрь",
+]
+NAMES = [
+    "Ромашка", "Вектор", "Сфера", "Альфа", "Гранит", "Меридиан", "Север", "Каскад",
+    "Орион", "Магистраль", "Полюс", "Стандарт", "Фаворит", "Эталон", "Горизонт",
+]
+
+
+@dataclass
+class Counterparty:
+    name: str
+    inn: str
+    account: str
+    contracts: list
+
+
+@dataclass
+class Document:
+    number: int
+    date: dt.date
+    amount: float
+    outgoing: bool
+    cp: Counterparty
+    temp: str
+    article: str
+
+
+def _inn(rnd) -> str:
+    return str(rnd.randint(7700000000, 7799999999))
+
+
+def _account(rnd) -> str:
+    return "40702810" + "".join(str(rnd.randint(0, 9)) for _ in range(12))
+
+
+def counterparties(n: int, seed: int = 1) -> list[Counterparty]:
+    """Справочник контрагентов: ИНН, счёт, 1–4 договора с номерами в духе 12/24-АР."""
+    rnd = random.Random(seed)
+    result = []
+    for i in range(n):
+        name = f'ООО "{rnd.choice(NAMES)}-{i + 1}"'
+        contracts = [
+            (f"{rnd.randint(1, 300)}/{rnd.randint(20, 25)}-{rnd.choice('АБВГДКМП')}{rnd.choice('АБВГДКМП')}",
+             dt.date(2020 + rnd.randint(0, 5), rnd.randint(1, 12), rnd.randint(1, 28)),
+             rnd.choice(SUBJECTS))
+            for _ in range(rnd.randint(1, 4))
+        ]
+        result.append(Counterparty(name, _inn(rnd), _account(rnd), contracts))
+    return result
+
+
+def documents(n: int, cps: list[Counterparty], start: dt.date, seed: int = 1):
+    """
+    Генератор документов. Доли: ~60% оплат по договорам (повторяются помесячно),
+    ~20% по счетам, ~10% комиссии банка, ~5% налоги, ~5% внутригрупповые.
+    """
+    rnd = random.Random(seed)
+    days = max(n // 200, 1)
+
+    for i in range(n):
+        date = start + dt.timedelta(days=i * days // n)
+        month = MONTHS[date.month - 1]
+        cp = rnd.choice(cps)
+        kind = rnd.random()
+        outgoing = rnd.random() < 0.45
+        amount = round(rnd.choice([1_000, 5_000, 12_500, 48_000, 150_000]) * rnd.uniform(0.5, 2), 2)
+        article = "Оплата поставщику" if outgoing else "Поступление от покупателя"
+
+        if kind < 0.6:
+            number, signed, subject = rnd.choice(cp.contracts)
+            vat = round(amount * 20 / 120, 2)
+            temp = (
+                f"Оплата по договору № {number} от {signed:%d.%m.%Y} за {subject} за {month} {date.year} г. "
+                f"Сумма {amount:.2f}, в т.ч. НДС 20% - {vat:.2f} рублей"
+            )
+        elif kind < 0.8:
+            subject = rnd.choice(SUBJECTS)
+            temp = f"Оплата по счету № {rnd.randint(1, 9999)} от {date:%d.%m.%Y} за {subject}. Без налога (НДС)"
+        elif kind < 0.9:
+            outgoing, amount, article = True, round(rnd.uniform(50, 3_000), 2), "Расходы на услуги банков"
+            cp = Counterparty("ПАО Совкомбанк", "4401116480", "30101810445250000360", [])
+            temp = f"Комиссия за ведение счета за {month} {date.year} г. Без НДС"
+        elif kind < 0.95:
+            outgoing, article = True, "Прочие налоги и сборы"
+            cp = Counterparty("УФК по г. Москве (ИФНС России № 51)", "7727406020", "03100643000000017300", [])
+            temp = f"Единый налоговый платеж за {month} {date.year} г."
+        else:
+            article = "Внутреннее перемещение"
+            cp = Counterparty(OWN_NAME, OWN_INN, "40702810000010018499", [])
+            temp = "Перевод собственных средств на расчетный счет. Без НДС"
+
+        yield Document(i + 1, date, amount, outgoing, cp, temp, article)
+
+
+def _period(n: int, start: dt.date) -> dt.date:
+    return start + dt.timedelta(days=max(n // 200, 1))
+
+
+def write_1c(path: str, n: int, *, account: str = OWN_ACCOUNT, start: dt.date = dt.date(2024, 1, 1),
+             bb: float = 1_000_000.0, cps: int = 300, seed: int = 1) -> str:
+    """1CClientBankExchange в windows-1251 с переводами строк CRLF, как выгружает клиент-банк."""
+    cp_list = counterparties(cps, seed)
+    finish = _period(n, start)
+
+    with open(path, "w", encoding="windows-1251", errors="replace", newline="\r\n") as f:
+        f.write(
+            "1CClientBankExchange\nВерсияФормата=1.03\nКодировка=Windows\nОтправитель=Бухгалтерский учет\n"
+            f"Получатель=\nДатаСоздания={dt.date.today():%d.%m.%Y}\nВремяСоздания=10:00:00\n"
+            f"ДатаНачала={start:%d.%m.%Y}\nДатаКонца={finish:%d.%m.%Y}\nРасчСчет={account}\n"
+            f"СекцияРасчСчет\nДатаНачала={start:%d.%m.%Y}\nДатаКонца={finish:%d.%m.%Y}\n"
+            f"РасчСчет={account}\nНачальныйОстаток={bb:.2f}\n"
+        )
+        total_dt = total_cr = 0.0
+        docs = documents(n, cp_list, start, seed)
+
+        # обороты и конечный остаток известны только после документов — пишем их в конце
+        body = []
+        for doc in docs:
+            payer, payer_inn, payer_acc = (OWN_NAME, OWN_INN, account) if doc.outgoing else (doc.cp.name, doc.cp.inn, doc.cp.account)
+            reciver, reciver_inn, reciver_acc = (doc.cp.name, doc.cp.inn, doc.cp.account) if doc.outgoing else (OWN_NAME, OWN_INN, account)
+            if doc.outgoing:
+                total_cr += doc.amount
+            else:
+                total_dt += doc.amount
+            body.append(
+                "СекцияДокумент=Платежное поручение\n"
+                f"Номер={doc.number}\nДата={doc.date:%d.%m.%Y}\nСумма={doc.amount:.2f}\n"
+                f"ПлательщикСчет={payer_acc}\nДатаСписано={f'{doc.date:%d.%m.%Y}' if doc.outgoing else ''}\n"
+                f"Плательщик={payer}\nПлательщикИНН={payer_inn}\nПлательщик1={payer}\n"
+                f"ПлательщикРасчСчет={payer_acc}\nПлательщикБанк1=ПАО БАНК\nПлательщикБИК={BANK_BIK}\n"
+                f"ПлательщикКорсчет={BANK_CORR}\nПолучательСчет={reciver_acc}\n"
+                f"ДатаПоступило={'' if doc.outgoing else f'{doc.date:%d.%m.%Y}'}\n"
+                f"Получатель={reciver}\nПолучательИНН={reciver_inn}\nПолучатель1={reciver}\n"
+                f"ПолучательРасчСчет={reciver_acc}\nПолучательБанк1=ПАО БАНК\nПолучательБИК={BANK_BIK}\n"
+                f"ПолучательКорсчет={BANK_CORR}\nВидОплаты=01\nОчередность=5\n"
+                f"НазначениеПлатежа={doc.temp}\nКонецДокумента\n"
+            )
+            if len(body) >= 10_000:
+                f.write("".join(body))
+                body.clear()
+        f.write("".join(body))
+
+        f.write(
+            f"ВсегоПоступило={total_dt:.2f}\nВсегоСписано={total_cr:.2f}\n"
+            f"КонечныйОстаток={bb + total_dt - total_cr:.2f}\nКонецРасчСчет\nКонецФайла\n"
+        )
+    return path
+
+
+def write_xlsx(path: str, n: int, *, account: str = OWN_ACCOUNT, start: dt.date = dt.date(2024, 1, 1),
+               bb: float = 1_000_000.0, cps: int = 300, seed: int = 1) -> str:
+    """
+    Excel-выгрузка из 1С в разметке xls_parser: отбор по счёту в A6,
+    входящий остаток в L10, операции с 11-й строки, последняя — итоги.
+    """
+    cp_list = counterparties(cps, seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Выписка")
+
+    empty = [None] * 12
+    for row in range(1, 11):
+        if row == 6:
+            ws.append([f'Отбор: Банковские счета Равно "{account}, Филиал "Корпоративный" ПАО "Совкомбанк""'])
+        elif row == 10:
+            ws.append(["Остаток на начало", *[None] * 10, bb])
+        else:
+            ws.append(empty)
+
+    total_dt = total_cr = 0.0
+    for doc in documents(n, cp_list, start, seed):
+        kind = "Списание с расчетного счета" if doc.outgoing else "Поступление на расчетный счет"
+        cp_cell = f"{doc.cp.name}\n{doc.article}\n{doc.temp[:40]}"
+        own_cell = f"{account}\n{'Оплата поставщику' if doc.outgoing else 'Поступление от покупателя'}"
+        anal_dt, anal_cr = (cp_cell, own_cell) if doc.outgoing else (own_cell, cp_cell)
+        if doc.article == "Расходы на услуги банков":
+            anal_dt, anal_cr = own_cell, f"ПАО Совкомбанк\n{doc.article}\nКомиссия"
+
+        dt_amount, cr_amount = (None, doc.amount) if doc.outgoing else (doc.amount, None)
+        total_dt += dt_amount or 0
+        total_cr += cr_amount or 0
+        ws.append([
+            f"{doc.date:%d.%m.%Y}", f"{kind} {doc.number} от {doc.date:%d.%m.%Y}\n{doc.temp}",
+            anal_dt, anal_cr, None, dt_amount, None, None, cr_amount, None, None, None,
+        ])
+
+    ws.append(["Итого", None, None, None, None, total_dt, None, None, total_cr, None, None, bb + total_dt - total_cr])
+    wb.save(path)
+    return path
+
+
+WRITERS = {"txt": write_1c, "xlsx": write_xlsx}
+
+
+def write_statement(path: str, n: int, fmt: str = "txt", **kwargs) -> str:
+    return WRITERS[fmt](path, n, **kwargs)
@@ -1,12 +1,19 @@
 # Парсим xls
-import numpy as np
+#
+# Выгрузка из 1С (Совкомбанк, БЖФ) в xlsx. Файл читаем один раз потоково
+# (openpyxl read_only): из шапки берём счёт и входящий остаток, дальше строки
+# операций. Аналитика Дт/Кт (контрагент, статья, обоснование — через перевод
+# строки) режется один раз на строку, и правила подбора контрагента (RULES)
+# проходятся по строке за один проход.
+import re
+from operator import attrgetter
+from typing import NamedTuple
+
 import pandas as pd
+from openpyxl import load_workbook
+
+from .formats import StatementFormat, register
 
-from .intercompany_rules import (
-    INTERCOMPANY_EXCLUDE,
-    INTERCOMPANY_INCLUDE,
-    apply_intercompany_overrides,
-)
 
 
 
@@ -31,281 +38,273 @@ FIELDS_TO_KEEP = [
     
 ]
 
+# Разметка листа (номера строк и колонок с 1, как в Excel)
+ACC_ROW, ACC_COL = 6, 1     # 'Отбор: Банковские счета Равно "<счёт>, <банк>"'
+BB_ROW, BB_COL = 10, 12     # строка входящего остатка
+FIRST_ROW = BB_ROW + 1      # дальше операции, последняя строка — итоги
 
-def get_acc(filename):
-    df = pd.read_excel(filename, nrows=10,header=None)
-    acc:str = df.iloc[5, 0]
-    parts = acc.split(',')
-    rpl = ','+str(parts[1])
-    print(rpl)
-    acc = acc.replace('Отбор: Банковские счета Равно "',"").replace(', АО "Банк БЖФ""','').replace(', Филиал "Корпоративный" ПАО "Совкомбанк""','').replace(rpl,'').strip()  #replace(', МОРСКОЙ БАНК (АО)"',"").strip() 
-    # Отбор: Банковские счета Равно "40702810410000104161, АО "Банк БЖФ""
-    return acc
-
-def get_bb(filename):
-    df = pd.read_excel(filename, nrows=11,header=None)
-    return df.iloc[9, 11]
-
-def make_df(filename)->pd.DataFrame:
-    df = pd.read_excel(
-    filename,
-    skiprows=9,   # пропустить первые 10 строк
-    skipfooter=1,  # пропустить последнюю строку
-    names=["date", "_temp", "_anal_dt", "_anal_cr","_dt_acc","dt","_cr_acc","_cr",'cr','col10','col11','col12']
-    )
-    
-    return df[['date','_temp','_anal_dt','_anal_cr','dt','cr']]
+# Колонки строки операции: дата, документ + назначение, аналитика Дт / Кт, Дт, Кт
+DATE_COL, TEMP_COL, ANAL_DT_COL, ANAL_CR_COL, DT_COL, CR_COL = 0, 1, 2, 3, 5, 8
+ROW_WIDTH = 12
 
-def adjust_df(filename)->pd.DataFrame:
-    
-    
-    acc_number = get_acc(filename)
-    bb = get_bb(filename)
-    
-    
-    df:pd.DataFrame = make_df(filename)
-    
-    df[["_doc", "temp"]] = (
-        df["_temp"]
-        .str.split("\n", n=1, expand=True)
-        .apply(lambda x: x.str.strip())
-    )
-    
-    
-    df['_len_dt'] = df["_anal_dt"].str.split("\n").str.len().fillna(0).astype(int)
-    df['_len_cr'] = df["_anal_cr"].str.split("\n").str.len().fillna(0).astype(int)
-    
-    
-    parts_cr = (
-    df["_anal_cr"]
-    .fillna("")
-    .astype("string")                 # <-- важно
-    .str.split("\n", n=2, expand=True)
-    .reindex(columns=[0, 1, 2])
-)
-
-    parts_cr = parts_cr.astype("string").apply(lambda c: c.str.strip())
-    parts_cr = parts_cr.replace({"": None, pd.NA: None})
-
-    df[["_cp_name_cr", "_contract_number_cr", "_justification_cr"]] = parts_cr
-    # df[['_cp_name_cr','_contract_number_cr','_justification_cr']] = (df['_anal_cr']
-    #    .str.split("\n", n=2, expand=True)
-    #    .apply(lambda x: x.str.strip())
-    # )
-    
-    # df[['_cp_name_dt','_contract_number_dt','_justification_dt']] = (df['_anal_dt']
-    #    .str.split("\n", n=2, expand=True)
-    #    .apply(lambda x: x.str.strip())
-    # )
-    
-    parts_dt = (
-    df["_anal_dt"]
-    .fillna("")
-    .astype("string")                 # <-- важно
-    .str.split("\n", n=2, expand=True)
-    .reindex(columns=[0, 1, 2])
-)
-
-    parts_dt = parts_dt.astype("string").apply(lambda c: c.str.strip())
-    parts_dt = parts_dt.replace({"": None, pd.NA: None})
-
-    df[["_cp_name_dt", "_contract_number_dt", "_justification_dt"]] = parts_dt
-    
-    
-    #Парсим контрагента где 3 и 3 
-    
-    df["cp_name"] = np.where(
-    df["_len_cr"].to_numpy() == 3,
-    df["_cp_name_cr"].to_numpy(),
-    np.where(
-        df["_len_dt"].to_numpy() == 3,
-        df["_cp_name_dt"].to_numpy(),
-        np.nan
-        )
-    )
-    
-    #Парсим внутреннии перемещения
-    df["tax_id"] = None
-    df["tax_id"] = np.where(
-    df["_contract_number_dt"].str.startswith("Внутреннее", na=False)
-    | df["_contract_number_cr"].str.startswith("Внутреннее", na=False),
-    "9719052621",
-    df["tax_id"]
-    )
-    
-    df["cp_name"] = np.where(
-    df["_contract_number_dt"].str.startswith("Внутреннее", na=False)
-    | df["_contract_number_cr"].str.startswith("Внутреннее", na=False),
-    "Трендсеттер ООО",
-    df["cp_name"]
-    )
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    df["tax_id"] = np.where(
-    df["_contract_number_dt"].str.startswith("Конвертация валюты", na=False),
-    
-    "9719052621",
-    df["tax_id"]
-    )
-    
-    df["cp_name"] = np.where(
-    df["_contract_number_dt"].str.startswith("Конвертация валюты", na=False),
-   
-    "Трендсеттер ООО",
-    df["cp_name"]
-    )
-    
-    
-    df["cp_name"] = np.where(
-        df["_contract_number_cr"].isin(['Расходы на услуги банков']),
-        df['_cp_name_cr'], df["cp_name"]
-    )
-    
-    
-    
-    
-    df["cp_name"] = np.where(
-    df["_contract_number_cr"].isin(["Прочие налоги и сборы"])
-    & df["_cp_name_dt"].isna(),
-    "ИФНС",
-    df["cp_name"]
-    )
-    
-    df["cp_name"] = np.where(
-    df["_contract_number_cr"].isin(["Прочие налоги и сборы"])
-    & df["_cp_name_dt"].isin(['Налог (взносы): начислено / уплачено']),
-    "ФСС",
-    df["cp_name"]
-    )
-    
-    df["tax_id"] = np.where(
-    df["_contract_number_cr"].isin(["Прочие налоги и сборы"])
-    & df["_cp_name_dt"].isna(),
-    "7727406020",
-    df["tax_id"]
-    )
-    
-    df["tax_id"] = np.where(
-    df["_contract_number_cr"].isin(["Прочие налоги и сборы"])
-    & df["_cp_name_dt"].isin(['Налог (взносы): начислено / уплачено']),
-    "7703363868",
-    df["tax_id"]
-    )
-    
-    df["employee_name"] = (
-    df["temp"]
-    .str.extract(r"на счет\s+([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){2})",
-                 expand=False)
-    )
-    
-    
-    rpc = {
-        'Мурадяна Каринэ Арутюновны':"Мурадян Каринэ Арутюновна", 
-           'Бердникова Сергея Алексеевича':'Бердников Сергей Алексеевич', 
-           'Гавшина Богдана Сергеевича':'Гавшин Богдан Сергеевич', 
-           'Юдиной Елены Геннадиевны':'Юдина Елена Геннадиевна', 
-           'Амунца Александра Дмитриевича':'Амунц Александр Дмитриевич', 
-           'Малая Максима Александровича':'Малай Максим Александрович', 
-           'Сидоровой Ксении Дмитриевны':'Сидорова Ксения Дмитриевна', 
-           'Котовской Карины Владимировны':'Котовская Карина Владимировна', 
-           'Ромашенко Виктории Владимировны':'Ромашенко Виктория Владимировна', 
-           'Переверзева Дмитрия Владимировича':'Переверзев Дмитрий Владимирович', 
-           'Кузина Максима Евгеньевича':'Кузин Максим Евгеньевич'
-           }
-    
-    df["cp_name"] = df["cp_name"].fillna(
-        df["employee_name"].map(rpc)
-        )
-    
-    
-    df["cp_name"] = np.where(
-        df['_contract_number_cr'].isin(['Выдача подотчетных сумм']),
-        df['_cp_name_dt'],
-        df["cp_name"]
-    )
-    
-    df["cp_name"] = np.where(
-        df['_contract_number_dt'].isin(['Получение кредитов и займов','Поступления от погашения займов']),
-        df['_cp_name_cr'],
-        df["cp_name"]
-    )
-    
-    df["cp_name"] = np.where(
-        df['_contract_number_cr'].isin(['Погашение кредитов и займов',"Выплата процентов по кредитам и займам"]),
-        df['_cp_name_dt'],
-        df["cp_name"]
-    )
-    
-    df["cp_name"] = np.where(
-    df["_cp_name_cr"].str.startswith("Проценты к получению, уплате", na=False),
-   
-    df['_cp_name_dt'],
-    df["cp_name"]
-    )
-    
-    
-    rpls = {     
+OWN_NAME = "Трендсеттер ООО"
+OWN_INN = "9719052621"
+
+ACC_RX = re.compile(r"\b(\d{20})\b")
+
+EMPLOYEE_RX = re.compile(r"на счет\s+([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){2})")
+
+# ФИО сотрудника в родительном падеже (из назначения) -> как в справочнике
+EMPLOYEES = {
+    'Мурадяна Каринэ Арутюновны':"Мурадян Каринэ Арутюновна",
+    'Бердникова Сергея Алексеевича':'Бердников Сергей Алексеевич',
+    'Гавшина Богдана Сергеевича':'Гавшин Богдан Сергеевич',
+    'Юдиной Елены Геннадиевны':'Юдина Елена Геннадиевна',
+    'Амунца Александра Дмитриевича':'Амунц Александр Дмитриевич',
+    'Малая Максима Александровича':'Малай Максим Александрович',
+    'Сидоровой Ксении Дмитриевны':'Сидорова Ксения Дмитриевна',
+    'Котовской Карины Владимировны':'Котовская Карина Владимировна',
+    'Ромашенко Виктории Владимировны':'Ромашенко Виктория Владимировна',
+    'Переверзева Дмитрия Владимировича':'Переверзев Дмитрий Владимирович',
+    'Кузина Максима Евгеньевича':'Кузин Максим Евгеньевич'
+}
+
+# Контрагент из выписки -> имя в справочнике Counterparty
+COUNTERPARTY_NAMES = {     
         '40702810512010618308, Филиал "Корпоративный" ПАО "Совкомбанк"':"СОВКОМБАНК ПАО","Хримян Артур Гагикович":"ХРИМЯН АРТУР ГАГИКОВИЧ",   
         "Трендсеттер ООО":"ТРЕНДСЕТТЕР OOO","ИФНС":"ИФНС","ФСС":"ФСС ПО Г. МОСКВЕ И МОСКОВСКОЙ ОБЛАСТИ",'40702810410000104161, АО "Банк БЖФ"':'БАНК БЖФ АО','ВАЙЛДБЕРРИЗ ООО':'ВАЙЛДБЕРРИЗ ООО','Мурадян Каринэ Арутюновна':'МУРАДЯН КАРИНЭ АРТЮНОВНА','Бердников Сергей Алексеевич':'БЕРДНИКОВ СЕРГЕЙ АЛЕКСЕЕВИЧ','Талипова Галия Гаяновна':'ТАЛИПОВА ГАЛИЯ ГАЯНОВНА ИП','ЗАО "Экспорт Файненс"':'ЭКСПОРТ ФИНАНС ЗАО','МОДУЛЬ-СОФТ ООО':'МОДУЛЬ-СОФТ ООО','Волга-Созь-Сервис ООО':'ВОЛГА-СВЯЗЬ-СЕРВИС ООО','ПРОИЗВОДСТВЕННАЯ ФИРМА СКБ КОНТУР НАО':'СКБ КОНТУР ПФ АО','Халипский Сергей Николаевич (ИП)':'ХАЛИПСКИЙ СЕРГЕЙ НИКОЛАЕВИЧ ИП','СПЕЦГАЗСТРОЙ ООО':'СПЕЦГАЗСТРОЙ ООО','Окишев Евгений Александрович (ИП)':'ОКИШЕВ ЕВГЕНИЙ АЛЕКСАНДРОВИЧ ИП','ЗАО "Арминвест"':'АРМИНВЕСТ ЗАО','БЕЛЫЙ МЕДВЕДЬ ООО':'БЕЛЫЙ МЕДВЕДЬ ООО','ОПЕРАТОР-ЦРПТ ООО':'ОПЕРАТОР-ЦРПТ ООО','НЬЮ РИВЕР ООО':'НЬЮ РИВЕР ООО','ЭР Софт ООО':'ЭР СОФТ ООО','Юридическая фирма Априори ООО':'ЮРИДИЧЕСКАЯ ФИРМА АПРИОРИ ООО','Межрегиональное операционное УФК (Федеральная служба по интеллектуальной собственности)':'ФЕДЕРАЛЬНАЯ СЛУЖБА ПО ИНТЕЛЛЕКТУАЛЬНОЙ СОБСТВЕННОСТИ','ГК ГАЛА-ПРОДЖЕКТ ООО':'ГК ГАЛА-ПРОДЖЕКТ ООО','МФ КАПИТАЛ ООО':'МФ КАПИТАЛ ООО','МЕГАМОЛСТРОЙ ООО':'МЕГАМОЛСТРОЙ ООО','РВБ ООО':'РВБ ООО','МИНАСЯН МАКСИМ ВАДИМОВИЧ':'МИНАСЯН МАКСИМ ВАДИМОВИЧ','Мосолов Артём Сергеевич':'МОСОЛОВ АРТЁМ СЕРГЕЕВИЧ','БРУНОЯМ ООО':'БРУНОЯМ ООО','СУ-43 ООО':'СУ-43 ООО','Гавшин Богдан Сергеевич':'ГАВШИН БОГДАН СЕРГЕЕВИЧ','Юдина Елена Геннадиевна':'ЮДИНА ЕЛЕНА ГЕННАДИЕВНАЯ','ЗАО "БРЕНДДЕВЕЛОПМЕНТ"':'БРЕНДДЕВЕЛОПМЕНТ ЗАО','СИТИЛИНК ООО':'СИТИЛИНК ООО','ООО ЛУКОЙЛ-ИНТЕР-КАРД':'ЛУКОЙЛ-ИНТЕР-КАРД ООО','УК ПРОМИНВЕСТ ГРУПП ООО':'УК ПРОМИНВЕСТ ГРУПП ООО','Кириченко Денис Владимирович':'КИРИЧЕНКО ДЕНИС ВЛАДИМИРОВИЧ','МПСТАТС ООО':'МПСТАТС ООО','ХЭДХАНТЕР ООО':'ХЭДХАНТЕР ООО','МИКРОКРЕДИТНАЯ КОМПАНИЯ ВБ ФИНАНС ООО':'МКК ВБ ФИНАНС ООО','СОЮЗ ЗАСТРОЙЩИКОВ МСК ООО':'СОЮЗ ЗАСТРОЙЩИКОВ МСК ООО','Амунц Александр Дмитриевич':'АМУНЦ АЛЕКСАНДР ДМИТРИЕВИЧ','Малай Максим Александрович':'МАЛАЙ МАКСИМ АЛЕКСАНДРОВИЧ','ИП Васильев Данил Андреевич':'ВАСИЛЬЕВ ДАНИЛА АНДРЕЕВИЧ ИП','Сидорова Ксения Дмитриевна':'СИДОРОВА КСЕНИЯ ДМИТРИЕВНА','Котовская Карина Владимировна':'КОТОВСКАЯ КАРИНА ВЛАДИМИРОВНА','КМТ-СЕРВИС ООО':'КМТ СЕРВИС ООО','ФЕДЕРАЛЬНАЯ ТАМОЖЕННАЯ СЛУЖБА ФГКУ':'ФЕДЕРАЛЬНАЯ ТАМОЖЕННАЯ СЛУЖБА','ГС1 РУС':'ЮНИСКАН/ГС1 РУС','Шерстнева Татьяна Анатольевна':'ШЕРСТНЕВА ТАТЬЯНА АНАТОЛЬЕВНА ИП','ВАКА ООО':'ВАКА ООО','Новосибирское карьероуправление АО':'НОВОСИБИРСКОЕ КАРЬЕРОУПРАВЛЕНИЕ АО','АВТОКОМ ООО':'АВТОКОМ ООО','ГАЛА ООО':'ГК ГАЛА-ПРОДЖЕКТ ООО','АМЕРИАБАНК ЗАО':'АМЕРИАБАНК ЗАО','ИП Соколова Евгения Геннадьевна':'СОКОЛОВА ЕВГЕНИЯ ГЕННАДЬЕВНА ИП','Ромашенко Виктория Владимировна':'РОМАШЕНКО ВИКТОРИЯ ВЛАДИМИРОВНА','Валовая Юлия Игоревна':'ВАЛОВАЯ ЮЛИЯ ИГОРЕВНА','АИ ВЭЙ ООО':'АИ ВЭЙ ООО','Гостев Михаил Алексеевич':'ГОСТЕВ МИХАИЛ АЛЕКСЕЕВИЧ ИП','ПРОАКТИОН ООО':'ПРОАКТИОН ООО','Тимохина Виктория Викторовна':'ТИМОХИНА ВИКТОРИЯ ВИКТОРОВНА ИП','НДЛ ООО':'НДЛ ООО','ПРОГРЕСС-ГРУПП ООО':'ПРОГРЕСС-ГРУПП ООО','Нотариус Булатова Ирина Борисовна':'НОТАРИУС БУЛАТОВА И. Б.','ФЭШН ФЭКТОРИ ШКОЛА ЛЮДМИЛЫ НОРСОЯН ООО':'ФЭШН ФЭКТОРИ ШКОЛА ЛЮДМИЛЫ НОРСОЯН ООО','Переверзев Дмитрий Владимирович':'ПЕРЕВЕРЗЕВ ДМИТРИЙ ВЛАДИМИРОВИЧ','ЭКО НЭЙЧЕР ПРОДАКТС ООО':'ЭКО НЭЙЧЕР ПРОДАКТС ООО','Кузин Максим Евгеньевич':'КУЗИН МАКСИМ ЕВГЕНЬЕВИЧ','ВИИИК ООО':'ВИИИК ООО'
-    
-    }
-    df["cp_name_final"] = df["cp_name"].map(rpls)
-    
-    df['dt'] = df['dt'].fillna(0).astype(float)
-    df['cr'] = df['cr'].fillna(0).astype(float)
-    
-    def find_doc_number(text:str)->str:
-        parts = text.split('от')
-        part:str = parts[0]
-        part = part.replace("Списание с расчетного счета",'').replace('Поступление на расчетный счет','').strip()
-        return part
-    
-    df['doc_type'] = np.where(
-        df['_doc'].str.startswith("Списание"),"Списание","Поступление"
-    )
-    df['doc_numner'] = df['_doc'].apply(find_doc_number)
-    
-    df['doc_numner'] = df['doc_numner'] + '-'+df['dt'].astype(str)+df['cr'].astype(str)
-    
-    df['doc_date'] = df['date']
-    
-    df['date'] = pd.to_datetime(df['date'],dayfirst=True,errors='coerce')
-    
-    df['cp_bs_name'] = df['cp_name_final']
-    
-    df['intercompany'] = np.where(
-        df['cp_name_final'] == 'ТРЕНДСЕТТЕР OOO',True,False
-    )
-    
-    df = apply_intercompany_overrides(
-    df,
-    exclude=INTERCOMPANY_EXCLUDE,
-    include=INTERCOMPANY_INCLUDE,
-)
-    
+}
+
+
+class Analytics(NamedTuple):
+    """Разрезанные ячейки аналитики Дт/Кт одной строки и назначение платежа."""
+    name_dt: str | None
+    contract_dt: str | None
+    justification_dt: str | None
+    name_cr: str | None
+    contract_cr: str | None
+    justification_cr: str | None
+    len_dt: int
+    len_cr: int
+    temp: str | None
+
+
+def _split_analytics(value):
+    """
+    'контрагент\nстатья\nобоснование' -> ([3 части или None], число строк).
+    Число строк считаем только у текстовых ячеек, как раньше .str.split().str.len().
+    """
+    if value is None:
+        return [None, None, None], 0
+    text = value if isinstance(value, str) else str(value)
+    parts = [part.strip() or None for part in text.split("\n", 2)]
+    parts += [None] * (3 - len(parts))
+    return parts, len(text.split("\n")) if isinstance(value, str) else 0
+
+
+def _starts(value, prefix):
+    return value is not None and value.startswith(prefix)
+
+
+def _employee(a: Analytics):
+    m = EMPLOYEE_RX.search(a.temp) if a.temp else None
+    return EMPLOYEES.get(m.group(1)) if m else None
+
+
+# Правила подбора контрагента, по порядку: следующее совпавшее правило перекрывает предыдущее.
+# (условие(аналитика, текущий контрагент), контрагент: строка или функция от аналитики, ИНН или None — не менять)
+RULES = [
+    # внутренние перемещения и конвертация — это мы
+    (lambda a, cp: _starts(a.contract_dt, "Внутреннее") or _starts(a.contract_cr, "Внутреннее"), OWN_NAME, OWN_INN),
+    (lambda a, cp: _starts(a.contract_dt, "Конвертация валюты"), OWN_NAME, OWN_INN),
+    # комиссии банка
+    (lambda a, cp: a.contract_cr == "Расходы на услуги банков", attrgetter("name_cr"), None),
+    # налоги
+    (lambda a, cp: a.contract_cr == "Прочие налоги и сборы" and a.name_dt is None, "ИФНС", "7727406020"),
+    (
+        lambda a, cp: a.contract_cr == "Прочие налоги и сборы" and a.name_dt == "Налог (взносы): начислено / уплачено",
+        "ФСС",
+        "7703363868",
+    ),
+    # перевод сотруднику на карту — только если контрагента ещё нет
+    (lambda a, cp: cp is None, _employee, None),
+    # подотчёт, займы и проценты
+    (lambda a, cp: a.contract_cr == "Выдача подотчетных сумм", attrgetter("name_dt"), None),
+    (
+        lambda a, cp: a.contract_dt in ("Получение кредитов и займов", "Поступления от погашения займов"),
+        attrgetter("name_cr"),
+        None,
+    ),
+    (
+        lambda a, cp: a.contract_cr in ("Погашение кредитов и займов", "Выплата процентов по кредитам и займам"),
+        attrgetter("name_dt"),
+        None,
+    ),
+    (lambda a, cp: _starts(a.name_cr, "Проценты к получению, уплате"), attrgetter("name_dt"), None),
+]
+
+
+def find_counterparty(a: Analytics):
+    """(контрагент как в выписке, ИНН) по аналитике строки."""
+    # контрагент — в той аналитике, где все три части
+    cp_name = a.name_cr if a.len_cr == 3 else a.name_dt if a.len_dt == 3 else None
+    tax_id = None
+
+    for condition, name, inn in RULES:
+        if condition(a, cp_name):
+            cp_name = name(a) if callable(name) else name
+            if inn is not None:
+                tax_id = inn
+
+    return cp_name, tax_id
+
+
+def get_acc(acc: str) -> str:
+    """
+    Счёт из ячейки отбора, банк в ней любой:
+    Отбор: Банковские счета Равно "40702810410000104161, АО "Банк БЖФ""
+    """
+    m = ACC_RX.search(acc)
+    if m:
+        return m.group(1)
+    return acc.replace('Отбор: Банковские счета Равно "', "").split(",")[0].strip()
+
+
+def find_doc_number(text:str)->str:
+    parts = text.split('от')
+    part:str = parts[0]
+    part = part.replace("Списание с расчетного счета",'').replace('Поступление на расчетный счет','').strip()
+    return part
+
+
+def read_xls(filename):
+    """
+    Один потоковый проход по первому листу.
+    Returns:
+        (ячейка со счётом, входящий остаток, строки операций без итоговой)
+    """
+    wb = load_workbook(filename, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        # размеры в read_only берутся из файла и бывают неверными
+        ws.reset_dimensions()
+
+        acc = bb = None
+        rows = []
+        for n, row in enumerate(ws.iter_rows(values_only=True), start=1):
+            if n == ACC_ROW:
+                acc = row[ACC_COL - 1] if len(row) >= ACC_COL else None
+            elif n == BB_ROW:
+                bb = row[BB_COL - 1] if len(row) >= BB_COL else None
+            elif n >= FIRST_ROW and any(v is not None for v in row):
+                rows.append(row + (None,) * (ROW_WIDTH - len(row)))
+    finally:
+        wb.close()
+
+    # последняя строка — итоги
+    return acc, bb, rows[:-1]
+
+
+def adjust_df(filename)->pd.DataFrame:
+    acc, bb, rows = read_xls(filename)
+
+    acc_number = get_acc(acc)
+    bb = float(bb) if isinstance(bb, (int, float)) else bb
+
+    columns = {name: [] for name in ("doc_type", "doc_numner", "doc_date", "dt", "cr", "tax_id", "temp", "cp_bs_name", "intercompany")}
+
+    for row in rows:
+        raw_temp = row[TEMP_COL]
+        doc, sep, temp = ("" if raw_temp is None else str(raw_temp)).partition("\n")
+        doc = doc.strip()
+        temp = temp.strip() if sep else None
+
+        (name_dt, contract_dt, justification_dt), len_dt = _split_analytics(row[ANAL_DT_COL])
+        (name_cr, contract_cr, justification_cr), len_cr = _split_analytics(row[ANAL_CR_COL])
+        cp_name, tax_id = find_counterparty(Analytics(
+            name_dt, contract_dt, justification_dt,
+            name_cr, contract_cr, justification_cr,
+            len_dt, len_cr, temp,
+        ))
+        cp_name_final = COUNTERPARTY_NAMES.get(cp_name)
+
+        dt = float(row[DT_COL] or 0)
+        cr = float(row[CR_COL] or 0)
+
+        columns["doc_type"].append("Списание" if doc.startswith("Списание") else "Поступление")
+        columns["doc_numner"].append(f"{find_doc_number(doc)}-{dt}{cr}")
+        columns["doc_date"].append(row[DATE_COL])
+        columns["dt"].append(dt)
+        columns["cr"].append(cr)
+        columns["tax_id"].append(tax_id)
+        columns["temp"].append(temp)
+        columns["cp_bs_name"].append(cp_name_final)
+        columns["intercompany"].append(cp_name_final == 'ТРЕНДСЕТТЕР OOO')
+
+    df = pd.DataFrame(columns)
+    df["dt"] = df["dt"].astype(float)
+    df["cr"] = df["cr"].astype(float)
+    df['date'] = pd.to_datetime(df['doc_date'],dayfirst=True,errors='coerce')
+    # ручные правки (IntercompanyRule) применяются при записи, см. bsupdater.write_statement
 
-    
-    
     df['payer_account'] = None
     df['reciver_account'] = None
-    
-    # df[["_doc", "temp"]] = (
-    #     df["_temp"]
-    #     .str.split("\n", n=1, expand=True)
-    #     .apply(lambda x: x.str.strip())
-    # )
-    
+
     eb = round(df['dt'].sum() - df['cr'].sum() + bb,0)
     
     
     return df[FIELDS_TO_KEEP],acc_number,df['date'].min(),df['date'].max(),bb,eb
 
 
-''
\ No newline at end of file
+def parse_xlsx(filepath: str, ts_inn=None):
+    return adjust_df(filepath)
+
+
+def read_xlsx_header(filepath: str):
+    """
+    Счёт, период и остатки без разбора операций. Периода в шапке листа нет,
+    поэтому строки всё же проходим, но берём из них только дату и суммы —
+    без аналитики, подбора контрагентов и df. Результат тот же, что у adjust_df.
+    """
+    wb = load_workbook(filepath, read_only=True, data_only=True, keep_links=False)
+    try:
+        ws = wb.worksheets[0]
+        ws.reset_dimensions()
+
+        acc = bb = None
+        dates = []
+        dt_sum = cr_sum = 0.0
+        last = None
+        for n, row in enumerate(ws.iter_rows(values_only=True), start=1):
+            if n == ACC_ROW:
+                acc = row[ACC_COL - 1] if len(row) >= ACC_COL else None
+            elif n == BB_ROW:
+                bb = row[BB_COL - 1] if len(row) >= BB_COL else None
+            elif n >= FIRST_ROW and any(v is not None for v in row):
+                # последняя строка — итоги, поэтому учитываем строку, когда пришла следующая
+                if last is not None:
+                    dates.append(last[DATE_COL])
+                    dt_sum += float(last[DT_COL] or 0)
+                    cr_sum += float(last[CR_COL] or 0)
+                last = row + (None,) * (ROW_WIDTH - len(row))
+    finally:
+        wb.close()
+
+    bb = float(bb) if isinstance(bb, (int, float)) else bb
+    dates = pd.to_datetime(pd.Series(dates, dtype=object), dayfirst=True, errors="coerce")
+    return get_acc(acc), dates.min(), dates.max(), bb, round(dt_sum - cr_sum + bb, 0)
+
+
+def is_xlsx(head: bytes) -> bool:
+    # xlsx — zip-архив; других xlsx-форматов пока нет
+    return head.startswith(b"PK\x03\x04")
+
+
+register(StatementFormat(
+    name="xlsx_1c",
+    title="Excel-выгрузка из 1С (Совкомбанк, БЖФ)",
+    sniff=is_xlsx,
+    parse=parse_xlsx,
+    header=read_xlsx_header,
+    tax_id_by_name=True,
+))